@@ -11,4 +11,28 @@ class Config(object):
     SECRET_KEY = "SUPER_SECRET_KEY"
     JWT_ACCESS_LIFESPAN = {"minutes": 60}
     RESULT_LIMIT = 200
+    # Default page size of paginated endpoints, clients can ask for up to RESULT_LIMIT
+    PAGE_SIZE = 200
+    # Listing thumbnails are resized to fit in a square of this many pixels
+    THUMBNAIL_SIZES = {"small": 160, "medium": 480}
+    # Number of distinct listing searches kept in the result cache
+    SEARCH_CACHE_SIZE = 256
+    # Share of the search trigrams a listing name or address needs for a fuzzy match
+    FUZZY_SEARCH_THRESHOLD = 0.5
+    # Default number of listings returned by /listings/suggest
+    SUGGEST_LIMIT = 10
+    # Rows inserted per statement by the bulk listing import
+    IMPORT_CHUNK_SIZE = 500
+    # Most availabilities a single recurrence rule can create
+    RECURRENCE_SLOT_LIMIT = 5000
+    # Booking holds last at most this long, expired ones are swept in batches
+    HOLD_TTL_SECONDS = 120
+    HOLD_SWEEP_SECONDS = 30
+    HOLD_SWEEP_BATCH = 500
+    # Occupancy calendars cut days into blocks of this many minutes
+    CALENDAR_BLOCK_MINUTES = 30
+    # Longest date range of a single occupancy calendar request
+    CALENDAR_MAX_DAYS = 92
+    # Most free slots per listing returned by /availabilities/batch
+    BATCH_SLOTS_PER_LISTING = 20
     CATEGORIES = ["entertainment", "sport", "accommodation", "healthcare", "other"]
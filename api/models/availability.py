@@ -5,6 +5,25 @@ from api import db
 
 class AvailabilityModel(db.Model):
     __tablename__ = "availabilities"
+    __table_args__ = (
+        # Supports the "free between start_time and end_time" lookups of a listing
+        db.Index(
+            "ix_availabilities_listing_window",
+            "listing_id",
+            "start_time",
+            "end_time",
+            "is_available",
+        ),
+        # Supports the "next free slots of a listing" lookups, in time order
+        db.Index(
+            "ix_availabilities_listing_free",
+            "listing_id",
+            "is_available",
+            "start_time",
+        ),
+        # Splits bookings into past and upcoming and orders them
+        db.Index("ix_availabilities_end_time", "end_time"),
+    )
     availability_id = db.Column(db.Integer, primary_key=True)
     listing_id = db.Column(
         db.Integer, db.ForeignKey("listings.listing_id"), nullable=False
@@ -13,6 +32,9 @@ class AvailabilityModel(db.Model):
     start_time = db.Column(db.Integer)
     end_time = db.Column(db.Integer)
     is_available = db.Column(db.Boolean)
+    # Set when the row is a range of back to back free slots of this many minutes,
+    # a slot is split out of the range when it gets booked
+    slot_minutes = db.Column(db.Integer)
 
     def __repr__(self):
         return json.dumps(self.to_dict())
@@ -24,5 +46,6 @@ class AvailabilityModel(db.Model):
             "start_time": self.start_time,
             "end_time": self.end_time,
             "is_available": self.is_available,
+            "slot_minutes": self.slot_minutes,
         }
         return data
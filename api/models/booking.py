@@ -5,6 +5,10 @@ from api import db
 
 class BookingModel(db.Model):
     __tablename__ = "bookings"
+    __table_args__ = (
+        # The bookings of a user, joined to their availabilities
+        db.Index("ix_bookings_user_availability", "user_id", "availability_id"),
+    )
     booking_id = db.Column(db.Text, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
     listing_id = db.Column(
@@ -0,0 +1,27 @@
+import json
+
+from api import db
+
+
+class BookingHoldModel(db.Model):
+    __tablename__ = "booking_holds"
+    # At most one hold per availability
+    availability_id = db.Column(
+        db.Integer, db.ForeignKey("availabilities.availability_id"), primary_key=True
+    )
+    hold_id = db.Column(db.Text, nullable=False, unique=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
+    # Unix time in ms after which the hold no longer counts
+    expires_at = db.Column(db.Integer, nullable=False, index=True)
+
+    def __repr__(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
+        data = {
+            "hold_id": self.hold_id,
+            "availability_id": self.availability_id,
+            "user_id": self.user_id,
+            "expires_at": self.expires_at,
+        }
+        return data
@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import json
+import re
+
+from api import db
+from api.models.default_avatar import DEFAULT_AVATAR
+from api.models.default_listing_image import DEFAULT_LISTING_IMAGE
+from flask import has_request_context, request
+from sqlalchemy import event
+
+# Images are served from /images/<sha256 of the image bytes>
+IMAGE_URL_PREFIX = "/images/"
+IMAGE_REF_PATTERN = re.compile(r"/images/(?P<image_hash>[0-9a-f]{64})$")
+DATA_URL_PATTERN = re.compile(
+    r"^data:(?P<content_type>[\w.+-]+/[\w.+-]+)?(;[\w.+-]+=[\w.+-]+)*;base64,(?P<data>.*)$",
+    re.DOTALL,
+)
+# svg can run scripts when opened on its own, so only the server's defaults use it
+UNSAFE_IMAGE_TYPES = {"image/svg+xml"}
+
+
+class ImageModel(db.Model):
+    __tablename__ = "images"
+    # Content addressed, the same image is only ever stored once
+    image_hash = db.Column(db.Text, primary_key=True)
+    content_type = db.Column(db.Text, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
+        data = {
+            "image_hash": self.image_hash,
+            "content_type": self.content_type,
+            "size": len(self.data),
+            "url": image_url(image_ref(self.image_hash)),
+        }
+        return data
+
+
+def decode_data_url(value):
+    """
+    Splits a base64 data URL such as data:image/png;base64,iVBOR... into its parts
+    :return: (content_type, image bytes), or None if value is not a base64 data URL
+    """
+    if not isinstance(value, str):
+        return None
+    match = DATA_URL_PATTERN.match(value)
+    if match is None:
+        return None
+    try:
+        data = base64.b64decode(match.group("data"), validate=True)
+    except ValueError:
+        return None
+    content_type = match.group("content_type") or "application/octet-stream"
+    return content_type, data
+
+
+def is_safe_image_type(content_type):
+    """
+    :return: True for the image types a browser only ever renders as an image, so
+        they are safe to upload and serve inline from the API's origin
+    """
+    content_type = content_type.lower()
+    return content_type.startswith("image/") and content_type not in UNSAFE_IMAGE_TYPES
+
+
+def hash_image(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def image_ref(image_hash):
+    """What gets stored in the image columns, e.g. /images/<hash>"""
+    return f"{IMAGE_URL_PREFIX}{image_hash}"
+
+
+def parse_image_ref(value):
+    """Returns the image hash of an image URL created by this API, or None"""
+    if not isinstance(value, str):
+        return None
+    match = IMAGE_REF_PATTERN.search(value)
+    if match is None:
+        return None
+    return match.group("image_hash")
+
+
+def image_url(ref):
+    """
+    Turns a stored /images/<hash> reference into an absolute URL, so that clients on
+    another origin (the frontend) can use it directly as an img src.
+    Anything else that was stored is returned untouched.
+    """
+    if isinstance(ref, str) and ref.startswith(IMAGE_URL_PREFIX):
+        if has_request_context():
+            return f"{request.host_url.rstrip('/')}{ref}"
+    return ref
+
+
+def with_image_url(row, *columns):
+    """Copies a row dict from a raw SQL query with its image columns turned into URLs"""
+    return {**row, **{c: image_url(row[c]) for c in columns if c in row}}
+
+
+# The defaults are stored once, instead of being copied into every row
+DEFAULT_IMAGES = [
+    decode_data_url(DEFAULT_LISTING_IMAGE),
+    decode_data_url(DEFAULT_AVATAR),
+]
+DEFAULT_LISTING_IMAGE_REF = image_ref(hash_image(DEFAULT_IMAGES[0][1]))
+DEFAULT_AVATAR_REF = image_ref(hash_image(DEFAULT_IMAGES[1][1]))
+
+
+@event.listens_for(ImageModel.__table__, "after_create")
+def insert_default_images(target, connection, **kw):
+    connection.execute(
+        target.insert(),
+        [
+            {"image_hash": hash_image(data), "content_type": content_type, "data": data}
+            for content_type, data in DEFAULT_IMAGES
+        ],
+    )
@@ -1,7 +1,14 @@
 import json
 
 from api import db
-from api.models.default_listing_image import DEFAULT_LISTING_IMAGE
+from api.models.image import DEFAULT_LISTING_IMAGE_REF, image_url
+from api.utils.images import (
+    DEFAULT_LISTING_IMAGE_MEDIUM_REF,
+    DEFAULT_LISTING_IMAGE_SMALL_REF,
+)
+
+# Columns holding image references that have to be turned into URLs
+LISTING_IMAGE_COLUMNS = ["listing_image", "listing_image_small", "listing_image_medium"]
 
 
 class ListingModel(db.Model):
@@ -13,7 +20,15 @@ class ListingModel(db.Model):
     description = db.Column(db.Text)
     user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
     username = db.Column(db.Text, db.ForeignKey("users.username"), nullable=False)
-    listing_image = db.Column(db.Text, nullable=True, default=DEFAULT_LISTING_IMAGE)
+    # Reference to the image in the images table, not the image itself
+    listing_image = db.Column(db.Text, nullable=True, default=DEFAULT_LISTING_IMAGE_REF)
+    # Thumbnails of listing_image, made whenever the image changes
+    listing_image_small = db.Column(
+        db.Text, nullable=True, default=DEFAULT_LISTING_IMAGE_SMALL_REF
+    )
+    listing_image_medium = db.Column(
+        db.Text, nullable=True, default=DEFAULT_LISTING_IMAGE_MEDIUM_REF
+    )
 
     def __repr__(self):
         return json.dumps(self.to_dict())
@@ -27,6 +42,25 @@ class ListingModel(db.Model):
             "description": self.description,
             "user_id": self.user_id,
             "username": self.username,
-            "listing_image": self.listing_image,
+            "listing_image": image_url(self.listing_image),
+            "listing_image_small": image_url(self.listing_image_small),
+            "listing_image_medium": image_url(self.listing_image_medium),
         }
         return data
+
+
+LISTING_COLUMNS = [c.name for c in ListingModel.__table__.columns]
+
+
+def as_list_item(listing):
+    """
+    Listing lists send the medium thumbnail as the listing_image,
+    the full size image is only sent by /listings/<listing_id>
+    """
+    if "listing_image" not in listing:
+        return listing
+    return {
+        **listing,
+        "listing_image": listing.get("listing_image_medium")
+        or listing["listing_image"],
+    }
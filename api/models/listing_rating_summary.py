@@ -0,0 +1,38 @@
+import json
+
+from api import db
+
+
+class ListingRatingSummaryModel(db.Model):
+    __tablename__ = "listing_rating_summary"
+    listing_id = db.Column(
+        db.Integer, db.ForeignKey("listings.listing_id"), primary_key=True
+    )
+    rating_count = db.Column(db.Integer, nullable=False, server_default="0")
+    rating_sum = db.Column(db.Integer, nullable=False, server_default="0")
+    avg_rating = db.Column(db.Float, nullable=False, server_default="0")
+    # Histogram of how many times each rating from 1-5 was given
+    rating_1_count = db.Column(db.Integer, nullable=False, server_default="0")
+    rating_2_count = db.Column(db.Integer, nullable=False, server_default="0")
+    rating_3_count = db.Column(db.Integer, nullable=False, server_default="0")
+    rating_4_count = db.Column(db.Integer, nullable=False, server_default="0")
+    rating_5_count = db.Column(db.Integer, nullable=False, server_default="0")
+
+    def __repr__(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
+        data = {
+            "listing_id": self.listing_id,
+            "rating_count": self.rating_count,
+            "rating_sum": self.rating_sum,
+            "avg_rating": self.avg_rating,
+            "histogram": {
+                "1": self.rating_1_count,
+                "2": self.rating_2_count,
+                "3": self.rating_3_count,
+                "4": self.rating_4_count,
+                "5": self.rating_5_count,
+            },
+        }
+        return data
@@ -0,0 +1,12 @@
+from api import db
+
+
+class ListingTrigramModel(db.Model):
+    __tablename__ = "listing_trigrams"
+    # Looked up by trigram first, so it leads the primary key
+    trigram = db.Column(db.Text, primary_key=True)
+    listing_id = db.Column(
+        db.Integer, db.ForeignKey("listings.listing_id"), primary_key=True, index=True
+    )
+    # The listing column the trigram comes from
+    field = db.Column(db.Text, primary_key=True)
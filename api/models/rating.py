@@ -10,6 +10,8 @@ class RatingModel(db.Model):
         db.Text, db.ForeignKey("bookings.booking_id"), nullable=False
     )
     user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), nullable=False)
+    # The listing the rating counts towards in listing_rating_summary
+    listing_id = db.Column(db.Integer, db.ForeignKey("listings.listing_id"))
     rating = db.Column(db.Integer, nullable=False)
     comment = db.Column(db.String)
 
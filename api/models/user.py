@@ -1,9 +1,13 @@
 import json
 
-from api.models.default_avatar import DEFAULT_AVATAR
+from api.models.image import DEFAULT_AVATAR_REF, image_url
 from api import db
 
 
+# The columns that are safe to send to clients
+USER_COLUMNS = ["user_id", "username", "email", "avatar", "user_description"]
+
+
 class UserModel(db.Model):
     __tablename__ = "users"
     user_id = db.Column(db.Integer, primary_key=True)
@@ -11,7 +15,8 @@ class UserModel(db.Model):
     email = db.Column(db.Text, unique=True)
     password_hash = db.Column(db.Text)
     authenticated = db.Column(db.Boolean, default=False)
-    avatar = db.Column(db.Text, nullable=True, default=DEFAULT_AVATAR)
+    # Reference to the image in the images table, not the image itself
+    avatar = db.Column(db.Text, nullable=True, default=DEFAULT_AVATAR_REF)
     user_description = db.Column(db.Text, nullable=True, default="")
 
     # See: https://realpython.com/using-flask-login-for-user-management-with-flask/
@@ -39,7 +44,7 @@ class UserModel(db.Model):
             "user_id": self.user_id,
             "username": self.username,
             "email": self.email,
-            "avatar": self.avatar,
+            "avatar": image_url(self.avatar),
             "user_description": self.user_description,
         }
         return data
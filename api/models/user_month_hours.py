@@ -0,0 +1,24 @@
+import json
+
+from api import db
+
+
+class UserMonthHoursModel(db.Model):
+    __tablename__ = "user_month_hours"
+    user_id = db.Column(db.Integer, db.ForeignKey("users.user_id"), primary_key=True)
+    # Calendar month of the start of the booked slots, in server local time
+    year = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Integer, primary_key=True)
+    hours = db.Column(db.Integer, nullable=False, server_default="0")
+
+    def __repr__(self):
+        return json.dumps(self.to_dict())
+
+    def to_dict(self):
+        data = {
+            "user_id": self.user_id,
+            "year": self.year,
+            "month": self.month,
+            "hours": self.hours,
+        }
+        return data
@@ -1,4 +1,6 @@
 from api import engine
+from api.models.image import with_image_url
+from api.models.listing import LISTING_IMAGE_COLUMNS, as_list_item
 
 
 def get_top_rated_listings(n_listings: int = 5):
@@ -10,23 +12,17 @@ def get_top_rated_listings(n_listings: int = 5):
     query_text = f"""
     select
         l.*,
-        r.avg_rating
+        case when s.rating_count > 0 then s.avg_rating end as avg_rating
     from listings as l
-    left join
-        (
-            select
-                b.listing_id,
-                avg(r.rating) as avg_rating
-            from ratings as r
-            join bookings as b
-                on b.booking_id = r.booking_id 
-            group by b.listing_id
-        ) as r
-        on r.listing_id = l.listing_id 
-    order by r.avg_rating desc
+    left join listing_rating_summary as s
+        on s.listing_id = l.listing_id
+    order by s.avg_rating desc
     limit {n_listings} 
     """
     with engine.connect() as conn:
         results = conn.execute(query_text)
-        top_listings = [dict(r) for r in results]
+        top_listings = [
+            as_list_item(with_image_url(dict(r), *LISTING_IMAGE_COLUMNS))
+            for r in results
+        ]
         return {"listings": top_listings}
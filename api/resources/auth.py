@@ -4,10 +4,9 @@ import logging
 
 from api import db, login_manager
 from api.config import Config
-from api.models.availability import AvailabilityModel
-from api.models.booking import BookingModel
 from api.models.user import UserModel
 from api.resources.utils import *
+from api.utils.booked_hours import get_booked_hours
 from api.utils.req_handling import *
 from flask_login import login_user, logout_user, login_required, current_user
 from flask_restplus import Resource, fields
@@ -31,11 +30,6 @@ login_details_request = api.api.model(
     },
 )
 
-# start time vs end time
-def start_vs_end(end, start):
-    interval = round((float(end) - float(start)) / (60.0 * 60.0 * 1000.0))
-    return int(interval)
-
 
 @auth.route("/login")
 @auth.response(404, "User not found")
@@ -112,28 +106,8 @@ class AuthMe(Resource):
         try:
             logging.info(current_user)
             get_user_dict = current_user.to_dict()
-            # get existing bookings
-            list_bookings = BookingModel.query.filter_by(
-                user_id=get_user_dict["user_id"]
-            ).all()
-            list_bookings = [l.to_dict() for l in list_bookings]
-            hours_booked = 0
-            # Search through the existing bookings
-            for i in range(len(list_bookings)):
-                timeslot = AvailabilityModel.query.get_or_404(
-                    list_bookings[i]["availability_id"]
-                ).to_dict()
-                get_interval = start_vs_end(
-                    timeslot["end_time"], timeslot["start_time"]
-                )
-                booking_month = datetime.fromtimestamp(
-                    timeslot["start_time"] / 1000
-                ).strftime("%m")
-                current_month = datetime.now().strftime("%m")
-                if booking_month == current_month:
-                    hours_booked += get_interval
-
-            get_user_dict["hours_booked"] = hours_booked
+            # Hours booked this month come straight from the ledger
+            get_user_dict["hours_booked"] = get_booked_hours(get_user_dict["user_id"])
 
             # Who I'm following
             followees = find_followees(current_user.user_id)
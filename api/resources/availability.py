@@ -1,14 +1,31 @@
 import logging
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from api import db
 from api.models.listing import ListingModel
 from api.utils.req_handling import *
 from flask_login import current_user
 from flask_restplus import Resource, fields
 from sqlalchemy.orm.attributes import flag_modified
+from sqlalchemy.sql import bindparam, text
 from api.models.availability import AvailabilityModel
+from api.models.booking import BookingModel
+from api.models.booking_hold import BookingHoldModel
+from api.config import Config
+from api.search.availability_index import availability_index
+from api.search.occupancy_calendar import CALENDAR_LEGEND, occupancy_calendar
+from api.utils.availability_ranges import (
+    check_slot_times,
+    compact_availabilities,
+    merge_runs,
+    range_slots,
+)
+from api.utils.booked_hours import add_booked_hours, remove_booked_hours
+from api.utils.recurrence import drop_overlapping, expand_recurrence, parse_recurrence
 import api
 
+# end_time of a window with no end, later than any availability
+NO_END_TIME = 2 ** 62
+
 availability = api.api.namespace(
     "availabilities", description="availability operations"
 )
@@ -31,10 +48,163 @@ availability_details = api.api.model(
         "is_available": fields.Boolean(
             required=True, description="Resource is available or not"
         ),
+        "slot_minutes": fields.Integer(
+            required=False,
+            description="Stores start_time to end_time as a range of free slots of this many minutes",
+        ),
     },
 )
 
 
+def find_overlap(availability_id):
+    """
+    Finds another availability of the same listing overlapping this one, after it was
+    written on db.session so two overlapping slots can't be created at the same time.
+    The slots of a listing don't overlap each other, so only the one starting last
+    before this one ends can overlap it, one lookup on ix_availabilities_listing_window.
+    :param availability_id: The availability just created or changed
+    :return: availability_id of an overlapping slot, or None
+    """
+    overlap = db.session.execute(
+        text(
+            """
+            select other.availability_id, other.end_time > a.start_time as overlaps
+            from availabilities as a
+            join availabilities as other
+                on other.listing_id = a.listing_id
+            where
+                a.availability_id = :availability_id
+                and other.availability_id != a.availability_id
+                and other.start_time < a.end_time
+            order by other.start_time desc
+            limit 1
+            """
+        ),
+        {"availability_id": availability_id},
+    ).first()
+    if overlap is None or not overlap.overlaps:
+        return None
+    return overlap.availability_id
+
+
+def next_free_slots(listing_id, after, limit):
+    """
+    The next free slots of a listing in time order, ranges are cut into their slots
+    :param listing_id: The listing
+    :param after: Only slots starting at or after this unix time in ms
+    :param limit: Number of slots wanted
+    :return: (list of slots, end_time of the last one if there are more, else None)
+    """
+    free = AvailabilityModel.query.filter(
+        AvailabilityModel.listing_id == listing_id
+    ).filter(AvailabilityModel.is_available == True)
+    # Slots don't overlap, so only the last one starting before `after` can be a
+    # range still running at `after`
+    rows = (
+        free.filter(AvailabilityModel.start_time < after)
+        .order_by(AvailabilityModel.start_time.desc())
+        .limit(1)
+        .all()
+    )
+    rows = [a for a in rows if a.slot_minutes and a.end_time > after]
+    # Every row holds at least one slot
+    rows += (
+        free.filter(AvailabilityModel.start_time >= after)
+        .order_by(AvailabilityModel.start_time)
+        .limit(limit + 1)
+        .all()
+    )
+
+    slots = []
+    for a in rows:
+        a = a.to_dict()
+        for start, end in range_slots(
+            a["start_time"], a["end_time"], a["slot_minutes"], after=after
+        ):
+            if start >= after:
+                slots.append({**a, "start_time": start, "end_time": end})
+            if len(slots) > limit:
+                return slots[:limit], slots[limit - 1]["end_time"]
+    return slots, None
+
+
+def free_slots_by_listing(listing_ids, start_time, end_time, limit):
+    """
+    The first free slots of many listings inside a time window, from one query
+    :param listing_ids: The listings
+    :param start_time: Start of the window in unix time ms
+    :param end_time: End of the window in unix time ms
+    :param limit: Most slots per listing
+    :return: (dict of listing_id to its slots, dict of listing_id to the end_time of
+        its last slot for the listings that have more)
+    """
+    rows = db.session.execute(
+        text(
+            """
+            select availability_id, listing_id, start_time, end_time, is_available, slot_minutes
+            from (
+                select
+                    a.*,
+                    row_number() over (
+                        partition by a.listing_id order by a.start_time
+                    ) as n
+                from (
+                    select
+                        a.*,
+                        coalesce(
+                            a.slot_minutes * 60000, a.end_time - a.start_time
+                        ) as slot_length
+                    from availabilities as a
+                    where
+                        a.listing_id in :listing_ids
+                        and a.is_available = 1
+                        and a.start_time < :end_time
+                        and a.end_time > :start_time
+                ) as a
+                where
+                    -- Only rows whose first slot starting in the window also ends in
+                    -- it are counted, rows straddling the window hold no slot
+                    max(
+                        a.start_time,
+                        a.start_time
+                            + (:start_time - a.start_time + a.slot_length - 1)
+                            / a.slot_length * a.slot_length
+                    ) + a.slot_length <= min(a.end_time, :end_time)
+            )
+            where n <= :limit + 1
+            order by listing_id, start_time
+            """
+        ).bindparams(bindparam("listing_ids", expanding=True)),
+        {
+            "listing_ids": listing_ids,
+            "start_time": start_time,
+            "end_time": end_time,
+            "limit": limit,
+        },
+    )
+
+    # Every row left holds at least one slot, so limit + 1 rows tell whether there are more
+    slots = {listing_id: [] for listing_id in listing_ids}
+    for a in rows:
+        a = dict(a)
+        a["is_available"] = bool(a["is_available"])
+        listing_slots = slots[a["listing_id"]]
+        for start, end in range_slots(
+            a["start_time"], a["end_time"], a["slot_minutes"], after=start_time
+        ):
+            if len(listing_slots) > limit or end > end_time:
+                break
+            if start >= start_time:
+                listing_slots.append({**a, "start_time": start, "end_time": end})
+
+    next_after = {}
+    for listing_id, listing_slots in slots.items():
+        if len(listing_slots) > limit:
+            del listing_slots[limit:]
+            next_after[listing_id] = listing_slots[-1]["end_time"]
+    return slots, next_after
+
+
 # See example: https://github.com/noirbizarre/flask-restplus/blob/master/examples/todo.py
 @availability.route("/<int:availability_id>")
 @availability.param("availability_id", "The availability identifier")
@@ -54,8 +224,16 @@ class Availability(Resource):
         a = AvailabilityModel.query.filter(
             AvailabilityModel.availability_id == availability_id
         )
+        listing_ids = [r.listing_id for r in a]
+        # Bookings of a deleted slot stop counting towards their monthly quota
+        for r in a:
+            for b in BookingModel.query.filter_by(availability_id=r.availability_id):
+                remove_booked_hours(b.user_id, r.start_time, r.end_time)
+        # Holds go with the slot, its id can be given to a new slot later
+        BookingHoldModel.query.filter_by(availability_id=availability_id).delete()
         a.delete()
         db.session.commit()
+        availability_index.refresh(*listing_ids)
         return a, 204
 
     @availability.doc(description=f"availability_id must be provided")
@@ -66,17 +244,50 @@ class Availability(Resource):
         # get availability id
         content = get_request_json()
         a = AvailabilityModel.query.get_or_404(availability_id)
-        # update the availability data
-        a.listing_id = content["listing_id"]
-        a.start_time = content["start_time"]
-        a.end_time = content["end_time"]
-        a.is_available = content["is_available"]
-        flag_modified(a, "start_time")
-        flag_modified(a, "end_time")
-        flag_modified(a, "is_available")
-        db.session.merge(a)
-        db.session.flush()
-        db.session.commit()
+        # Check the whole payload before anything is written
+        try:
+            listing_id = int(content["listing_id"])
+            start_time = int(content["start_time"])
+            end_time = int(content["end_time"])
+            is_available = bool(content["is_available"])
+            slot_minutes = content.get("slot_minutes", a.slot_minutes)
+            check_slot_times(start_time, end_time, slot_minutes)
+        except (KeyError, TypeError, ValueError) as e:
+            api.api.abort(400, f"Bad availability: {e}")
+
+        old_listing_id = a.listing_id
+        try:
+            # Bookings of this slot are counted again with its new times
+            bookings = BookingModel.query.filter_by(
+                availability_id=availability_id
+            ).all()
+            for b in bookings:
+                remove_booked_hours(b.user_id, a.start_time, a.end_time)
+            # update the availability data
+            a.listing_id = listing_id
+            a.start_time = start_time
+            a.end_time = end_time
+            a.is_available = is_available
+            a.slot_minutes = slot_minutes
+            flag_modified(a, "start_time")
+            flag_modified(a, "end_time")
+            flag_modified(a, "is_available")
+            for b in bookings:
+                add_booked_hours(b.user_id, a.start_time, a.end_time)
+            db.session.merge(a)
+            db.session.flush()
+            overlap = find_overlap(availability_id)
+            if overlap is not None:
+                raise AvailabilityOverlaps(overlap)
+            db.session.commit()
+        except AvailabilityOverlaps as e:
+            db.session.rollback()
+            api.api.abort(409, e.message)
+        except Exception as e:
+            logging.error(e)
+            db.session.rollback()
+            api.api.abort(500, f"{e}")
+        availability_index.refresh(old_listing_id, a.listing_id)
         return a
 
 
@@ -88,6 +299,11 @@ class AvailabilityList(Resource):
     def post(self):
         logging.info("Registering a availability")
         content = get_request_json()
+        slot_minutes = content.get("slot_minutes")
+        try:
+            check_slot_times(content["start_time"], content["end_time"], slot_minutes)
+        except (KeyError, TypeError, ValueError) as e:
+            api.api.abort(400, f"{e}")
         try:
             # Receive contents from request
             logging.info(content)
@@ -112,35 +328,334 @@ class AvailabilityList(Resource):
                 start_time=start_time,
                 end_time=end_time,
                 is_available=True,
+                slot_minutes=slot_minutes,
             )
             db.session.add(a)
+            db.session.flush()
+            overlap = find_overlap(a.availability_id)
+            if overlap is not None:
+                raise AvailabilityOverlaps(overlap)
             db.session.commit()
             availability_id = a.availability_id
+            availability_index.refresh(listing_id)
             logging.info(f"availability_id created: {availability_id}")
 
             # Return what you just created
             a = AvailabilityModel.query.get_or_404(availability_id).to_dict()
             return a
 
+        except AvailabilityOverlaps as e:
+            db.session.rollback()
+            api.api.abort(409, e.message)
+
         except Exception as e:
             logging.error(e)
             api.api.abort(500, f"{e}")
 
     @availability.doc(
-        description=f"Returns a list of availabilities given a listing_id. For example: /availabilities?listing_id=1."
+        description=f"Returns a list of availabilities given a listing_id. For example: /availabilities?listing_id=1. "
+        "Ranges are listed slot by slot, book one with the availability_id and start_time of the slot."
     )
     @availability.param(
         "listing_id", "The listing_id you want to search availabilities for"
     )
+    @availability.param(
+        "after",
+        "Only return the free slots starting at or after this unix time, in time order",
+    )
+    @availability.param(
+        "limit",
+        f"Number of free slots to return, at most {Config.RESULT_LIMIT}. "
+        "Pass next_after as after to get the following ones.",
+    )
     def get(self):
         listing_id = request.args.get("listing_id")
         logging.info(f"Searching for availabilities under listing_id: {listing_id}")
+        now = int(datetime.now().strftime("%s")) * 1000
+        after = get_request_arg("after", int)
+        limit = get_request_arg("limit", int)
+        if after is not None or limit is not None:
+            limit = Config.PAGE_SIZE if limit is None else limit
+            if limit < 1:
+                api.api.abort(400, "Query parameter 'limit' must be at least 1")
+            slots, next_after = next_free_slots(
+                listing_id,
+                now if after is None else after,
+                min(limit, Config.RESULT_LIMIT),
+            )
+            return {"availabilities": slots, "next_after": next_after}
+
         availabilities = (
             AvailabilityModel.query.filter(AvailabilityModel.listing_id == listing_id)
-            .filter(
-                AvailabilityModel.end_time >= int(datetime.now().strftime("%s")) * 1000
-            )
+            .filter(AvailabilityModel.end_time >= now)
+            .order_by(AvailabilityModel.start_time)
             .all()
         )
-        search_results = [a.to_dict() for a in availabilities]
+        search_results = []
+        for a in availabilities:
+            a = a.to_dict()
+            if a["slot_minutes"] is None:
+                search_results.append(a)
+                continue
+            search_results.extend(
+                {**a, "start_time": start, "end_time": end}
+                for start, end in range_slots(
+                    a["start_time"], a["end_time"], a["slot_minutes"], after=now
+                )
+            )
         return {"availabilities": search_results}
+
+
+@availability.route("/recurring")
+class RecurringAvailabilityList(Resource):
+    @availability.doc(
+        description=f"Creates the availabilities of a recurrence rule in one go, "
+        "for example weekdays 9-17 in 1h blocks for 3 months. "
+        "Slots overlapping existing availabilities of the listing are skipped. "
+        "With as_ranges set back to back slots are stored as one range."
+    )
+    def post(self):
+        content = get_request_json()
+        try:
+            listing_id = content["listing_id"]
+            rule = parse_recurrence(content)
+            slots = expand_recurrence(rule)
+        except (KeyError, ValueError) as e:
+            api.api.abort(400, f"{e}")
+
+        listing = ListingModel.query.get_or_404(listing_id)
+        try:
+            if listing.user_id != current_user.user_id:
+                raise NotListingOwner()
+            if len(slots) == 0:
+                return {"created": [], "skipped": []}
+
+            # Existing slots in the same time range, one query over the listing window index
+            existing = (
+                db.session.query(
+                    AvailabilityModel.start_time, AvailabilityModel.end_time
+                )
+                .filter(AvailabilityModel.listing_id == listing_id)
+                .filter(AvailabilityModel.start_time < slots[-1][1])
+                .filter(AvailabilityModel.end_time > slots[0][0])
+                .order_by(AvailabilityModel.start_time)
+                .all()
+            )
+            free, overlapping = drop_overlapping(slots, existing)
+            rows = [(start, end, None) for start, end in free]
+            if content.get("as_ranges"):
+                rows = [
+                    (
+                        run[0][1],
+                        run[-1][2],
+                        rule["slot_minutes"] if len(run) > 1 else None,
+                    )
+                    for run in merge_runs([(None, s, e, None) for s, e in free])
+                ]
+
+            # One batched insert for every new slot
+            if len(rows) > 0:
+                db.session.execute(
+                    AvailabilityModel.__table__.insert(),
+                    [
+                        {
+                            "listing_id": listing_id,
+                            "start_time": start,
+                            "end_time": end,
+                            "is_available": True,
+                            "slot_minutes": slot_minutes,
+                        }
+                        for start, end, slot_minutes in rows
+                    ],
+                )
+            db.session.commit()
+            availability_index.refresh(listing_id)
+            logging.info(
+                f"Created {len(free)} recurring availabilities on {listing_id}"
+            )
+
+            # One range scan over the listing window index, the rows in between that
+            # already existed are left out
+            starts = {s for s, _, _ in rows}
+            created = (
+                [
+                    a
+                    for a in AvailabilityModel.query.filter(
+                        AvailabilityModel.listing_id == listing_id
+                    )
+                    .filter(AvailabilityModel.start_time >= rows[0][0])
+                    .filter(AvailabilityModel.start_time <= rows[-1][0])
+                    .order_by(AvailabilityModel.start_time)
+                    if a.start_time in starts
+                ]
+                if len(rows) > 0
+                else []
+            )
+            return {
+                "created": [a.to_dict() for a in created],
+                "skipped": [{"start_time": s, "end_time": e} for s, e in overlapping],
+            }
+
+        except NotListingOwner as e:
+            return {"error": e.message}, 403
+
+        except Exception as e:
+            logging.error(e)
+            api.api.abort(500, f"{e}")
+
+
+@availability.route("/batch")
+class AvailabilityBatch(Resource):
+    @availability.doc(
+        description=f"Returns the free slots of many listings inside a time window in one go, "
+        f"for example /availabilities/batch?listing_ids=1,2,3&start_time=...&end_time=... "
+        f"At most {Config.BATCH_SLOTS_PER_LISTING} slots per listing, in time order. "
+        "Listings with more have a next_after to use as start_time."
+    )
+    @availability.param(
+        "listing_ids",
+        f"Comma separated listing_ids, at most {Config.RESULT_LIMIT}",
+    )
+    @availability.param(
+        "start_time", "Start of the window in unix time, defaults to now"
+    )
+    @availability.param("end_time", "End of the window in unix time, no end by default")
+    @availability.param(
+        "limit",
+        f"Slots per listing, at most {Config.BATCH_SLOTS_PER_LISTING}",
+    )
+    def get(self):
+        try:
+            listing_ids = list(
+                dict.fromkeys(int(i) for i in request.args["listing_ids"].split(","))
+            )
+        except (KeyError, ValueError):
+            api.api.abort(400, "Expected comma separated listing_ids")
+        if len(listing_ids) > Config.RESULT_LIMIT:
+            api.api.abort(400, f"At most {Config.RESULT_LIMIT} listing_ids per batch")
+        start_time = get_request_arg(
+            "start_time", int, default=int(datetime.now().strftime("%s")) * 1000
+        )
+        end_time = get_request_arg("end_time", int, default=NO_END_TIME)
+        limit = get_request_arg("limit", int, default=Config.BATCH_SLOTS_PER_LISTING)
+        if limit < 1:
+            api.api.abort(400, "Query parameter 'limit' must be at least 1")
+        limit = min(limit, Config.BATCH_SLOTS_PER_LISTING)
+
+        try:
+            slots, next_after = free_slots_by_listing(
+                listing_ids, start_time, end_time, limit
+            )
+            return {"availabilities": slots, "next_after": next_after}
+        except Exception as e:
+            logging.error(e)
+            api.api.abort(500, f"{e}")
+
+
+@availability.route("/compact")
+class AvailabilityCompaction(Resource):
+    @availability.doc(
+        description=f"Merges the adjacent free slots of your listings into ranges, "
+        "or of a single listing with listing_id. Booked and held slots are left alone."
+    )
+    def post(self):
+        content = request.get_json(silent=True) or {}
+        listing_ids = [
+            l.listing_id
+            for l in ListingModel.query.filter_by(user_id=current_user.user_id)
+        ]
+        try:
+            if content.get("listing_id") is not None:
+                if content["listing_id"] not in listing_ids:
+                    raise NotListingOwner()
+                listing_ids = [content["listing_id"]]
+            if len(listing_ids) == 0:
+                return {"before": 0, "after": 0}
+            counts = compact_availabilities(listing_ids)
+            if counts is None:
+                raise AvailabilitiesChanged()
+            availability_index.refresh(*listing_ids)
+            return counts
+
+        except NotListingOwner as e:
+            return {"error": e.message}, 403
+
+        except AvailabilitiesChanged as e:
+            return {"error": e.message}, 409
+
+        except Exception as e:
+            logging.error(e)
+            db.session.rollback()
+            api.api.abort(500, f"{e}")
+
+
+@availability.route("/calendar")
+class OccupancyCalendar(Resource):
+    @availability.doc(
+        description=f"Returns the occupancy of a listing per day, "
+        f"for example: /availabilities/calendar?listing_id=1&start_date=2021-07-01&end_date=2021-07-31. "
+        f"Each day is cut into blocks of {Config.CALENDAR_BLOCK_MINUTES} minutes and run-length encoded, "
+        f"18.4F2B24. is 18 blocks without availability, 4 free, 2 booked and 24 without availability."
+    )
+    @availability.param("listing_id", "The listing you want the calendar of")
+    @availability.param("start_date", "First day of the calendar, YYYY-MM-DD")
+    @availability.param(
+        "end_date",
+        f"Last day of the calendar, YYYY-MM-DD, at most {Config.CALENDAR_MAX_DAYS} days after start_date",
+    )
+    def get(self):
+        try:
+            listing_id = int(request.args["listing_id"])
+            start_date = date.fromisoformat(request.args["start_date"])
+            end_date = date.fromisoformat(request.args["end_date"])
+        except (KeyError, ValueError) as e:
+            api.api.abort(400, f"Bad calendar request: {e}")
+        if end_date < start_date:
+            api.api.abort(400, "end_date is before start_date")
+        if end_date - start_date >= timedelta(days=Config.CALENDAR_MAX_DAYS):
+            api.api.abort(
+                400, f"Calendars span at most {Config.CALENDAR_MAX_DAYS} days"
+            )
+        ListingModel.query.get_or_404(listing_id)
+
+        try:
+            return {
+                "listing_id": listing_id,
+                "block_minutes": occupancy_calendar.block_minutes,
+                "legend": CALENDAR_LEGEND,
+                "days": occupancy_calendar.days(listing_id, start_date, end_date),
+            }
+        except Exception as e:
+            logging.error(e)
+            api.api.abort(500, f"{e}")
+
+
+# Exceptions
+class NotListingOwner(Exception):
+    """
+    Raised when someone other than the owner creates availabilities of a listing
+    """
+
+    def __init__(self):
+        self.message = "You are not the owner, can't create availability"
+        super().__init__(self.message)
+
+
+class AvailabilityOverlaps(Exception):
+    """
+    Raised when an availability overlaps another one of the same listing
+    """
+
+    def __init__(self, availability_id):
+        self.message = f"Overlaps availability_id {availability_id} of the listing"
+        super().__init__(self.message)
+
+
+class AvailabilitiesChanged(Exception):
+    """
+    Raised when availabilities are booked, held or edited while they are compacted
+    """
+
+    def __init__(self):
+        self.message = "Availabilities changed while compacting, try again"
+        super().__init__(self.message)
@@ -4,14 +4,31 @@ import uuid
 from datetime import datetime, timezone
 from api import db
 from api.models.availability import AvailabilityModel
-from api.models.listing import ListingModel
+from api.search.availability_index import availability_index
+from api.utils.availability_ranges import split_range
+from api.utils.booked_hours import (
+    MAX_HOURS_PER_MONTH,
+    add_booked_hours,
+    get_booked_hours,
+    get_booked_hours_by_month,
+    month_of,
+    remove_booked_hours,
+    slot_hours,
+)
+from api.models.image import with_image_url
+from api.models.listing import LISTING_IMAGE_COLUMNS, ListingModel, as_list_item
 from api.models.booking import BookingModel
+from api.models.booking_hold import BookingHoldModel
 from api.models.rating import RatingModel
+from api.utils.holds import acquire_hold, now_ms, release_hold, take_hold
+from api.utils.pagination import decode_cursor, get_page_args, split_page
+from api.utils.rating_summary import delete_booking_ratings
 from api.utils.req_handling import *
 from flask_login import current_user
 from flask_restplus import Resource, fields
 from sqlalchemy.orm.attributes import flag_modified
-from sqlalchemy.sql import select
+from sqlalchemy import and_, exists
+from sqlalchemy.sql import select, text
 from api import engine
 import api
 
@@ -28,6 +45,10 @@ create_booking_details = api.api.model(
             required=True,
             description="The availability_id linked to the availabilities table",
         ),
+        "start_time": fields.Integer(
+            required=False,
+            description="The start_time of the slot to book when the availability is a range, its first slot by default",
+        ),
     },
 )
 
@@ -48,6 +69,63 @@ get_booking_details = api.api.model(
     },
 )
 
+batch_booking_details = api.api.model(
+    "batch_booking",
+    {
+        "availability_ids": fields.List(
+            fields.Integer,
+            required=True,
+            description="The availability_ids to book, all of them or none",
+        ),
+    },
+)
+
+hold_details = api.api.model(
+    "hold",
+    {
+        "availability_id": fields.Integer(
+            required=True, description="The availability_id to hold"
+        ),
+        "start_time": fields.Integer(
+            required=False,
+            description="The start_time of the slot to hold when the availability is a range, its first slot by default",
+        ),
+        "ttl_seconds": fields.Integer(
+            required=False,
+            description="How long to hold it for, at most the server maximum which is also the default",
+        ),
+    },
+)
+
+
+# Fields of /bookings/mybookings and the column each one is read from
+MY_BOOKING_COLUMNS = {
+    "booking_id": "b.booking_id",
+    "user_id": "b.user_id",
+    "listing_id": "b.listing_id",
+    "availability_id": "b.availability_id",
+    "listing_name": "l.listing_name",
+    "address": "l.address",
+    "category": "l.category",
+    "description": "l.description",
+    "username": "l.username",
+    "listing_image": "l.listing_image",
+    "listing_image_small": "l.listing_image_small",
+    "listing_image_medium": "l.listing_image_medium",
+    "start_time": "a.start_time",
+    "end_time": "a.end_time",
+    "is_available": "a.is_available",
+    "rating_id": "r.rating_id",
+    "rating": "r.rating",
+    "comment": "r.comment",
+}
+
+# Sections of /bookings/mybookings, how each one filters and orders by end_time
+MY_BOOKING_SECTIONS = {
+    "past": ("<", "desc"),
+    "upcoming": (">=", "asc"),
+}
+
 
 # Current time vs start time
 def start_vs_current(start, current):
@@ -55,10 +133,88 @@ def start_vs_current(start, current):
     return int(interval)
 
 
-# start time vs end time
-def start_vs_end(end, start):
-    interval = round((float(end) - float(start)) / (60.0 * 60.0 * 1000.0))
-    return int(interval)
+def claim_availability(availability_id, user_id):
+    """
+    Marks an availability as taken if, and only if, it is still available and nobody
+    else holds it. It is a single conditional UPDATE, so two requests can never both
+    get the same slot.
+    :param availability_id: The availability to claim
+    :param user_id: The user claiming it, their own hold does not stop them
+    :return: True if this transaction got the slot
+    """
+    result = db.session.execute(
+        text(
+            """
+            update availabilities
+            set is_available = 0
+            where
+                availability_id = :availability_id
+                and is_available = 1
+                and slot_minutes is null
+                and not exists (
+                    select 1
+                    from booking_holds as h
+                    where
+                        h.availability_id = availabilities.availability_id
+                        and h.expires_at > :now
+                        and h.user_id != :user_id
+                )
+            """
+        ),
+        {"availability_id": availability_id, "user_id": user_id, "now": now_ms()},
+    )
+    return result.rowcount == 1
+
+
+def take_range_slot(a, start_time):
+    """
+    Splits the slot at start_time out of a range on db.session
+    :param a: The AvailabilityModel of the range
+    :param start_time: Start of the slot, None for the first slot of the range
+    :return: availability_id of the slot
+    :raises SlotNotInRange: If start_time is not a slot of the range
+    :raises AvailabilityIdNotAvailable: If the range changed in the meantime
+    """
+    try:
+        availability_id = split_range(a, start_time)
+    except ValueError as e:
+        raise SlotNotInRange(f"{e}")
+    if availability_id is None:
+        raise AvailabilityIdNotAvailable(a.availability_id)
+    return availability_id
+
+
+def create_booking(user_id, listing_id, a, start_time=None):
+    """
+    Books an availability on db.session, the caller commits or rolls back
+    :param user_id: The user making the booking
+    :param listing_id: The listing booked
+    :param a: The AvailabilityModel booked
+    :param start_time: The slot to book when the availability is a range, None for
+        its first slot
+    :return: The new BookingModel
+    :raises AvailabilityIdNotAvailable: If someone else has the slot
+    :raises BookedMoreThan10HoursPerMonth: If the slot takes the user over the quota
+    :raises SlotNotInRange: If start_time is not a slot of the range
+    """
+    if a.slot_minutes:
+        # `a` is reloaded as the slot split out of the range
+        take_range_slot(a, start_time)
+    if not claim_availability(a.availability_id, user_id):
+        raise AvailabilityIdNotAvailable(a.availability_id)
+    # The ledger row is written before it is checked, so concurrent bookings of the
+    # same user wait on each other instead of both passing the check
+    add_booked_hours(user_id, a.start_time, a.end_time)
+    if get_booked_hours(user_id, a.start_time) > MAX_HOURS_PER_MONTH:
+        raise BookedMoreThan10HoursPerMonth()
+    b = BookingModel(
+        booking_id=str(uuid.uuid4()),
+        user_id=user_id,
+        listing_id=listing_id,
+        availability_id=a.availability_id,
+    )
+    db.session.add(b)
+    return b
 
 
 # See example: https://github.com/noirbizarre/flask-restplus/blob/master/examples/todo.py
@@ -93,8 +249,12 @@ class Booking(Resource):
             flag_modified(a, "availability_id")
             db.session.merge(a)
             db.session.flush()
+            remove_booked_hours(b.user_id, a.start_time, a.end_time)
+            # Ratings of a cancelled booking go too, with their part of the summary
+            delete_booking_ratings(booking_id)
             b1.delete()
             db.session.commit()
+            availability_index.refresh(a.listing_id)
             return b1, 204
 
         except BookedMoreThan10HoursPerMonth as e:
@@ -117,13 +277,14 @@ class Booking(Resource):
         # get booking id
         content = get_request_json()
         try:
+            new_avail = AvailabilityModel.query.get_or_404(content["availability_id"])
+            if new_avail.slot_minutes:
+                content["availability_id"] = take_range_slot(
+                    new_avail, content.get("start_time")
+                )
             new_time = AvailabilityModel.query.get_or_404(
                 content["availability_id"]
             ).to_dict()
-
-            new_time_month = datetime.fromtimestamp(
-                new_time["start_time"] / 1000
-            ).strftime("%m")
             b = BookingModel.query.get_or_404(booking_id).to_dict()
             old_time = AvailabilityModel.query.get_or_404(
                 b["availability_id"]
@@ -133,32 +294,27 @@ class Booking(Resource):
             if (start_vs_current(old_time["start_time"], current_unixtime)) < 72:
                 raise CannotUpdateLessThan3DaysOfBooking
             # New booking cannot allow a user more than 10 hours in a month - note that this is based on the consumer
-            list_bookings = BookingModel.query.filter_by(
-                user_id=current_user.user_id
-            ).all()
-            list_bookings = [l.to_dict() for l in list_bookings]
-            hours_booked = 0
-
-            ##Search through the existing bookings
-            for i in range(len(list_bookings)):
-                timeslot = AvailabilityModel.query.get_or_404(
-                    list_bookings[i]["availability_id"]
-                ).to_dict()
-                if (
-                    datetime.fromtimestamp(timeslot["start_time"] / 1000).strftime("%m")
-                    == new_time_month
-                ):
-                    get_interval = start_vs_end(
-                        timeslot["end_time"], timeslot["start_time"]
-                    )
-                    hours_booked += get_interval
-            get_new_booking_interval = start_vs_end(
-                new_time["end_time"], new_time["start_time"]
+            hours_booked = get_booked_hours(
+                current_user.user_id, new_time["start_time"]
             )
-            if (hours_booked + get_new_booking_interval) > 10:
+            # The slot being moved away from no longer counts
+            if b["user_id"] == current_user.user_id and month_of(
+                old_time["start_time"]
+            ) == month_of(new_time["start_time"]):
+                hours_booked -= slot_hours(old_time["start_time"], old_time["end_time"])
+            get_new_booking_interval = slot_hours(
+                new_time["start_time"], new_time["end_time"]
+            )
+            if (hours_booked + get_new_booking_interval) > MAX_HOURS_PER_MONTH:
                 raise BookedMoreThan10HoursPerMonth
             b1 = BookingModel.query.get_or_404(booking_id)
             old_avail = AvailabilityModel.query.get_or_404(b["availability_id"])
+            moved = b["availability_id"] != content["availability_id"]
+            # The new slot is claimed the same way as a new booking
+            if moved and not claim_availability(
+                content["availability_id"], current_user.user_id
+            ):
+                raise AvailabilityIdNotAvailable(content["availability_id"])
             b1.user_id = current_user.user_id
             # update the booking data
             b1.listing_id = content["listing_id"]
@@ -167,13 +323,30 @@ class Booking(Resource):
             flag_modified(b1, "availability_id")
             db.session.merge(b1)
             # Note - update the old avaliability such that it will go back to true
-            old_avail.is_available = True
-            flag_modified(old_avail, "is_available")
-            db.session.merge(old_avail)
+            if moved:
+                old_avail.is_available = True
+                flag_modified(old_avail, "is_available")
+                db.session.merge(old_avail)
             db.session.flush()
+            # Move the hours in the ledger along with the booking
+            remove_booked_hours(
+                b["user_id"], old_time["start_time"], old_time["end_time"]
+            )
+            add_booked_hours(
+                current_user.user_id, new_time["start_time"], new_time["end_time"]
+            )
             db.session.commit()
+            availability_index.refresh(old_avail.listing_id, b1.listing_id)
             return b1.to_dict()
 
+        except SlotNotInRange as e:
+            db.session.rollback()
+            return {"error": e.message}, 400
+
+        except AvailabilityIdNotAvailable as e:
+            db.session.rollback()
+            return {"error": e.message}, 409
+
         except BookedMoreThan10HoursPerMonth as e:
             return {"error": e.message}, 403
 
@@ -197,118 +370,457 @@ class BookingList(Resource):
             # Receive contents from request
             logging.info(content)
             user_id = current_user.user_id
-            booking_id = str(uuid.uuid4())
             listing_id = content["listing_id"]
             availability_id = content["availability_id"]
 
-            # Check that the availability is still open
-            a = AvailabilityModel.query.get_or_404(availability_id)
+            a = AvailabilityModel.query.get(availability_id)
             if a is None:
                 raise AvailabilityIdNotFound(availability_id)
-            if not a.is_available:
-                raise AvailabilityIdNotAvailable(availability_id)
-            if current_user.user_id != user_id:
-                raise ValueError(
-                    "Token invalid, you can't request for a user that is not you!"
+
+            # Claiming the slot, counting the hours and making the booking happen in
+            # one short transaction, nothing is read and then written back
+            b = create_booking(user_id, listing_id, a, content.get("start_time"))
+            db.session.commit()
+            availability_index.refresh(a.listing_id)
+            return b.to_dict()
+
+        except AvailabilityIdNotFound as e:
+            db.session.rollback()
+            return {"error": e.message}, 404
+
+        except SlotNotInRange as e:
+            db.session.rollback()
+            return {"error": e.message}, 400
+
+        except AvailabilityIdNotAvailable as e:
+            db.session.rollback()
+            return {"error": e.message}, 409
+
+        except BookedMoreThan10HoursPerMonth as e:
+            db.session.rollback()
+            return {"error": e.message}, 403
+
+        except Exception as e:
+            logging.error(e)
+            db.session.rollback()
+            api.api.abort(500, f"{e}")
+
+
+@booking.route("/batch")
+class BookingBatch(Resource):
+    @booking.doc(
+        description=f"Books a list of availability_ids all-or-nothing. "
+        "When the batch is rejected nothing is booked and every slot gets a result."
+    )
+    @booking.expect(batch_booking_details)
+    def post(self):
+        content = get_request_json()
+        availability_ids = content.get("availability_ids")
+        if not isinstance(availability_ids, list) or len(availability_ids) == 0:
+            api.api.abort(400, "Expected a non empty list of availability_ids")
+        if len(availability_ids) > api.config.Config.RESULT_LIMIT:
+            api.api.abort(
+                400,
+                f"At most {api.config.Config.RESULT_LIMIT} availability_ids per batch",
+            )
+        # Ids sent as strings are fine, anything else fails the whole batch
+        ids = []
+        for availability_id in availability_ids:
+            try:
+                ids.append(int(str(availability_id).strip()))
+            except ValueError:
+                ids.append(None)
+        if None in ids:
+            return {
+                "error": "Nothing was booked",
+                "results": [
+                    {"availability_id": a, "status": "ok"}
+                    if i is not None
+                    else {
+                        "availability_id": a,
+                        "status": "failed",
+                        "error": "availability_id must be an integer",
+                    }
+                    for a, i in zip(availability_ids, ids)
+                ],
+            }, 400
+        availability_ids = ids
+        user_id = current_user.user_id
+        try:
+            availabilities = {
+                a.availability_id: a
+                for a in AvailabilityModel.query.filter(
+                    AvailabilityModel.availability_id.in_(availability_ids)
                 )
-            # New booking cannot allow a user more than 10 hours in a month
-            new_time = AvailabilityModel.query.get_or_404(
-                content["availability_id"]
-            ).to_dict()
-            new_time_month = datetime.fromtimestamp(
-                new_time["start_time"] / 1000
-            ).strftime("%m")
-            list_bookings = BookingModel.query.filter_by(
-                user_id=current_user.user_id
-            ).all()
-            list_bookings = [l.to_dict() for l in list_bookings]
-            hours_booked = 0
-            ##Search through the existing bookings
-            for i in range(len(list_bookings)):
-                timeslot = AvailabilityModel.query.get_or_404(
-                    list_bookings[i]["availability_id"]
-                ).to_dict()
-                if (
-                    datetime.fromtimestamp(timeslot["start_time"] / 1000).strftime("%m")
-                    == new_time_month
-                ):
-                    get_interval = start_vs_end(
-                        timeslot["end_time"], timeslot["start_time"]
-                    )
-                    hours_booked += get_interval
-            get_new_booking_interval = start_vs_end(
-                new_time["end_time"], new_time["start_time"]
+            }
+            # A range in the batch is booked from its first slot, which keeps the
+            # availability_id of the range
+            taken = {}
+            for a in availabilities.values():
+                if a.slot_minutes and a.is_available:
+                    try:
+                        take_range_slot(a, None)
+                    except AvailabilityIdNotAvailable as e:
+                        taken[a.availability_id] = e.message
+            errors = {
+                **batch_errors(user_id, availability_ids, availabilities),
+                **taken,
+            }
+            # One statement claims every slot, nothing is booked unless it got them all
+            claimed = len(errors) == 0 and claim_availabilities(
+                availability_ids, user_id
             )
-            if (hours_booked + get_new_booking_interval) > 10:
+            if not claimed:
+                db.session.rollback()
+                if len(errors) == 0:
+                    # Another booking or hold got in first. The reasons are looked
+                    # up again for the results, if they don't explain the failed
+                    # claim every slot is reported as not available.
+                    availabilities = {
+                        a.availability_id: a
+                        for a in AvailabilityModel.query.filter(
+                            AvailabilityModel.availability_id.in_(availability_ids)
+                        )
+                    }
+                    errors = batch_errors(
+                        user_id, availability_ids, availabilities
+                    ) or {
+                        a: AvailabilityIdNotAvailable(a).message
+                        for a in availability_ids
+                    }
+                return {
+                    "error": "Nothing was booked",
+                    "results": batch_results(availability_ids, errors),
+                }, 409
+
+            bookings = []
+            for availability_id in availability_ids:
+                a = availabilities[availability_id]
+                add_booked_hours(user_id, a.start_time, a.end_time)
+                bookings.append(
+                    BookingModel(
+                        booking_id=str(uuid.uuid4()),
+                        user_id=user_id,
+                        listing_id=a.listing_id,
+                        availability_id=availability_id,
+                    )
+                )
+            # Checked again after the ledger was written, like a single booking
+            months = {month_of(a.start_time) for a in availabilities.values()}
+            hours = get_booked_hours_by_month(user_id, months)
+            if any(h > MAX_HOURS_PER_MONTH for h in hours.values()):
                 raise BookedMoreThan10HoursPerMonth()
-            # The following steps must be atomic
-            # 1. Make a booking
-            b = BookingModel(
-                booking_id=booking_id,
-                user_id=user_id,
-                listing_id=listing_id,
-                availability_id=availability_id,
+            db.session.add_all(bookings)
+            db.session.commit()
+            availability_index.refresh(*{a.listing_id for a in availabilities.values()})
+            return {"bookings": [b.to_dict() for b in bookings]}
+
+        except BookedMoreThan10HoursPerMonth as e:
+            db.session.rollback()
+            return {"error": e.message}, 403
+
+        except Exception as e:
+            logging.error(e)
+            db.session.rollback()
+            api.api.abort(500, f"{e}")
+
+
+def claim_availabilities(availability_ids, user_id):
+    """
+    Claims many availabilities with one conditional UPDATE
+    :param availability_ids: The availabilities to claim, without duplicates
+    :param user_id: The user claiming them, their own holds do not stop them
+    :return: True if every one of them was still available and not held by others
+    """
+    result = db.session.execute(
+        AvailabilityModel.__table__.update()
+        .where(AvailabilityModel.availability_id.in_(availability_ids))
+        .where(AvailabilityModel.is_available)
+        .where(AvailabilityModel.slot_minutes.is_(None))
+        .where(~held_by_others(user_id))
+        .values(is_available=False)
+    )
+    return result.rowcount == len(availability_ids)
+
+
+def held_by_others(user_id):
+    """
+    :param user_id: The user booking
+    :return: Condition on AvailabilityModel, true while someone else holds the slot
+    """
+    return exists().where(
+        and_(
+            BookingHoldModel.availability_id == AvailabilityModel.availability_id,
+            BookingHoldModel.expires_at > now_ms(),
+            BookingHoldModel.user_id != user_id,
+        )
+    )
+
+
+def batch_errors(user_id, availability_ids, availabilities):
+    """
+    Checks a batch before its slots are claimed, the quota is computed once for the set
+    :param user_id: The user booking
+    :param availability_ids: The availability_ids asked for
+    :param availabilities: dict of availability_id to the AvailabilityModel found
+    :return: dict of availability_id to error message, empty if the batch looks fine
+    """
+    errors = {}
+    seen = set()
+    held = {
+        a.availability_id
+        for a in db.session.query(AvailabilityModel.availability_id)
+        .filter(AvailabilityModel.availability_id.in_(availability_ids))
+        .filter(held_by_others(user_id))
+    }
+    for availability_id in availability_ids:
+        a = availabilities.get(availability_id)
+        if a is None:
+            errors[availability_id] = AvailabilityIdNotFound(availability_id).message
+        elif availability_id in seen:
+            errors[availability_id] = "availability_id is in the batch more than once"
+        elif not a.is_available:
+            errors[availability_id] = AvailabilityIdNotAvailable(
+                availability_id
+            ).message
+        elif availability_id in held:
+            errors[availability_id] = AvailabilityIdHeld(availability_id).message
+        seen.add(availability_id)
+
+    # Hours asked for per month on top of what is already booked
+    found = [availabilities[a] for a in seen if a in availabilities]
+    hours = get_booked_hours_by_month(user_id, [month_of(a.start_time) for a in found])
+    for a in found:
+        hours[month_of(a.start_time)] += slot_hours(a.start_time, a.end_time)
+    for a in found:
+        if hours[month_of(a.start_time)] > MAX_HOURS_PER_MONTH:
+            errors.setdefault(
+                a.availability_id, BookedMoreThan10HoursPerMonth().message
             )
-            db.session.add(b)
+    return errors
 
-            # 2. Mark the availability_id not available
-            a.is_available = False
-            db.session.add(a)
 
-            # Commit changes to db
+def batch_results(availability_ids, errors):
+    return [
+        {"availability_id": a, "status": "failed", "error": errors[a]}
+        if a in errors
+        else {"availability_id": a, "status": "ok"}
+        for a in availability_ids
+    ]
+
+
+@booking.route("/holds")
+class BookingHoldList(Resource):
+    @booking.doc(
+        description=f"Holds an availability for a short time before booking it. "
+        "Only one user can hold a slot, confirm the hold to turn it into a booking."
+    )
+    @booking.expect(hold_details)
+    def post(self):
+        content = get_request_json()
+        availability_id = content.get("availability_id")
+        if availability_id is None:
+            api.api.abort(400, "Expected an availability_id")
+        try:
+            ttl_seconds = parse_ttl_seconds(content.get("ttl_seconds"))
+            a = AvailabilityModel.query.get(availability_id)
+            split = a is not None and bool(a.slot_minutes)
+            if split:
+                availability_id = take_range_slot(a, content.get("start_time"))
+            hold = acquire_hold(availability_id, current_user.user_id, ttl_seconds)
+            if hold is None:
+                raise AvailabilityIdNotAvailable(availability_id)
             db.session.commit()
+            if split:
+                availability_index.refresh(a.listing_id)
+            return hold
 
-            # Return the bookingbooking_time
-            booking_id = b.booking_id
-            return BookingModel.query.get_or_404(booking_id).to_dict()
+        except (InvalidHoldTtl, SlotNotInRange) as e:
+            db.session.rollback()
+            return {"error": e.message}, 400
 
-        except BookedMoreThan10HoursPerMonth as e:
-            return {"error": e.message}, 403
+        except AvailabilityIdNotAvailable as e:
+            db.session.rollback()
+            return {"error": e.message}, 409
 
-        except CannotUpdateLessThan3DaysOfBooking as e:
+        except Exception as e:
+            logging.error(e)
+            db.session.rollback()
+            api.api.abort(500, f"{e}")
+
+
+def parse_ttl_seconds(value):
+    """
+    :param value: ttl_seconds of the request, if any
+    :return: How long to hold for, Config.HOLD_TTL_SECONDS when not given
+    :raises InvalidHoldTtl: If it is not a whole number of seconds up to the maximum
+    """
+    if value is None:
+        return api.config.Config.HOLD_TTL_SECONDS
+    try:
+        ttl_seconds = int(str(value).strip())
+    except ValueError:
+        raise InvalidHoldTtl()
+    if not 0 < ttl_seconds <= api.config.Config.HOLD_TTL_SECONDS:
+        raise InvalidHoldTtl()
+    return ttl_seconds
+
+
+@booking.route("/holds/<hold_id>")
+@booking.param("hold_id", "The hold identifier")
+class BookingHold(Resource):
+    @booking.doc(description=f"Releases a hold")
+    def delete(self, hold_id):
+        released = release_hold(hold_id, current_user.user_id)
+        db.session.commit()
+        if not released:
+            return {"error": HoldNotFound(hold_id).message}, 404
+        return None, 204
+
+
+@booking.route("/holds/<hold_id>/confirm")
+@booking.param("hold_id", "The hold identifier")
+class BookingHoldConfirm(Resource):
+    @booking.doc(description=f"Turns a live hold into a booking")
+    def post(self, hold_id):
+        user_id = current_user.user_id
+        try:
+            availability_id = take_hold(hold_id, user_id)
+            if availability_id is None:
+                raise HoldNotFound(hold_id)
+            a = AvailabilityModel.query.get(availability_id)
+            # The availability was deleted while it was held
+            if a is None:
+                raise AvailabilityIdNotFound(availability_id)
+            b = create_booking(user_id, a.listing_id, a)
+            db.session.commit()
+            availability_index.refresh(a.listing_id)
+            return b.to_dict()
+
+        except HoldNotFound as e:
+            db.session.rollback()
+            return {"error": e.message}, 410
+
+        except AvailabilityIdNotFound as e:
+            # Nothing is left to book, the hold stays released
+            db.session.commit()
+            return {"error": e.message}, 404
+
+        except AvailabilityIdNotAvailable as e:
+            db.session.rollback()
+            return {"error": e.message}, 409
+
+        except BookedMoreThan10HoursPerMonth as e:
+            db.session.rollback()
             return {"error": e.message}, 403
 
         except Exception as e:
             logging.error(e)
+            db.session.rollback()
             api.api.abort(500, f"{e}")
 
 
 @booking.route("/mybookings")
+@booking.param("fields", f"Comma separated subset of {list(MY_BOOKING_COLUMNS.keys())}")
+@booking.param("section", f"Only fetch one of {list(MY_BOOKING_SECTIONS.keys())}")
+@booking.param("page_size", "Number of bookings per page of each section")
+@booking.param("past_cursor", "The next_cursor of past from the previous page")
+@booking.param("upcoming_cursor", "The next_cursor of upcoming from the previous page")
 class MyBookings(Resource):
     @booking.doc(description=f"Fetch my bookings")
     def get(self):
-        query_text = f"""
-        select 
-            b.*,
-            l.*,
-            a.*,
-            r.rating_id,
-            r.rating,
-            r.comment
+        fields = get_request_fields(
+            list(MY_BOOKING_COLUMNS.keys()), always=["booking_id"]
+        )
+        sections = list(MY_BOOKING_SECTIONS.keys())
+        section = get_request_arg("section")
+        if section is not None:
+            if section not in sections:
+                api.api.abort(
+                    400, f"Query parameter 'section' must be one of {sections}"
+                )
+            sections = [section]
+        page_size, _ = get_page_args()
+
+        # end_time and booking_id are always needed for the cursor and
+        # listing_image is swapped for its medium thumbnail
+        wanted = set(MY_BOOKING_COLUMNS.keys()) if fields is None else set(fields)
+        wanted.add("end_time")
+        if "listing_image" in wanted:
+            wanted.add("listing_image_medium")
+        columns = [
+            f"{column} as {field}"
+            for field, column in MY_BOOKING_COLUMNS.items()
+            if field in wanted
+        ]
+        now = int(datetime.now().strftime("%s")) * 1000
+
+        out = {}
+        next_cursors = {}
+        with engine.connect() as conn:
+            for section in sections:
+                cursor = get_request_arg(f"{section}_cursor")
+                if cursor:
+                    cursor = decode_cursor(cursor)
+                    if len(cursor) != 3 or cursor[0] != section:
+                        api.api.abort(
+                            400, f"Query parameter '{section}_cursor' malformed"
+                        )
+                query_text = my_bookings_query(columns, section, cursor, page_size)
+                params = {"user_id": current_user.user_id, "now": now}
+                if cursor:
+                    params["cursor_end_time"] = cursor[1]
+                    params["cursor_booking_id"] = cursor[2]
+                my_bookings = [
+                    as_list_item(with_image_url(dict(r), *LISTING_IMAGE_COLUMNS))
+                    for r in conn.execute(text(query_text), params)
+                ]
+                my_bookings, next_cursors[section] = split_page(
+                    my_bookings,
+                    page_size,
+                    lambda b: [section, b["end_time"], b["booking_id"]],
+                )
+                out[section] = [only_fields(b, fields) for b in my_bookings]
+        return {"mybookings": out, "next_cursor": next_cursors}
+
+
+def my_bookings_query(columns, section, cursor, page_size):
+    """
+    One page of past or upcoming bookings of a user, split and ordered in SQL
+    Past bookings come most recent first, upcoming ones soonest first
+    :param columns: The select list
+    :param section: One of MY_BOOKING_SECTIONS
+    :param cursor: The decoded cursor of the section, if any
+    :param page_size: Number of bookings per page
+    :return: The query text, bound to :user_id, :now and the cursor values
+    """
+    end_time_filter, direction = MY_BOOKING_SECTIONS[section]
+    after = ">" if direction == "asc" else "<"
+    cursor_filter = ""
+    if cursor:
+        cursor_filter = f"""
+            and (
+                a.end_time {after} :cursor_end_time
+                or (a.end_time = :cursor_end_time and b.booking_id {after} :cursor_booking_id)
+            )
+        """
+    return f"""
+        select
+            {", ".join(columns)}
         from bookings as b
-        join listings as l 
-            on l.listing_id = b.listing_id
         join availabilities as a
             on a.availability_id = b.availability_id
+        join listings as l
+            on l.listing_id = b.listing_id
         left join ratings as r
             on r.booking_id = b.booking_id
         where
-            b.user_id = {current_user.user_id}
-        limit {api.config.Config.RESULT_LIMIT}
+            b.user_id = :user_id
+            and a.end_time {end_time_filter} :now
+            {cursor_filter}
+        order by a.end_time {direction}, b.booking_id {direction}
+        limit {page_size + 1}
         """
-        with engine.connect() as conn:
-            results = conn.execute(query_text)
-            my_bookings = [dict(r) for r in results]
-            out = {
-                "past": [],
-                "upcoming": [],
-            }
-            for b in my_bookings:
-                if b["end_time"] < int(datetime.now().strftime("%s")) * 1000:
-                    out["past"].append(b)
-                else:
-                    out["upcoming"].append(b)
-            return {"mybookings": out}
 
 
 # Exceptions
@@ -332,6 +844,16 @@ class AvailabilityIdNotAvailable(Exception):
         super().__init__(self.message)
 
 
+class AvailabilityIdHeld(Exception):
+    """
+    Raised when another user holds availability_id
+    """
+
+    def __init__(self, availability_id):
+        self.message = f"availability_id {availability_id} is held by another user"
+        super().__init__(self.message)
+
+
 class BookedMoreThan10HoursPerMonth(Exception):
     """
     Raised when availability_id is not available
@@ -356,3 +878,33 @@ class CannotUpdateLessThan3DaysOfBooking(Exception):
             "Cannot update booking less than 3 days of start time of the booking"
         )
         super().__init__(self.message)
+
+
+class HoldNotFound(Exception):
+    """
+    Raised when a hold expired or does not belong to the user
+    """
+
+    def __init__(self, hold_id):
+        self.message = f"hold_id {hold_id} not found or expired"
+        super().__init__(self.message)
+
+
+class SlotNotInRange(Exception):
+    """
+    Raised when a range is booked with a start_time that is not one of its slots
+    """
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(self.message)
+
+
+class InvalidHoldTtl(Exception):
+    """
+    Raised when ttl_seconds of a hold is not between 1 and the maximum
+    """
+
+    def __init__(self):
+        self.message = f"ttl_seconds must be a whole number from 1 to {api.config.Config.HOLD_TTL_SECONDS}"
+        super().__init__(self.message)
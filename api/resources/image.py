@@ -0,0 +1,32 @@
+import logging
+
+from api.models.image import ImageModel, is_safe_image_type
+from api.utils.req_handling import *
+from flask import make_response
+from flask_restplus import Resource
+import api
+
+image = api.api.namespace("images", description="Image operations")
+
+# An image URL always points at the same bytes, so clients can cache it forever
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@image.route("/<string:image_hash>")
+@image.param("image_hash", "The SHA-256 of the image")
+@image.response(404, "image not found")
+class Image(Resource):
+    @image.doc(description="Returns the image bytes, use If-None-Match to revalidate")
+    def get(self, image_hash):
+        logging.info(f"Getting image {image_hash}")
+        i = ImageModel.query.get_or_404(image_hash)
+        response = make_response(i.data)
+        response.headers["Content-Type"] = i.content_type
+        response.headers["Cache-Control"] = IMAGE_CACHE_CONTROL
+        response.headers["X-Content-Type-Options"] = "nosniff"
+        # The default svg avatar still shows in an img tag but is never opened as a page
+        if not is_safe_image_type(i.content_type):
+            response.headers["Content-Disposition"] = "attachment"
+        response.set_etag(i.image_hash)
+        # Turns into an empty 304 when the client already has this image
+        return response.make_conditional(request)
@@ -1,19 +1,46 @@
 import api
+import json
 import logging
 
 from api import db
 from api.models.booking import BookingModel
-from api.models.listing import ListingModel
+from api.models.listing import (
+    LISTING_COLUMNS,
+    LISTING_IMAGE_COLUMNS,
+    ListingModel,
+    as_list_item,
+)
+from api.models.image import image_url, with_image_url
+from api.models.listing_rating_summary import ListingRatingSummaryModel
+from api.models.listing_trigram import ListingTrigramModel
 from api.models.rating import RatingModel
+from api.search.availability_index import availability_index
+from api.search.listing_index import LISTING_SEARCH_RANK, build_search_match
+from api.search.listing_suggestions import listing_suggestions
+from api.search.search_cache import search_cache
+from api.search.trigram_index import fuzzy_match_query
+from api.utils.images import store_listing_image
+from api.utils.listing_import import IMPORT_FORMATS, import_listings, read_listing_rows
+from api.utils.pagination import get_page_args, split_page
 from api.utils.req_handling import *
 from flask_login import current_user
 from flask_restplus import Resource, fields
+from sqlalchemy import and_, or_
 from sqlalchemy.orm.attributes import flag_modified
-import numpy as np
+from sqlalchemy.sql import text
 from jinja2 import Template
 
 listing = api.api.namespace("listings", description="Listing operations")
 
+# Columns that listing endpoints can be ordered (and paginated) by
+LISTING_SORT_KEYS = ["listing_id", "listing_name"]
+# Searches can also be ordered by how well they match the search_query
+SEARCH_SORT_KEYS = LISTING_SORT_KEYS + ["relevance"]
+# exact matches words of the search_query, fuzzy tolerates typos
+SEARCH_MATCH_MODES = ["exact", "fuzzy"]
+# What can be asked for with ?fields=
+LISTING_FIELDS = LISTING_COLUMNS + ["avg_rating", "ratings"]
+
 listing_details = api.api.model(
     "Listing",
     {
@@ -33,7 +60,8 @@ listing_details = api.api.model(
         ),
         "username": fields.String(required=True, description="Username of the user"),
         "listing_image": fields.String(
-            required=False, description="The image of the listing in base64"
+            required=False,
+            description="The image of the listing, a base64 data URL when uploading and an image URL when returned",
         ),
         "avg_rating": fields.Float(
             required=False, description="Avg rating for the listing"
@@ -49,20 +77,26 @@ listing_details = api.api.model(
 # See example: https://github.com/noirbizarre/flask-restplus/blob/master/examples/todo.py
 @listing.route("/<int:listing_id>")
 @listing.param("listing_id", "The listing identifier")
+@listing.param("fields", f"Comma separated subset of {LISTING_FIELDS}")
 @listing.response(404, "listing not found")
 class Listing(Resource):
     @listing.doc(description=f"listing_id must be provided")
     # @listing.marshal_with(listing_details)
     def get(self, listing_id):
         logging.info(f"Getting listing {listing_id}")
+        fields = get_request_fields(LISTING_FIELDS, always=["listing_id"])
+        # Only select the columns that were asked for
+        columns = [getattr(ListingModel, c) for c in listing_columns(fields)]
+        row = (
+            db.session.query(*columns)
+            .filter(ListingModel.listing_id == listing_id)
+            .first()
+        )
+        if row is None:
+            api.api.abort(404, f"listing {listing_id} not found")
+        listing_dict = with_image_url(row._asdict(), *LISTING_IMAGE_COLUMNS)
         # Calculate avg ratings
-        listing_dict = ListingModel.query.get_or_404(listing_id).to_dict()
-        out = {
-            **listing_dict,
-            "avg_rating": calculate_avg_rating(listing_dict["listing_id"]),
-            "ratings": get_ratings(listing_dict["listing_id"]),
-        }
-        return out
+        return only_fields(with_ratings([listing_dict], fields)[0], fields)
 
     @listing.doc(description=f"listing_id must be provided")
     @listing.marshal_with(listing_details)
@@ -70,7 +104,14 @@ class Listing(Resource):
         logging.info(f"Deleting listing {listing_id}")
         listing = ListingModel.query.filter(ListingModel.listing_id == listing_id)
         listing.delete()
+        ListingRatingSummaryModel.query.filter(
+            ListingRatingSummaryModel.listing_id == listing_id
+        ).delete()
+        ListingTrigramModel.query.filter(
+            ListingTrigramModel.listing_id == listing_id
+        ).delete()
         db.session.commit()
+        listing_suggestions.remove(listing_id)
         return listing
 
     # Need to see what updates are made
@@ -94,18 +135,38 @@ class Listing(Resource):
         listing.username = current_user.username
 
         # Image is optional
-        if "listing_image" in content.keys():
-            listing.listing_image = content["listing_image"]
+        # Only run the thumbnail pipeline when the image actually changed
+        if "listing_image" in content.keys() and content["listing_image"] != image_url(
+            listing.listing_image
+        ):
+            (
+                listing.listing_image,
+                listing.listing_image_small,
+                listing.listing_image_medium,
+            ) = store_listing_image(content["listing_image"])
 
         flag_modified(listing, "description")
         db.session.merge(listing)
         db.session.flush()
         db.session.commit()
+        listing_suggestions.update(listing_id, listing.listing_name, listing.category)
         return {**listing.to_dict(), "avg_rating": 0}
 
 
 @listing.route("")
 @listing.param("search_query", "Keyword resource search")
+@listing.param(
+    "match",
+    f"One of {SEARCH_MATCH_MODES}, fuzzy also finds listing names and addresses with typos",
+)
+@listing.param(
+    "sort",
+    f"Order results by one of {SEARCH_SORT_KEYS}, relevance is the default with a search_query",
+)
+@listing.param("page_size", "Number of listings per page")
+@listing.param("cursor", "The next_cursor returned with the previous page")
+@listing.param("fields", f"Comma separated subset of {LISTING_FIELDS}")
+@listing.param("facets", "Set to true to also count the matches of every category")
 class ListingList(Resource):
     @listing.doc(description=f"Creates a new listing")
     @listing.expect(listing_details)
@@ -135,12 +196,17 @@ class ListingList(Resource):
 
             # Image is optional
             if "listing_image" in content.keys():
-                v.listing_image = content["listing_image"]
+                (
+                    v.listing_image,
+                    v.listing_image_small,
+                    v.listing_image_medium,
+                ) = store_listing_image(content["listing_image"])
 
             db.session.add(v)
             db.session.commit()
             listing_id = v.listing_id
             logging.info(f"listing_id created: {listing_id}")
+            listing_suggestions.update(listing_id, listing_name, category)
             return {
                 **ListingModel.query.get_or_404(listing_id).to_dict(),
                 "avg_rating": 0,
@@ -157,10 +223,28 @@ class ListingList(Resource):
         start_time = request.args.get("start_time")
         end_time = request.args.get("end_time")
         categories = request.args.get("categories")
+        facets = str(request.args.get("facets", "")).lower() in ["1", "true"]
+        match = get_request_arg("match", default="exact")
+        if match not in SEARCH_MATCH_MODES:
+            api.api.abort(
+                400, f"Query parameter 'match' must be one of {SEARCH_MATCH_MODES}"
+            )
+        fields = get_request_fields(LISTING_FIELDS, always=["listing_id"])
 
         # Cast types
-        if search_query:
-            search_query = str(search_query).lower()
+        search_match = fuzzy = None
+        if match == "fuzzy":
+            fuzzy = fuzzy_match_query(
+                search_query, api.config.Config.FUZZY_SEARCH_THRESHOLD
+            )
+        else:
+            search_match = build_search_match(search_query)
+        # Best matches come first unless asked otherwise
+        sort, page_size, cursor = get_listing_page_args(
+            SEARCH_SORT_KEYS, "relevance" if search_match or fuzzy else "listing_id"
+        )
+        if sort == "relevance" and not (search_match or fuzzy):
+            api.api.abort(400, "Sorting by relevance needs a search_query")
         if start_time:
             start_time = int(start_time)
         if end_time:
@@ -168,138 +252,353 @@ class ListingList(Resource):
         # If categories is None, then the query will return all
         if categories:
             # Split the categories with comma
-            categories = [str(i).lower() for i in categories.split(",")]
+            categories = sorted({str(i).lower() for i in categories.split(",")})
+
+        # Identical searches are answered from the cache until the next relevant write
+        cache_key = (
+            request.host_url,
+            search_match,
+            frozenset(fuzzy[1].items()) if fuzzy else None,
+            tuple(categories) if categories else None,
+            start_time,
+            end_time,
+            sort,
+            page_size,
+            tuple(cursor) if cursor else None,
+            tuple(sorted(fields)) if fields else None,
+            facets,
+        )
+        generation = search_cache.generation
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Listings with a free slot inside the time window come from the interval index,
+        # they are bound as one json array so the query text doesn't grow with them
+        free_listing_ids = None
+        if start_time and end_time:
+            free_listing_ids = availability_index.listings_free_between(
+                start_time, end_time
+            )
 
+        # Keyword search goes through the listings_fts index instead of scanning listings
         template = Template(
             """
-        select l.*
+        select
+            {% if count_by_category %}
+            l.category,
+            count(*) as listing_count
+            {% else %}
+            {% for column in columns %}
+            l.{{ column }}{% if not loop.last %},{% endif %}
+            {% endfor %}
+            {% if sort == "relevance" %}
+            , {{ sort_column }} as relevance
+            {% endif %}
+            {% endif %}
         from listings as l
+        {% if search_match %}
+        join listings_fts as f
+            on f.rowid = l.listing_id
+        {% endif %}
+        {% if fuzzy_query %}
+        join ({{ fuzzy_query }}) as t
+            on t.listing_id = l.listing_id
+        {% endif %}
         where
-            (
-                l.listing_name like '%{{ search_query }}%'
-                or l.description like '%{{ search_query }}%'
-                or l.address like '%{{ search_query }}%'
-            )
+            1 = 1
 
-            {% if start_time and end_time %}
-            and l.listing_id in (
-                select listing_id
-                from availabilities
-                where
-                {% if start_time and end_time %}
-                    start_time >= {{ start_time }}
-                    and end_time <= {{ end_time }}
-                    and is_available
-                {% endif %}
-            )
+            {% if search_match %}
+            and listings_fts match :search_match
+            {% endif %}
+
+            {% if filter_free %}
+            and l.listing_id in (select value from json_each(:free_listing_ids))
             {% endif %}
 
-            {% if categories %}
+            {% if categories and not count_by_category %}
             and category in (
                 {% for category in categories %}
                     '{{ category }}' {% if not loop.last %},{% endif %}
                 {% endfor %}
             )
             {% endif %}
-        limit {{ result_limit }}
+
+            {% if cursor and not count_by_category %}
+            and (
+                {{ sort_column }} > :cursor_value
+                or ({{ sort_column }} = :cursor_value and l.listing_id > :cursor_id)
+            )
+            {% endif %}
+        {% if count_by_category %}
+        group by l.category
+        {% else %}
+        order by {{ sort_column }}, l.listing_id
+        limit {{ page_size + 1 }}
+        {% endif %}
         """
         )
 
-        query = template.render(
-            search_query=search_query,
-            start_time=start_time,
-            end_time=end_time,
-            result_limit=api.config.Config.RESULT_LIMIT,
+        query_args = dict(
+            search_match=search_match,
+            fuzzy_query=fuzzy[0] if fuzzy else None,
+            filter_free=free_listing_ids is not None,
             categories=categories,
+            sort=sort,
+            sort_column=relevance_column(fuzzy) if sort == "relevance" else f"l.{sort}",
+            cursor=cursor,
+            page_size=page_size,
         )
+        query = template.render(columns=listing_columns(fields, sort), **query_args)
+        params = {"search_match": search_match}
+        if free_listing_ids is not None:
+            params["free_listing_ids"] = json.dumps(free_listing_ids)
+        if fuzzy:
+            params.update(fuzzy[1])
+        if cursor:
+            params["cursor_value"] = cursor[1]
+            params["cursor_id"] = cursor[2]
 
         with api.engine.connect() as conn:
-            query_results = conn.execute(query)
-            search_listings = [dict(l) for l in query_results]
-
-            # Calculate avg ratings and fetch ratings for that listing
-            out = [
-                {
-                    **l,
-                    "avg_rating": calculate_avg_rating(l["listing_id"]),
-                    "ratings": get_ratings(l["listing_id"]),
-                }
-                for l in search_listings
+            query_results = conn.execute(text(query), params)
+            search_listings = [
+                as_list_item(with_image_url(dict(l), *LISTING_IMAGE_COLUMNS))
+                for l in query_results
             ]
-            return {"listings": out}
+
+            # Facet counts ignore the category filter and the cursor, so the client can
+            # show how many listings each category would match for the same search
+            if facets:
+                facet_query = template.render(count_by_category=True, **query_args)
+                category_counts = {c: 0 for c in api.config.Config.CATEGORIES}
+                for r in conn.execute(text(facet_query), params):
+                    if r["category"] in category_counts:
+                        category_counts[r["category"]] = r["listing_count"]
+
+        search_listings, next_cursor = split_page(
+            search_listings, page_size, lambda l: [sort, l[sort], l["listing_id"]]
+        )
+        # The score is only needed for the cursor
+        for l in search_listings:
+            l.pop("relevance", None)
+        # Calculate avg ratings and fetch ratings for all listings in one go
+        search_listings = [
+            only_fields(l, fields) for l in with_ratings(search_listings, fields)
+        ]
+        result = {"listings": search_listings, "next_cursor": next_cursor}
+        if facets:
+            result["facets"] = {"categories": category_counts}
+        search_cache.put(cache_key, result, generation)
+        return result
+
+
+@listing.route("/import")
+@listing.param(
+    "format", f"One of {IMPORT_FORMATS}, taken from the Content-Type by default"
+)
+class ListingImport(Resource):
+    @listing.doc(
+        description=f"Creates many listings from a CSV or NDJSON body in the shape of api/utils/listings.csv"
+    )
+    def post(self):
+        format = get_request_arg(
+            "format", default="csv" if request.mimetype == "text/csv" else "ndjson"
+        )
+        if format not in IMPORT_FORMATS:
+            api.api.abort(
+                400, f"Query parameter 'format' must be one of {IMPORT_FORMATS}"
+            )
+        try:
+            rows = read_listing_rows(request.stream, format)
+            results = import_listings(rows, current_user)
+        except Exception as e:
+            logging.error(e)
+            db.session.rollback()
+            api.api.abort(500, f"{e}")
+        created = len([r for r in results if r["status"] == "created"])
+        logging.info(f"Imported {created} of {len(results)} listings")
+        return {
+            "created": created,
+            "failed": len(results) - created,
+            "results": results,
+        }
+
+
+@listing.route("/suggest")
+@listing.param("prefix", "What was typed in the search box so far")
+@listing.param("limit", "Maximum number of suggestions")
+class ListingSuggest(Resource):
+    @listing.doc(
+        description=f"Suggests listing ids and names whose name or category starts with prefix"
+    )
+    def get(self):
+        prefix = get_request_arg("prefix", default="")
+        limit = get_request_arg("limit", int, default=api.config.Config.SUGGEST_LIMIT)
+        limit = max(0, min(limit, api.config.Config.RESULT_LIMIT))
+        return {"suggestions": listing_suggestions.suggest(prefix, limit)}
+
+
+@listing.route("/cache_stats")
+class ListingCacheStats(Resource):
+    @listing.doc(description=f"Hit and miss counters of the listing search cache")
+    def get(self):
+        return search_cache.stats()
 
 
-# TODO: Paginate this and add docs
 @listing.route("/mylistings")
+@listing.param("sort", f"Order results by one of {LISTING_SORT_KEYS}")
+@listing.param("page_size", "Number of listings per page")
+@listing.param("cursor", "The next_cursor returned with the previous page")
 class MyListings(Resource):
     @listing.doc(description=f"Fetch my listings")
     def get(self):
-        my_listings = ListingModel.query.filter_by(user_id=current_user.user_id).limit(
-            api.config.Config.RESULT_LIMIT
+        my_listings, next_cursor = paginate_listings(
+            ListingModel.query.filter_by(user_id=current_user.user_id)
         )
-
-        my_listings = [l.to_dict() for l in my_listings]
-        # Calculate avg ratings and fetch ratings for that listing
-        out = [
-            {
-                **l,
-                "avg_rating": calculate_avg_rating(l["listing_id"]),
-                "ratings": get_ratings(l["listing_id"]),
-            }
-            for l in my_listings
-        ]
-        return {"mylistings": out}
+        # Calculate avg ratings and fetch ratings for all listings in one go
+        return {"mylistings": with_ratings(my_listings), "next_cursor": next_cursor}
+
+
+def listing_columns(fields, *extra_columns):
+    """
+    The listings columns to select to answer with the fields asked for
+    :param fields: The fields from ?fields=, None means all of them
+    :param extra_columns: Columns needed on top of that, e.g. the sort key
+    """
+    if fields is None:
+        return LISTING_COLUMNS
+    wanted = set(fields) | set(extra_columns)
+    # Lists send the medium thumbnail in place of the listing_image
+    if "listing_image" in wanted:
+        wanted.add("listing_image_medium")
+    return [c for c in LISTING_COLUMNS if c in wanted]
+
+
+def relevance_column(fuzzy):
+    """
+    The SQL expression to order search results by, lower is more relevant
+    :param fuzzy: The fuzzy match query, if it is a fuzzy search
+    """
+    if fuzzy:
+        return "-t.similarity"
+    return LISTING_SEARCH_RANK
+
+
+def get_listing_page_args(sort_keys=LISTING_SORT_KEYS, default_sort="listing_id"):
+    """
+    Reads the sort key and pagination query parameters of a listing endpoint
+    :param sort_keys: The sort keys the endpoint supports
+    :param default_sort: The sort key used when none is given
+    :return: (sort key, page_size, cursor values or None)
+    """
+    sort = get_request_arg("sort", default=default_sort)
+    if sort not in sort_keys:
+        api.api.abort(400, f"Query parameter 'sort' must be one of {sort_keys}")
+    page_size, cursor = get_page_args()
+    # A cursor only makes sense for the ordering it was created with
+    if cursor and (len(cursor) != 3 or cursor[0] != sort):
+        api.api.abort(400, "Query parameter 'cursor' does not match 'sort'")
+    return sort, page_size, cursor
+
+
+def paginate_listings(query):
+    """
+    Fetches one page of a ListingModel query, seeking past the cursor instead of
+    using an offset so every page costs the same
+    :param query: A ListingModel query with any filters applied
+    :return: (listing dicts on this page, next cursor or None)
+    """
+    sort, page_size, cursor = get_listing_page_args()
+    sort_column = getattr(ListingModel, sort)
+    if cursor:
+        _, cursor_value, cursor_id = cursor
+        query = query.filter(
+            or_(
+                sort_column > cursor_value,
+                and_(sort_column == cursor_value, ListingModel.listing_id > cursor_id),
+            )
+        )
+    rows = query.order_by(sort_column, ListingModel.listing_id).limit(page_size + 1)
+    return split_page(
+        [as_list_item(r.to_dict()) for r in rows],
+        page_size,
+        lambda l: [sort, l[sort], l["listing_id"]],
+    )
 
 
 def calculate_avg_rating(listing_id):
     # Calculate an avg rating for a listing
+    return get_listings_ratings([listing_id])[listing_id]["avg_rating"]
 
-    # Find out the booking ids
-    my_bookings = BookingModel.query.filter_by(listing_id=listing_id).all()
 
-    my_ratings = []
-    for b in my_bookings:
-        booking_id = b.to_dict()["booking_id"]
-        my_ratings_in_booking = RatingModel.query.filter_by(booking_id=booking_id).all()
-        for r in my_ratings_in_booking:
-            my_ratings.append(r)
+def get_ratings(listing_id):
+    # Pull the ratings for this listing
+    return get_listings_ratings([listing_id])[listing_id]["ratings"]
+
+
+def with_ratings(listings, fields=None):
+    """
+    Attaches the avg rating and ratings to every listing in a list
+    :param listings: List of listing dicts, each must have a listing_id
+    :param fields: The fields from ?fields=, ratings are only fetched if asked for
+    :return: The listings with avg_rating and ratings added
+    """
+    if fields is not None and "avg_rating" not in fields and "ratings" not in fields:
+        return listings
+    include_ratings = fields is None or "ratings" in fields
+    ratings = get_listings_ratings(
+        [l["listing_id"] for l in listings], include_ratings=include_ratings
+    )
+    return [{**l, **ratings[l["listing_id"]]} for l in listings]
+
+
+def get_listings_ratings(listing_ids, include_ratings=True):
+    """
+    Looks up the avg rating and the ratings of many listings at once.
+    Runs two queries no matter how many listings are asked for, the avg rating
+    comes straight from the listing_rating_summary table.
+    :param listing_ids: The listing_ids to look up
+    :param include_ratings: Set to False to only look up the avg rating
+    :return: dict of listing_id to {"avg_rating": float, "ratings": list}
+    """
+    out = {listing_id: {"avg_rating": 0.0, "ratings": []} for listing_id in listing_ids}
+    if len(out) == 0:
+        return out
+    listing_ids_text = ", ".join(str(int(i)) for i in out.keys())
+
+    avg_query = f"""
+    select
+        s.listing_id,
+        s.avg_rating
+    from listing_rating_summary as s
+    where s.listing_id in ({listing_ids_text})
+    """
+
+    ratings_query = f"""
+    select
+        b.listing_id as rated_listing_id,
+        r.*,
+        u.username
+    from ratings as r
+    join bookings as b
+        on b.booking_id = r.booking_id
+    join users as u
+        on u.user_id = r.user_id
+    where b.listing_id in ({listing_ids_text})
+    order by r.rating_id
+    """
 
-    # Calculate the avg rating
-    if len(my_ratings) == 0:
-        avg_rating = 0.0
-    else:
-        ratings_numeric = [r.to_dict()["rating"] for r in my_ratings]
-        avg_rating = np.average(ratings_numeric)
+    with api.engine.connect() as conn:
+        for r in conn.execute(avg_query):
+            # Round to two significant digits
+            out[r["listing_id"]]["avg_rating"] = round(r["avg_rating"], 2)
 
-    # Round to two significant digits
-    rounded_avg = round(avg_rating, 2)
-    return rounded_avg
+        if not include_ratings:
+            return {k: {"avg_rating": v["avg_rating"]} for k, v in out.items()}
 
+        for r in conn.execute(ratings_query):
+            rating = dict(r)
+            listing_id = rating.pop("rated_listing_id")
+            out[listing_id]["ratings"].append(rating)
 
-def get_ratings(listing_id):
-    # Pull the ratinsg for this listing
-    # Find out the booking ids
-    my_bookings = BookingModel.query.filter_by(listing_id=listing_id).all()
-    my_ratings = []
-    for b in my_bookings:
-        booking_id = b.to_dict()["booking_id"]
-        my_ratings_in_booking = get_ratings_with_username(booking_id)
-        for r in my_ratings_in_booking:
-            my_ratings.append(r)
-    return my_ratings
-
-
-def get_ratings_with_username(booking_id):
-    with api.engine.connect() as conn:
-        query = f"""
-            select
-                r.*,
-                u.username
-            from ratings as r
-            join users as u
-                on u.user_id = r.user_id 
-            where r.booking_id = '{booking_id}'
-            """
-        results = conn.execute(query)
-        my_ratings_in_booking = [dict(r) for r in results]
-        return my_ratings_in_booking
+    return out
@@ -2,8 +2,12 @@ import hashlib
 import logging
 
 from api import db
+from api.models.image import with_image_url
 from api.models.listing import ListingModel
+from api.models.user import USER_COLUMNS
+from api.resources.listing import LISTING_SORT_KEYS, paginate_listings
 from api.resources.utils import *
+from api.utils.images import store_image
 from api.utils.req_handling import *
 from flask_login import current_user
 from flask_restplus import Resource, fields
@@ -12,26 +16,32 @@ import api
 
 profile = api.api.namespace("profiles", description="User operations")
 
+# What can be asked for with ?fields=
+PROFILE_FIELDS = USER_COLUMNS + ["followers", "followees", "is_followed"]
+
 
 @profile.route("/<username>")
 @profile.param("username", "The username of the user")
+@profile.param("fields", f"Comma separated subset of {PROFILE_FIELDS}")
 @profile.response(404, "user not found")
 class Profile(Resource):
     @profile.doc(description=f"Returns the profile of a given username")
     def get(self, username):
-        u = UserModel.query.filter(UserModel.username == username).first()
+        fields = get_request_fields(PROFILE_FIELDS, always=["user_id"])
+        # Only select the columns that were asked for
+        columns = [
+            getattr(UserModel, c) for c in USER_COLUMNS if fields is None or c in fields
+        ]
+        u = db.session.query(*columns).filter(UserModel.username == username).first()
         if u:
-            followers = find_followers(u.user_id)
-            followees = find_followees(u.user_id)
-            is_followed = True if len(followers) > 0 else False
-            user = u.to_dict()
-            out = {
-                **user,
-                "followers": followers,
-                "followees": followees,
-                "is_followed": is_followed,
-            }
-            return out
+            out = with_image_url(u._asdict(), "avatar")
+            if fields is None or "followers" in fields or "is_followed" in fields:
+                followers = find_followers(u.user_id)
+                out["followers"] = followers
+                out["is_followed"] = True if len(followers) > 0 else False
+            if fields is None or "followees" in fields:
+                out["followees"] = find_followees(u.user_id)
+            return only_fields(out, fields)
         else:
             return {"error": "user not found"}, 404
 
@@ -49,7 +59,7 @@ class Profile(Resource):
         # Update the user conditionally
         if "avatar" in content.keys():
             avatar = content["avatar"]
-            user.avatar = avatar
+            user.avatar = store_image(avatar)
             flag_modified(user, "avatar")
 
         if "email" in content.keys():
@@ -76,21 +86,14 @@ class Profile(Resource):
 
 
 @profile.route("/<username>/listings")
+@profile.param("sort", f"Order results by one of {LISTING_SORT_KEYS}")
+@profile.param("page_size", "Number of listings per page")
+@profile.param("cursor", "The next_cursor returned with the previous page")
 class Listings(Resource):
     @profile.doc(description=f"Fetch users listings given some username provided")
     def get(self, username):
-        my_listings = ListingModel.query.filter(
-            ListingModel.username == username
-        ).limit(api.config.Config.RESULT_LIMIT)
-
-        my_listings = [l.to_dict() for l in my_listings]
-        # Calculate avg ratings and fetch ratings for that listing
-        out = [
-            {
-                **l,
-                "avg_rating": calculate_avg_rating(l["listing_id"]),
-                "ratings": get_ratings(l["listing_id"]),
-            }
-            for l in my_listings
-        ]
-        return {"mylistings": out}
+        my_listings, next_cursor = paginate_listings(
+            ListingModel.query.filter(ListingModel.username == username)
+        )
+        # Calculate avg ratings and fetch ratings for all listings in one go
+        return {"mylistings": with_ratings(my_listings), "next_cursor": next_cursor}
@@ -2,7 +2,14 @@ import logging
 
 from api import db
 from api.utils.req_handling import *
+from api.models.booking import BookingModel
 from api.models.rating import RatingModel
+from api.utils.rating_summary import (
+    add_to_rating_summary,
+    rated_listing_id,
+    remove_from_rating_summary,
+    validate_rating,
+)
 from flask_login import current_user
 from flask_restplus import Resource, fields
 from sqlalchemy.orm.attributes import flag_modified
@@ -47,9 +54,22 @@ class Rating(Resource):
     @rating.marshal_with(rating_details)
     def delete(self, rating_id):
         logging.info(f"Deleting rating {rating_id}")
-        b = RatingModel.query.filter(RatingModel.rating_id == rating_id)
-        b.delete()
-        db.session.commit()
+        r = RatingModel.query.get_or_404(rating_id)
+        # Ratings from before listing_id was stored find it through their booking
+        listing_id = r.listing_id
+        if listing_id is None and BookingModel.query.get(r.booking_id) is not None:
+            listing_id = rated_listing_id(r.booking_id)
+        try:
+            # Take it out of the listing summary in the same transaction
+            if listing_id is not None:
+                remove_from_rating_summary(listing_id, r.rating)
+            b = RatingModel.query.filter(RatingModel.rating_id == rating_id)
+            b.delete()
+            db.session.commit()
+        except Exception as e:
+            logging.error(e)
+            db.session.rollback()
+            api.api.abort(500, f"{e}")
         return b, 204
 
     @rating.doc(description=f"rating_id must be provided")
@@ -59,16 +79,40 @@ class Rating(Resource):
         # get rating id
         content = get_request_json()
         b = RatingModel.query.get_or_404(rating_id)
-        # update the rating data - consists of the relevant fields.
-        b.booking_id = content["booking_id"]
-        b.user_id = current_user.user_id
-        b.rating = content["rating"]
-        b.comment = content["comment"]
-        flag_modified(b, "rating")
-        flag_modified(b, "comment")
-        db.session.merge(b)
-        db.session.flush()
-        db.session.commit()
+        # Check everything before the summary is touched
+        try:
+            booking_id = content["booking_id"]
+            rating_value = validate_rating(content["rating"])
+            comment = content["comment"]
+        except (KeyError, ValueError) as e:
+            api.api.abort(400, f"Bad rating: {e}")
+        if BookingModel.query.get(booking_id) is None:
+            api.api.abort(400, f"booking_id {booking_id} not found")
+        old_listing_id = b.listing_id
+        if old_listing_id is None and BookingModel.query.get(b.booking_id) is not None:
+            old_listing_id = rated_listing_id(b.booking_id)
+
+        try:
+            # Swap the old rating for the new one in the listing summary
+            listing_id = rated_listing_id(booking_id)
+            if old_listing_id is not None:
+                remove_from_rating_summary(old_listing_id, b.rating)
+            add_to_rating_summary(listing_id, rating_value)
+            # update the rating data - consists of the relevant fields.
+            b.booking_id = booking_id
+            b.listing_id = listing_id
+            b.user_id = current_user.user_id
+            b.rating = rating_value
+            b.comment = comment
+            flag_modified(b, "rating")
+            flag_modified(b, "comment")
+            db.session.merge(b)
+            db.session.flush()
+            db.session.commit()
+        except Exception as e:
+            logging.error(e)
+            db.session.rollback()
+            api.api.abort(500, f"{e}")
         return b
 
 
@@ -86,18 +130,23 @@ class RatingList(Resource):
             # user_id = content["user_id"]
             user_id = current_user.user_id
             # Calling it rating_value because rating is already taken
-            rating_value = content["rating"]
+            rating_value = validate_rating(content["rating"])
             comment = content["comment"]
+            listing_id = rated_listing_id(booking_id)
 
             # Create the rating
             r = RatingModel(
                 user_id=user_id,
                 booking_id=booking_id,
+                listing_id=listing_id,
                 rating=rating_value,
                 comment=comment,
             )
             db.session.add(r)
 
+            # Keep the listing summary up to date in the same transaction
+            add_to_rating_summary(listing_id, rating_value)
+
             # Commit changes to db
             db.session.commit()
 
@@ -105,8 +154,13 @@ class RatingList(Resource):
             rating_id = r.rating_id
             return RatingModel.query.get_or_404(rating_id).to_dict()
 
+        except (KeyError, ValueError) as e:
+            db.session.rollback()
+            api.api.abort(400, f"Bad rating: {e}")
+
         except Exception as e:
             logging.error(e)
+            db.session.rollback()
             api.api.abort(500, f"{e}")
 
 
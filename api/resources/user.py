@@ -3,7 +3,9 @@ import logging
 
 from api import db
 from api.models.follower import FollowerModel
-from api.models.user import UserModel
+from api.models.image import with_image_url
+from api.models.user import USER_COLUMNS, UserModel
+from api.utils.images import store_image
 from api.utils.req_handling import *
 from flask_login import current_user
 from flask_restplus import Resource, fields
@@ -12,6 +14,9 @@ import api
 
 user = api.api.namespace("users", description="User operations")
 
+# What can be asked for with ?fields=
+USER_FIELDS = USER_COLUMNS + ["is_followed"]
+
 create_user_details = api.api.model(
     "User",
     {
@@ -72,7 +77,7 @@ class User(Resource):
             # Update the user conditionally
             if "avatar" in content.keys():
                 avatar = content["avatar"]
-                user.avatar = avatar
+                user.avatar = store_image(avatar)
                 flag_modified(user, "avatar")
 
             if "email" in content.keys():
@@ -104,6 +109,7 @@ class User(Resource):
 
 @user.route("")
 @user.param("username", "The username to search")
+@user.param("fields", f"Comma separated subset of {USER_FIELDS}")
 class UserList(Resource):
     @user.doc(description=f"Creates a new User")
     @user.expect(create_user_details)
@@ -144,15 +150,24 @@ class UserList(Resource):
     @user.expect(get_user_details)
     def get(self):
         keyword = request.args.get("username")
+        fields = get_request_fields(USER_FIELDS, always=["user_id"])
         logging.info(f"Searching for usernames like: {keyword}")
-        search_return = UserModel.query.filter(
-            UserModel.username.ilike(f"%{keyword}%")
-        ).limit(api.config.Config.RESULT_LIMIT)
-        search_users = [l.to_dict() for l in search_return]
-        with_is_followed = [
-            {**u, "is_followed": is_user_followed(u["user_id"])} for u in search_users
+        # Only select the columns that were asked for
+        columns = [
+            getattr(UserModel, c) for c in USER_COLUMNS if fields is None or c in fields
         ]
-        return {"users": with_is_followed}
+        search_return = (
+            db.session.query(*columns)
+            .filter(UserModel.username.ilike(f"%{keyword}%"))
+            .limit(api.config.Config.RESULT_LIMIT)
+        )
+        search_users = [with_image_url(u._asdict(), "avatar") for u in search_return]
+        if fields is None or "is_followed" in fields:
+            search_users = [
+                {**u, "is_followed": is_user_followed(u["user_id"])}
+                for u in search_users
+            ]
+        return {"users": search_users}
 
 
 def is_user_followed(user_id: int):
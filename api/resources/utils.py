@@ -1,5 +1,7 @@
-from api.resources.listing import get_ratings, calculate_avg_rating
+from api.models.listing import LISTING_IMAGE_COLUMNS, as_list_item
+from api.resources.listing import with_ratings
 from api import engine
+from api.models.image import with_image_url
 from api.resources.user import UserModel
 
 
@@ -30,7 +32,7 @@ def find_followees(follower_user_id):
 
     with engine.connect() as conn:
         results = conn.execute(query)
-        out = [dict(r) for r in results]
+        out = [with_image_url(dict(r), "avatar") for r in results]
         return out
 
 
@@ -61,48 +63,29 @@ def find_followers(influencer_user_id):
 
     with engine.connect() as conn:
         results = conn.execute(query)
-        out = [dict(r) for r in results]
+        out = [with_image_url(dict(r), "avatar") for r in results]
         return out
 
 
 def find_listings_of_followees(followees):
-    listings = []
-    # # Find the listings that are owned by a followee
-    # for f in followees:
-    #     query = (
-    #         db.session.query(ListingModel)
-    #             .filter(ListingModel.listing_id == f["user_id"])
-    #             .limit(api.config.Config.RESULT_LIMIT)
-    #     )
-    #     unpacked_query = [q for q in query]
-    #     for u in unpacked_query:
-    #         listings.append(u)
-
-    listings = []
-    for f in followees:
-        user_id = f["user_id"]
-        query = f"""
-        select
-            l.*
-        from listings as l
-        where
-            l.user_id = {user_id}
-        """
-
-        with engine.connect() as conn:
-            results = conn.execute(query)
-            listings_to_add = [dict(r) for r in results]
-            for l in listings_to_add:
-                listings.append(l)
+    # Find the listings that are owned by any followee
+    if len(followees) == 0:
+        return []
+    user_ids = ", ".join(str(int(f["user_id"])) for f in followees)
+    query = f"""
+    select
+        l.*
+    from listings as l
+    where
+        l.user_id in ({user_ids})
+    """
 
-    # Calculate avg ratings and fetch ratings for that listing
-    out = [
-        {
-            **l,
-            "avg_rating": calculate_avg_rating(l["listing_id"]),
-            "ratings": get_ratings(l["listing_id"]),
-        }
-        for l in listings
-    ]
+    with engine.connect() as conn:
+        results = conn.execute(query)
+        listings = [
+            as_list_item(with_image_url(dict(r), *LISTING_IMAGE_COLUMNS))
+            for r in results
+        ]
 
-    return out
+    # Calculate avg ratings and fetch ratings for all listings in one go
+    return with_ratings(listings)
@@ -17,6 +17,9 @@ if __name__ == "__main__":
     import api.resources.recommendation
     import api.resources.follower
     import api.resources.profile
+    import api.resources.image
+    from api.search.listing_suggestions import listing_suggestions
+    from api.utils.holds import start_hold_sweeper
 
     # Create all database tables
     db.create_all()
@@ -24,4 +27,10 @@ if __name__ == "__main__":
     # Generate some fake data
     g.generate_fake_data()
 
+    # Load the autocomplete index
+    listing_suggestions.rebuild()
+
+    # Release expired booking holds in the background
+    start_hold_sweeper(app)
+
     app.run(debug=True, host="0.0.0.0", use_reloader=False)
@@ -0,0 +1,207 @@
+import bisect
+import threading
+
+from api import db
+from api.models.availability import AvailabilityModel
+
+
+class AvailabilityIndex(object):
+    """
+    In-memory interval index over the free availability slots of every listing
+
+    Each listing keeps the start_time of its free slots in sorted order, next to the
+    smallest end_time found from that position to the end of the list. A listing is
+    free between X and Y if some slot starts at or after X and ends at or before Y,
+    which is one bisect on the start times and one lookup in the suffix minimums.
+    Ranges of back to back slots are kept aside per listing and checked one by one.
+
+    To find every listing free in a window without visiting each listing, all free
+    slots are also kept in one list sorted by start_time. Only the slots starting
+    inside the window are looked at. Ranges are kept in lists sorted by start_time,
+    one per power of two of their length. A range shorter than 2^k can only overlap
+    the window if it starts less than 2^k before it, so past ranges are skipped.
+
+    The index is loaded on first use and refreshed one listing at a time whenever
+    its availabilities change. Other caches derived from availabilities can subscribe
+    to those refreshes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # listing_id -> (sorted (start, end) slots, suffix minimum of end times, ranges)
+        self._listings = None
+        # (start, end, listing_id) of every free slot, sorted
+        self._slots = []
+        # Power of two of the length of a range -> sorted (start, end, slot length,
+        # listing_id) of every free range that long
+        self._ranges = {}
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """
+        :param callback: Called with the listing_ids every time they are refreshed
+        """
+        self._subscribers.append(callback)
+
+    def listings_free_between(self, start_time, end_time):
+        """
+        Finds the listings with a free slot fully inside a time window
+        :param start_time: Start of the window in unix time
+        :param end_time: End of the window in unix time
+        :return: Sorted list of listing_ids
+        """
+        self._get_listings()
+        free = set()
+        with self._lock:
+            i = bisect.bisect_left(self._slots, (start_time,))
+            while i < len(self._slots) and self._slots[i][0] < end_time:
+                slot_start, slot_end, listing_id = self._slots[i]
+                if slot_end <= end_time:
+                    free.add(listing_id)
+                i += 1
+            for bucket, ranges in self._ranges.items():
+                # Every range here is shorter than 2^bucket
+                i = bisect.bisect_right(ranges, (start_time - (1 << bucket),))
+                last = bisect.bisect_left(ranges, (end_time,))
+                while i < last:
+                    range_start, range_end, length, listing_id = ranges[i]
+                    if _range_has_slot_between(
+                        range_start, range_end, length, start_time, end_time
+                    ):
+                        free.add(listing_id)
+                    i += 1
+        return sorted(free)
+
+    def is_free_between(self, listing_id, start_time, end_time):
+        """
+        :param listing_id: The listing to check
+        :param start_time: Start of the window in unix time
+        :param end_time: End of the window in unix time
+        :return: True if the listing has a free slot fully inside the window
+        """
+        slots = self._get_listings().get(listing_id)
+        return slots is not None and _has_slot_between(slots, start_time, end_time)
+
+    def refresh(self, *listing_ids):
+        """
+        Reloads the free slots of some listings after their availabilities changed
+        Call this after the change has been committed
+        :param listing_ids: The listings to reload
+        """
+        listing_ids = {int(i) for i in listing_ids if i is not None}
+        if self._listings is not None and len(listing_ids) > 0:
+            slots = _load_slots(listing_ids)
+            with self._lock:
+                listings = dict(self._listings)
+                for listing_id in listing_ids:
+                    old = listings.pop(listing_id, None)
+                    if old is not None:
+                        _remove_sorted(
+                            self._slots, [(s, e, listing_id) for s, e in old[0]]
+                        )
+                        for r in old[2]:
+                            _remove_sorted(
+                                self._ranges.get(_range_bucket(r), []),
+                                [(*r, listing_id)],
+                            )
+                for listing_id, new in slots.items():
+                    for s, e in new[0]:
+                        bisect.insort(self._slots, (s, e, listing_id))
+                    for r in new[2]:
+                        bisect.insort(
+                            self._ranges.setdefault(_range_bucket(r), []),
+                            (*r, listing_id),
+                        )
+                listings.update(slots)
+                self._listings = listings
+        # Caches built on top of the index are refreshed once it is up to date
+        for callback in self._subscribers:
+            callback(listing_ids)
+
+    def rebuild(self):
+        """
+        Reloads every listing, for example after bulk loading availabilities
+        """
+        listings = _load_slots()
+        all_slots = sorted(
+            (s, e, listing_id)
+            for listing_id, (window, _, _) in listings.items()
+            for s, e in window
+        )
+        all_ranges = {}
+        for listing_id, (_, _, ranges) in listings.items():
+            for r in ranges:
+                all_ranges.setdefault(_range_bucket(r), []).append((*r, listing_id))
+        for ranges in all_ranges.values():
+            ranges.sort()
+        with self._lock:
+            self._listings = listings
+            self._slots = all_slots
+            self._ranges = all_ranges
+
+    def _get_listings(self):
+        if self._listings is None:
+            self.rebuild()
+        return self._listings
+
+
+def _load_slots(listing_ids=None):
+    query = db.session.query(
+        AvailabilityModel.listing_id,
+        AvailabilityModel.start_time,
+        AvailabilityModel.end_time,
+        AvailabilityModel.slot_minutes,
+    ).filter(AvailabilityModel.is_available)
+    if listing_ids is not None:
+        query = query.filter(AvailabilityModel.listing_id.in_(listing_ids))
+    query = query.order_by(AvailabilityModel.listing_id, AvailabilityModel.start_time)
+
+    windows = {}
+    ranges = {}
+    for listing_id, start_time, end_time, slot_minutes in query:
+        if start_time is None or end_time is None:
+            continue
+        if slot_minutes:
+            ranges.setdefault(listing_id, []).append(
+                (start_time, end_time, slot_minutes * 60 * 1000)
+            )
+        else:
+            windows.setdefault(listing_id, []).append((start_time, end_time))
+
+    slots = {}
+    for listing_id in windows.keys() | ranges.keys():
+        window = windows.get(listing_id, [])
+        min_ends = [e for _, e in window]
+        for i in range(len(min_ends) - 2, -1, -1):
+            min_ends[i] = min(min_ends[i], min_ends[i + 1])
+        slots[listing_id] = (window, min_ends, ranges.get(listing_id, []))
+    return slots
+
+
+def _remove_sorted(items, to_remove):
+    for item in to_remove:
+        i = bisect.bisect_left(items, item)
+        if i < len(items) and items[i] == item:
+            del items[i]
+
+
+def _range_bucket(r):
+    # The smallest k with end - start < 2^k
+    return (r[1] - r[0]).bit_length()
+
+
+def _range_has_slot_between(range_start, range_end, length, start_time, end_time):
+    # The first slot of the range starting at or after start_time
+    first = range_start + max(0, -(-(start_time - range_start) // length)) * length
+    return first + length <= min(end_time, range_end)
+
+
+def _has_slot_between(slots, start_time, end_time):
+    window, min_ends, ranges = slots
+    i = bisect.bisect_left(window, (start_time,))
+    if i < len(window) and min_ends[i] <= end_time:
+        return True
+    return any(_range_has_slot_between(*r, start_time, end_time) for r in ranges)
+
+
+availability_index = AvailabilityIndex()
@@ -0,0 +1,73 @@
+import re
+
+from api.models.listing import ListingModel
+from sqlalchemy import DDL, event
+
+# Full-text index over the searchable listing columns. It is an external content
+# FTS5 table, so it only stores the index and reads the text back from listings.
+# The triggers keep it in sync on every listing create, update and delete.
+LISTING_SEARCH_INDEX_DDL = [
+    """
+    create virtual table if not exists listings_fts using fts5(
+        listing_name,
+        description,
+        address,
+        content='listings',
+        content_rowid='listing_id',
+        prefix='2 3'
+    )
+    """,
+    """
+    create trigger if not exists listings_fts_insert after insert on listings
+    begin
+        insert into listings_fts(rowid, listing_name, description, address)
+        values (new.listing_id, new.listing_name, new.description, new.address);
+    end
+    """,
+    """
+    create trigger if not exists listings_fts_delete after delete on listings
+    begin
+        insert into listings_fts(listings_fts, rowid, listing_name, description, address)
+        values ('delete', old.listing_id, old.listing_name, old.description, old.address);
+    end
+    """,
+    """
+    create trigger if not exists listings_fts_update
+    after update of listing_name, description, address on listings
+    begin
+        insert into listings_fts(listings_fts, rowid, listing_name, description, address)
+        values ('delete', old.listing_id, old.listing_name, old.description, old.address);
+        insert into listings_fts(rowid, listing_name, description, address)
+        values (new.listing_id, new.listing_name, new.description, new.address);
+    end
+    """,
+    # Index whatever is already in the table
+    "insert into listings_fts(listings_fts) values ('rebuild')",
+]
+
+for ddl in LISTING_SEARCH_INDEX_DDL:
+    event.listen(ListingModel.__table__, "after_create", DDL(ddl))
+
+# How much a match in each indexed column counts towards the relevance of a listing,
+# in the order the columns are declared in listings_fts
+LISTING_SEARCH_WEIGHTS = {"listing_name": 10.0, "description": 2.0, "address": 1.0}
+
+# BM25 score of a match, lower is more relevant
+LISTING_SEARCH_RANK = "bm25(listings_fts, {})".format(
+    ", ".join(str(w) for w in LISTING_SEARCH_WEIGHTS.values())
+)
+
+
+def build_search_match(search_query):
+    """
+    Turns a free text search into an FTS5 match expression
+    Every word becomes a quoted prefix term, so "coffee camp" matches "Coffee On Campus"
+    :param search_query: The raw search_query sent by the client
+    :return: The match expression, or None if there is nothing to search for
+    """
+    if not search_query:
+        return None
+    terms = re.findall(r"\w+", str(search_query).lower())
+    if len(terms) == 0:
+        return None
+    return " ".join(f'"{t}"*' for t in terms)
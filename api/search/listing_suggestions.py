@@ -0,0 +1,116 @@
+import bisect
+import re
+import threading
+
+from api import db
+from api.models.listing import ListingModel
+
+
+class ListingSuggestions(object):
+    """
+    In-memory prefix index of listing names and categories for autocomplete
+
+    Every word of a listing name starts a key, so "cor" finds "Bagel Corner", and the
+    category is a key too. The keys sit in one sorted list, a prefix lookup is a bisect
+    followed by a short scan over the keys that start with it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Sorted (key, listing_id) pairs
+        self._keys = None
+        # listing_id -> (listing_name, keys)
+        self._listings = {}
+
+    def suggest(self, prefix, limit):
+        """
+        :param prefix: What the user typed so far
+        :param limit: Maximum number of suggestions
+        :return: list of {"listing_id", "listing_name"}
+        """
+        prefix = _normalize(prefix)
+        if not prefix:
+            return []
+        if self._keys is None:
+            self.rebuild()
+        out = []
+        seen = set()
+        with self._lock:
+            i = bisect.bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and len(out) < limit:
+                key, listing_id = self._keys[i]
+                if not key.startswith(prefix):
+                    break
+                if listing_id not in seen:
+                    seen.add(listing_id)
+                    name = self._listings[listing_id][0]
+                    out.append({"listing_id": listing_id, "listing_name": name})
+                i += 1
+        return out
+
+    def update(self, listing_id, listing_name, category):
+        """
+        Adds or replaces a listing after it was committed
+        """
+        if self._keys is None:
+            return
+        with self._lock:
+            self._remove(listing_id)
+            self._add(listing_id, listing_name, category)
+
+    def remove(self, listing_id):
+        """
+        Drops a listing after its delete was committed
+        """
+        if self._keys is None:
+            return
+        with self._lock:
+            self._remove(listing_id)
+
+    def rebuild(self):
+        """
+        Loads every listing, called at startup
+        """
+        rows = db.session.query(
+            ListingModel.listing_id, ListingModel.listing_name, ListingModel.category
+        ).all()
+        with self._lock:
+            self._keys = []
+            self._listings = {}
+            for listing_id, listing_name, category in rows:
+                self._add(listing_id, listing_name, category, sort=False)
+            self._keys.sort()
+
+    def _add(self, listing_id, listing_name, category, sort=True):
+        keys = _keys_of(listing_name, category)
+        self._listings[listing_id] = (listing_name, keys)
+        for key in keys:
+            if sort:
+                bisect.insort(self._keys, (key, listing_id))
+            else:
+                self._keys.append((key, listing_id))
+
+    def _remove(self, listing_id):
+        listing = self._listings.pop(listing_id, None)
+        if listing is None:
+            return
+        for key in listing[1]:
+            i = bisect.bisect_left(self._keys, (key, listing_id))
+            if i < len(self._keys) and self._keys[i] == (key, listing_id):
+                del self._keys[i]
+
+
+def _normalize(value):
+    return " ".join(str(value or "").lower().split())
+
+
+def _keys_of(listing_name, category):
+    name = _normalize(listing_name)
+    # The name from each word onwards
+    keys = {name[m.start() :] for m in re.finditer(r"\S+", name)}
+    if category:
+        keys.add(_normalize(category))
+    return sorted(keys)
+
+
+listing_suggestions = ListingSuggestions()
@@ -0,0 +1,137 @@
+import threading
+from datetime import date, datetime, time, timedelta
+
+from api import db
+from api.config import Config
+from api.models.availability import AvailabilityModel
+from api.search.availability_index import availability_index
+
+# States of a calendar block
+NO_SLOT = "."
+FREE = "F"
+BOOKED = "B"
+CALENDAR_LEGEND = {NO_SLOT: "no availability", FREE: "free", BOOKED: "booked"}
+
+
+class OccupancyCalendar(object):
+    """
+    Precomputed per-day occupancy of each listing
+
+    A day is cut into blocks of Config.CALENDAR_BLOCK_MINUTES. Every block is booked
+    if any booked slot overlaps it, free if any free slot does, and empty otherwise.
+    Days are stored run-length encoded, "18.4F2B24." is 18 empty blocks, 4 free,
+    2 booked and 24 empty. Days are computed the first time they are asked for and
+    a listing's days are dropped whenever its availabilities change.
+    """
+
+    def __init__(self, block_minutes):
+        self.block_minutes = block_minutes
+        self._lock = threading.Lock()
+        # listing_id -> {date: run-length encoded day}
+        self._listings = {}
+
+    def days(self, listing_id, start_day, end_day):
+        """
+        :param listing_id: The listing
+        :param start_day: First date of the range
+        :param end_day: Last date of the range
+        :return: dict of "YYYY-MM-DD" to the run-length encoded day, days without any
+            availability are all empty
+        """
+        with self._lock:
+            calendar = self._listings.setdefault(listing_id, {})
+        wanted = [
+            start_day + timedelta(days=i) for i in range((end_day - start_day).days + 1)
+        ]
+        missing = [day for day in wanted if day not in calendar]
+        if len(missing) > 0:
+            computed = self._compute(listing_id, missing[0], missing[-1])
+            with self._lock:
+                calendar.update(computed)
+        return {day.isoformat(): calendar[day] for day in wanted}
+
+    def invalidate(self, listing_ids):
+        with self._lock:
+            for listing_id in listing_ids:
+                self._listings.pop(listing_id, None)
+
+    def blocks_per_day(self, day):
+        """
+        :return: Number of blocks in a day, days where the clocks change are shorter
+            or longer than 24 hours
+        """
+        return -(-_day_length_ms(day) // (self.block_minutes * 60 * 1000))
+
+    def _compute(self, listing_id, start_day, end_day):
+        range_start = _unix_ms(datetime.combine(start_day, time()))
+        range_end = _unix_ms(datetime.combine(end_day + timedelta(days=1), time()))
+        # Only the slots overlapping the requested days
+        slots = (
+            db.session.query(
+                AvailabilityModel.start_time,
+                AvailabilityModel.end_time,
+                AvailabilityModel.is_available,
+            )
+            .filter(AvailabilityModel.listing_id == listing_id)
+            .filter(AvailabilityModel.start_time < range_end)
+            .filter(AvailabilityModel.end_time > range_start)
+        )
+
+        block_ms = self.block_minutes * 60 * 1000
+        days = {}
+        day = start_day
+        while day <= end_day:
+            days[day] = bytearray(NO_SLOT * self.blocks_per_day(day), "ascii")
+            day += timedelta(days=1)
+        for start_time, end_time, is_available in slots:
+            if start_time is None or end_time is None or end_time <= start_time:
+                continue
+            state = FREE if is_available else BOOKED
+            # Long slots are clipped so only the requested days are expanded
+            start_time = max(start_time, range_start)
+            end_time = min(end_time, range_end)
+            day = max(start_day, datetime.fromtimestamp(start_time / 1000).date())
+            while day <= end_day:
+                day_start = _unix_ms(datetime.combine(day, time()))
+                if day_start >= end_time:
+                    break
+                blocks = days[day]
+                first = max(0, (start_time - day_start) // block_ms)
+                last = min(len(blocks), -(-(end_time - day_start) // block_ms))
+                for i in range(first, last):
+                    # Booked wins over free, free wins over nothing
+                    if blocks[i] != ord(BOOKED):
+                        blocks[i] = ord(state)
+                day += timedelta(days=1)
+        return {
+            day: _run_length(blocks.decode("ascii")) for day, blocks in days.items()
+        }
+
+
+def _run_length(blocks):
+    out = []
+    run_state = blocks[0]
+    run_length = 0
+    for state in blocks:
+        if state == run_state:
+            run_length += 1
+        else:
+            out.append(f"{run_length}{run_state}")
+            run_state = state
+            run_length = 1
+    out.append(f"{run_length}{run_state}")
+    return "".join(out)
+
+
+def _unix_ms(dt):
+    return int(dt.timestamp()) * 1000
+
+
+def _day_length_ms(day):
+    return _unix_ms(datetime.combine(day + timedelta(days=1), time())) - _unix_ms(
+        datetime.combine(day, time())
+    )
+
+
+occupancy_calendar = OccupancyCalendar(Config.CALENDAR_BLOCK_MINUTES)
+availability_index.subscribe(occupancy_calendar.invalidate)
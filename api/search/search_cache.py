@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+
+from api.config import Config
+from api.models.availability import AvailabilityModel
+from api.models.booking import BookingModel
+from api.models.listing import ListingModel
+from api.models.rating import RatingModel
+from api.search.availability_index import availability_index
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Writes to any of these can change what a listing search returns
+SEARCH_MODELS = (ListingModel, AvailabilityModel, BookingModel, RatingModel)
+
+
+class SearchCache(object):
+    """
+    Bounded least recently used cache of listing search results
+    Keys are the normalized search parameters, the whole cache is dropped whenever a
+    listing, availability, booking or rating write is committed, and again once the
+    availability index has caught up with it. A result computed before a clear is
+    not stored, so a search racing a write can't put a stale result back.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        # Bumped by every clear
+        self.generation = 0
+
+    def get(self, key):
+        """
+        :param key: The normalized search parameters
+        :return: The cached result, or None on a miss
+        """
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result, generation=None):
+        """
+        :param key: The normalized search parameters
+        :param result: The search result
+        :param generation: The generation read before the search ran, the result is
+            dropped if the cache was cleared since
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_size:
+                self._results.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._results),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_stale_after_flush(session, flush_context):
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    if any(isinstance(o, SEARCH_MODELS) for o in changed):
+        session.info["search_cache_stale"] = True
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def _mark_stale_after_bulk(context):
+    entity = context.query.column_descriptions[0]["entity"]
+    if entity in SEARCH_MODELS:
+        context.session.info["search_cache_stale"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_after_commit(session):
+    if session.info.pop("search_cache_stale", False):
+        search_cache.clear()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_after_rollback(session):
+    session.info.pop("search_cache_stale", None)
+
+
+search_cache = SearchCache(Config.SEARCH_CACHE_SIZE)
+# Searches read free listings from the index, which is refreshed after the commit
+availability_index.subscribe(lambda listing_ids: search_cache.clear())
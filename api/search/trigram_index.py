@@ -0,0 +1,95 @@
+import re
+
+from api.models.listing import ListingModel
+from api.models.listing_trigram import ListingTrigramModel
+from sqlalchemy import event
+
+# Listing columns that typo tolerant searches look at
+TRIGRAM_FIELDS = ["listing_name", "address"]
+
+trigrams_table = ListingTrigramModel.__table__
+
+
+def trigrams(value):
+    """
+    Splits some text into the set of its trigrams
+    Every word is padded like "  word " so the start and the end of words count more
+    :param value: The text
+    :return: set of three character strings
+    """
+    out = set()
+    for word in re.findall(r"\w+", str(value or "").lower()):
+        padded = f"  {word} "
+        out.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return out
+
+
+def fuzzy_match_query(search_query, threshold):
+    """
+    Builds the query of listings similar to a free text search
+    The similarity of a listing column is the share of the search trigrams found in it,
+    and a listing is as similar as its most similar column
+    :param search_query: The raw search_query sent by the client
+    :param threshold: The lowest similarity still considered a match, from 0 to 1
+    :return: (select of listing_id and similarity, bound params), or None if there is
+        nothing to search for
+    """
+    search_trigrams = sorted(trigrams(search_query))
+    if len(search_trigrams) == 0:
+        return None
+    params = {f"trigram_{i}": t for i, t in enumerate(search_trigrams)}
+    placeholders = ", ".join(f":{p}" for p in params)
+    params["trigram_count"] = len(search_trigrams)
+    params["similarity_threshold"] = threshold
+    query = f"""
+    select
+        listing_id,
+        max(shared) * 1.0 / :trigram_count as similarity
+    from (
+        select
+            listing_id,
+            field,
+            count(*) as shared
+        from listing_trigrams
+        where trigram in ({placeholders})
+        group by listing_id, field
+    )
+    group by listing_id
+    having similarity >= :similarity_threshold
+    """
+    return query, params
+
+
+def index_listings(connection, listings):
+    """
+    Replaces the trigrams of some listings
+    :param connection: The connection of the transaction that changed the listings
+    :param listings: dicts with the listing_id and the TRIGRAM_FIELDS of each listing
+    """
+    listing_ids = [l["listing_id"] for l in listings]
+    connection.execute(
+        trigrams_table.delete().where(trigrams_table.c.listing_id.in_(listing_ids))
+    )
+    rows = [
+        {"trigram": t, "listing_id": l["listing_id"], "field": field}
+        for l in listings
+        for field in TRIGRAM_FIELDS
+        for t in trigrams(l.get(field))
+    ]
+    if len(rows) > 0:
+        connection.execute(trigrams_table.insert(), rows)
+
+
+# Keep the index up to date in the same transaction as the listing itself
+@event.listens_for(ListingModel, "after_insert")
+@event.listens_for(ListingModel, "after_update")
+def _index_listing(mapper, connection, listing):
+    values = {field: getattr(listing, field) for field in TRIGRAM_FIELDS}
+    index_listings(connection, [{"listing_id": listing.listing_id, **values}])
+
+
+@event.listens_for(ListingModel, "after_delete")
+def _unindex_listing(mapper, connection, listing):
+    connection.execute(
+        trigrams_table.delete().where(trigrams_table.c.listing_id == listing.listing_id)
+    )
@@ -33,7 +33,7 @@ def test_authenticate():
     assert protected_response.status_code == 200
     assert protected_response.json()["username"] == TEST_USER["username"]
     assert protected_response.json()["email"] == TEST_USER["email"]
-    assert protected_response.json()["avatar"] == DEFAULT_AVATAR
+    assert protected_response.json()["avatar"] == u.image_url_of(DEFAULT_AVATAR)
     assert type(protected_response.json()["avatar"]) == str
     assert (
         protected_response.json()["user_description"] == TEST_USER["user_description"]
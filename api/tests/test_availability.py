@@ -20,6 +20,13 @@ TEST_LISTING = {
     "description": "Delicious selection of sandwiches and coffee",
 }
 
+TEST_WINDOW_LISTING = {
+    "listing_name": "Quiet meeting room",
+    "address": "Sydney NSW 2000",
+    "category": "other",
+    "description": "Bookable by the hour",
+}
+
 now = datetime.now().strftime("%Y-%m-%d-00:00:00")
 current_date = datetime.strptime(now, "%Y-%m-%d-00:00:00")
 
@@ -100,3 +107,516 @@ def test_create_availability():
     availability_url = f"{API_URL}/availabilities/{actual['availability_id']}"
     response = requests.delete(availability_url, json=TEST_2_AVAILABILITY)
     assert response.status_code == 204
+
+
+def test_search_free_window():
+    token = u.login_user(TEST_AVAILABILITY_USER)
+    headers = {"Authorization": f"JWT {token}"}
+    listing_id = u.create_listing(TEST_WINDOW_LISTING, token)
+    availability_id = u.create_availability(TEST_AVAILABILITY, listing_id, token)
+    start_time = TEST_AVAILABILITY["start_time"]
+    end_time = TEST_AVAILABILITY["end_time"]
+    half_hour = 30 * 60 * 1000
+
+    def free_listing_ids(start, end):
+        response = requests.get(
+            f"{API_URL}/listings",
+            params={"start_time": start, "end_time": end},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        return [l["listing_id"] for l in response.json()["listings"]]
+
+    # The slot has to fit inside the window
+    assert listing_id in free_listing_ids(start_time - half_hour, end_time + half_hour)
+    assert listing_id in free_listing_ids(start_time, end_time)
+    assert listing_id not in free_listing_ids(start_time + half_hour, end_time)
+
+    # Taking the slot away hides the listing
+    availability_url = f"{API_URL}/availabilities/{availability_id}"
+    requests.put(
+        availability_url,
+        json={**TEST_AVAILABILITY, "listing_id": listing_id, "is_available": False},
+        headers=headers,
+    )
+    assert listing_id not in free_listing_ids(start_time, end_time)
+
+    requests.put(
+        availability_url,
+        json={**TEST_AVAILABILITY, "listing_id": listing_id},
+        headers=headers,
+    )
+    assert listing_id in free_listing_ids(start_time, end_time)
+
+    requests.delete(availability_url, headers=headers)
+    assert listing_id not in free_listing_ids(start_time, end_time)
+
+
+def test_create_recurring_availabilities():
+    token = u.login_user(TEST_AVAILABILITY_USER)
+    headers = {"Authorization": f"JWT {token}"}
+    listing_id = u.create_listing(
+        {
+            "listing_name": "Recurring meeting room",
+            "address": "Sydney NSW 2000",
+            "category": "other",
+            "description": "Bookable every morning",
+        },
+        token,
+    )
+    # One slot already sits inside the first morning
+    first_day = current_date + timedelta(7)
+    u.create_availability(
+        {
+            "start_time": int((first_day + timedelta(hours=9.5)).strftime("%s")) * 1000,
+            "end_time": int((first_day + timedelta(hours=10.5)).strftime("%s")) * 1000,
+            "is_available": True,
+        },
+        listing_id,
+        token,
+    )
+
+    rule = {
+        "listing_id": listing_id,
+        "start_date": int(first_day.strftime("%s")) * 1000,
+        "end_date": int((first_day + timedelta(6)).strftime("%s")) * 1000,
+        "weekdays": ["mon", "tue", "wed", "thu", "fri"],
+        "day_start": "09:00",
+        "day_end": "12:00",
+        "slot_minutes": 60,
+    }
+    response = requests.post(
+        f"{API_URL}/availabilities/recurring", json=rule, headers=headers
+    )
+    assert response.status_code == 200
+    actual = response.json()
+    # 5 weekdays in the week with 3 one hour slots each, the 9-10 and 10-11 slots of
+    # the first day overlap the existing slot if it is a weekday
+    overlaps = 2 if first_day.weekday() < 5 else 0
+    assert len(actual["skipped"]) == overlaps
+    assert len(actual["created"]) == 15 - overlaps
+    for a in actual["created"]:
+        start = datetime.fromtimestamp(a["start_time"] / 1000)
+        assert start.weekday() < 5
+        assert 9 <= start.hour < 12
+        assert a["end_time"] - a["start_time"] == 60 * 60 * 1000
+        assert a["listing_id"] == listing_id
+        assert a["is_available"]
+
+    # Running the rule again only finds overlaps
+    response = requests.post(
+        f"{API_URL}/availabilities/recurring", json=rule, headers=headers
+    )
+    assert response.json()["created"] == []
+
+    response = requests.post(
+        f"{API_URL}/availabilities/recurring",
+        json={**rule, "day_end": "08:00"},
+        headers=headers,
+    )
+    assert response.status_code == 400
+
+
+def test_occupancy_calendar():
+    token = u.login_user(TEST_AVAILABILITY_USER)
+    headers = {"Authorization": f"JWT {token}"}
+    listing_id = u.create_listing(
+        {
+            "listing_name": "Calendar meeting room",
+            "address": "Sydney NSW 2000",
+            "category": "other",
+            "description": "Bookable by the half hour",
+        },
+        token,
+    )
+    u.create_availability(TEST_AVAILABILITY, listing_id, token)
+    booked_id = u.create_availability(TEST_2_AVAILABILITY, listing_id, token)
+
+    day = avaliability_date.strftime("%Y-%m-%d")
+    next_day = (avaliability_date + timedelta(1)).strftime("%Y-%m-%d")
+
+    def calendar(start_date, end_date):
+        return requests.get(
+            f"{API_URL}/availabilities/calendar",
+            params={
+                "listing_id": listing_id,
+                "start_date": start_date,
+                "end_date": end_date,
+            },
+            headers=headers,
+        )
+
+    response = calendar(day, next_day)
+    assert response.status_code == 200
+    actual = response.json()
+    assert actual["block_minutes"] == 30
+    # 9-11 are free half hour blocks, the next day is empty
+    assert actual["days"] == {day: "18.4F26.", next_day: "48."}
+
+    # Taking a slot is reflected in the calendar
+    requests.put(
+        f"{API_URL}/availabilities/{booked_id}",
+        json={**TEST_2_AVAILABILITY, "listing_id": listing_id, "is_available": False},
+        headers=headers,
+    )
+    assert calendar(day, day).json()["days"] == {day: "18.2F2B26."}
+
+    # A slot running for decades only fills the days asked for
+    hour_ms = 60 * 60 * 1000
+    long_start = TEST_AVAILABILITY["start_time"] + 27 * hour_ms
+    long_slot = {
+        **TEST_AVAILABILITY,
+        "start_time": long_start,
+        "end_time": long_start + 50 * 365 * 24 * hour_ms,
+    }
+    u.create_availability(long_slot, listing_id, token)
+    third_day = (avaliability_date + timedelta(2)).strftime("%Y-%m-%d")
+    assert calendar(next_day, third_day).json()["days"] == {
+        next_day: "24.24F",
+        third_day: "48F",
+    }
+
+    assert calendar(next_day, day).status_code == 400
+    assert calendar(day, "not a date").status_code == 400
+    far = (avaliability_date + timedelta(365)).strftime("%Y-%m-%d")
+    assert calendar(day, far).status_code == 400
+
+
+def test_availability_ranges():
+    token = u.login_user(TEST_AVAILABILITY_USER)
+    headers = {"Authorization": f"JWT {token}"}
+    listing_id = u.create_listing(
+        {
+            "listing_name": "Hourly meeting room",
+            "address": "Sydney NSW 2000",
+            "category": "other",
+            "description": "Bookable by the hour all day",
+        },
+        token,
+    )
+    day = current_date + timedelta(14)
+    hour = 60 * 60 * 1000
+    nine = int((day + timedelta(hours=9)).strftime("%s")) * 1000
+    rule = {
+        "listing_id": listing_id,
+        "start_date": int(day.strftime("%s")) * 1000,
+        "end_date": int(day.strftime("%s")) * 1000,
+        "day_start": "09:00",
+        "day_end": "17:00",
+        "slot_minutes": 60,
+    }
+
+    def slots():
+        return [
+            (a["availability_id"], a["start_time"], a["is_available"])
+            for a in u.get_availabilities(listing_id, token)["availabilities"]
+        ]
+
+    def is_free(start, end):
+        response = requests.get(
+            f"{API_URL}/listings",
+            params={"start_time": start, "end_time": end},
+            headers=headers,
+        )
+        return listing_id in [l["listing_id"] for l in response.json()["listings"]]
+
+    # 9-17 is stored as one range but still listed and searched hour by hour
+    response = requests.post(
+        f"{API_URL}/availabilities/recurring",
+        json={**rule, "as_ranges": True},
+        headers=headers,
+    )
+    created = response.json()["created"]
+    assert len(created) == 1
+    assert created[0]["slot_minutes"] == 60
+    range_id = created[0]["availability_id"]
+    assert [s for _, s, _ in slots()] == [nine + i * hour for i in range(8)]
+    assert is_free(nine + 2 * hour, nine + 3 * hour)
+    assert not is_free(nine + 2 * hour + 1, nine + 3 * hour)
+
+    # Booking a range by its availability_id alone books its first slot
+    booking = {"listing_id": listing_id, "availability_id": range_id}
+    response = requests.post(f"{API_URL}/bookings", json=booking, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["availability_id"] == range_id
+    listed = slots()
+    assert [free for _, _, free in listed] == [i != 0 for i in range(8)]
+
+    # Any other slot is booked with its start_time
+    rest_id = [a for a, s, _ in listed if s == nine + 2 * hour][0]
+    booking = {"listing_id": listing_id, "availability_id": rest_id}
+    response = requests.post(
+        f"{API_URL}/bookings",
+        json={**booking, "start_time": nine + 30 * 60 * 1000},
+        headers=headers,
+    )
+    assert response.status_code == 400
+
+    # The slot is split out of the range when it is booked
+    response = requests.post(
+        f"{API_URL}/bookings",
+        json={**booking, "start_time": nine + 2 * hour},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    booked_id = response.json()["availability_id"]
+    listed = slots()
+    assert [s for _, s, _ in listed] == [nine + i * hour for i in range(8)]
+    assert [free for _, _, free in listed] == [i not in (0, 2) for i in range(8)]
+    assert not is_free(nine + 2 * hour, nine + 3 * hour)
+    assert is_free(nine + 3 * hour, nine + 4 * hour)
+
+    # Compacting merges plain hourly slots into ranges
+    rule["start_date"] = rule["end_date"] = rule["start_date"] + 24 * hour
+    requests.post(f"{API_URL}/availabilities/recurring", json=rule, headers=headers)
+    assert len(slots()) == 16
+    response = requests.post(
+        f"{API_URL}/availabilities/compact",
+        json={"listing_id": listing_id},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    # The ranges either side of the booking and 8 hourly slots the next day
+    assert response.json() == {"before": 10, "after": 3}
+    listed = slots()
+    assert [s for _, s, _ in listed[:8]] == [nine + i * hour for i in range(8)]
+    assert [free for _, _, free in listed] == [i not in (0, 2) for i in range(16)]
+    assert (booked_id, nine + 2 * hour, False) in listed
+    assert is_free(nine + 24 * hour, nine + 25 * hour)
+
+    # A range in a batch is booked from its first slot too
+    next_range_id = [a for a, s, _ in listed if s == nine + 24 * hour][0]
+    response = requests.post(
+        f"{API_URL}/bookings/batch",
+        json={"availability_ids": [next_range_id]},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert not is_free(nine + 24 * hour, nine + 25 * hour)
+    assert is_free(nine + 25 * hour, nine + 26 * hour)
+
+
+def test_overlapping_availabilities_are_rejected():
+    token = u.login_user(TEST_AVAILABILITY_USER)
+    headers = {"Authorization": f"JWT {token}"}
+    listing_id = u.create_listing(
+        {
+            "listing_name": "Overlap meeting room",
+            "address": "Sydney NSW 2000",
+            "category": "other",
+            "description": "One booking at a time",
+        },
+        token,
+    )
+    u.create_availability(TEST_AVAILABILITY, listing_id, token)
+    start_time = TEST_AVAILABILITY["start_time"]
+    end_time = TEST_AVAILABILITY["end_time"]
+    half_hour = 30 * 60 * 1000
+
+    def create(start, end):
+        return requests.post(
+            f"{API_URL}/availabilities",
+            json={"listing_id": listing_id, "start_time": start, "end_time": end},
+            headers=headers,
+        )
+
+    assert create(start_time, end_time).status_code == 409
+    assert create(start_time - half_hour, start_time + half_hour).status_code == 409
+    assert create(start_time + 1, end_time - 1).status_code == 409
+    assert create(start_time - half_hour, end_time + half_hour).status_code == 409
+    assert create(end_time, start_time).status_code == 400
+
+    # Back to back slots are fine
+    next_id = create(end_time, end_time + 2 * half_hour).json()["availability_id"]
+    assert create(start_time - 2 * half_hour, start_time).status_code == 200
+
+    # Moving a slot onto another one is rejected too
+    response = requests.put(
+        f"{API_URL}/availabilities/{next_id}",
+        json={
+            "listing_id": listing_id,
+            "start_time": end_time - half_hour,
+            "end_time": end_time + half_hour,
+            "is_available": True,
+        },
+        headers=headers,
+    )
+    assert response.status_code == 409
+    assert (
+        requests.get(f"{API_URL}/availabilities/{next_id}").json()["start_time"]
+        == end_time
+    )
+    assert len(u.get_availabilities(listing_id, token)["availabilities"]) == 3
+
+
+def test_next_free_slots():
+    token = u.login_user(TEST_AVAILABILITY_USER)
+    headers = {"Authorization": f"JWT {token}"}
+    listing_id = u.create_listing(
+        {
+            "listing_name": "Busy meeting room",
+            "address": "Sydney NSW 2000",
+            "category": "other",
+            "description": "Booked most of the day",
+        },
+        token,
+    )
+    day = current_date + timedelta(21)
+    hour = 60 * 60 * 1000
+    nine = int((day + timedelta(hours=9)).strftime("%s")) * 1000
+    # 9-13 as a range and the next morning as a plain slot
+    requests.post(
+        f"{API_URL}/availabilities",
+        json={
+            "listing_id": listing_id,
+            "start_time": nine,
+            "end_time": nine + 4 * hour,
+            "slot_minutes": 60,
+        },
+        headers=headers,
+    )
+    u.create_availability(
+        {"start_time": nine + 24 * hour, "end_time": nine + 25 * hour},
+        listing_id,
+        token,
+    )
+    range_id = u.get_availabilities(listing_id, token)["availabilities"][0][
+        "availability_id"
+    ]
+    response = requests.post(
+        f"{API_URL}/bookings",
+        json={
+            "listing_id": listing_id,
+            "availability_id": range_id,
+            "start_time": nine + hour,
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200
+
+    def next_slots(after, limit):
+        response = requests.get(
+            f"{API_URL}/availabilities",
+            params={"listing_id": listing_id, "after": after, "limit": limit},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    # The booked 10am slot is skipped, 9am started before `after`
+    page = next_slots(nine + 30 * 60 * 1000, 2)
+    assert [a["start_time"] for a in page["availabilities"]] == [
+        nine + 2 * hour,
+        nine + 3 * hour,
+    ]
+    assert all(a["is_available"] for a in page["availabilities"])
+    page = next_slots(page["next_after"], 2)
+    assert [a["start_time"] for a in page["availabilities"]] == [nine + 24 * hour]
+    assert page["next_after"] is None
+
+    page = next_slots(nine, 10)
+    assert [a["start_time"] for a in page["availabilities"]] == [
+        nine,
+        nine + 2 * hour,
+        nine + 3 * hour,
+        nine + 24 * hour,
+    ]
+    response = requests.get(
+        f"{API_URL}/availabilities",
+        params={"listing_id": listing_id, "limit": 0},
+        headers=headers,
+    )
+    assert response.status_code == 400
+
+
+def test_batch_availabilities():
+    token = u.login_user(TEST_AVAILABILITY_USER)
+    headers = {"Authorization": f"JWT {token}"}
+    listing_ids = [
+        u.create_listing(
+            {
+                "listing_name": f"Batch meeting room {i}",
+                "address": "Sydney NSW 2000",
+                "category": "other",
+                "description": "Shown on the search page",
+            },
+            token,
+        )
+        for i in range(3)
+    ]
+    day = current_date + timedelta(28)
+    hour = 60 * 60 * 1000
+    nine = int((day + timedelta(hours=9)).strftime("%s")) * 1000
+    # 9-13 as a range on the first listing, 9-10 and 11-12 on the second
+    requests.post(
+        f"{API_URL}/availabilities",
+        json={
+            "listing_id": listing_ids[0],
+            "start_time": nine,
+            "end_time": nine + 4 * hour,
+            "slot_minutes": 60,
+        },
+        headers=headers,
+    )
+    for start in [nine, nine + 2 * hour]:
+        u.create_availability(
+            {"start_time": start, "end_time": start + hour}, listing_ids[1], token
+        )
+
+    def batch(**params):
+        response = requests.get(
+            f"{API_URL}/availabilities/batch",
+            params={"listing_ids": ",".join(str(i) for i in listing_ids), **params},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        actual = response.json()
+        return (
+            {
+                int(listing_id): [a["start_time"] for a in slots]
+                for listing_id, slots in actual["availabilities"].items()
+            },
+            {int(l): after for l, after in actual["next_after"].items()},
+        )
+
+    slots, next_after = batch(start_time=nine, limit=3)
+    assert slots == {
+        listing_ids[0]: [nine, nine + hour, nine + 2 * hour],
+        listing_ids[1]: [nine, nine + 2 * hour],
+        listing_ids[2]: [],
+    }
+    assert next_after == {listing_ids[0]: nine + 3 * hour}
+
+    slots, next_after = batch(
+        start_time=nine + 30 * 60 * 1000, end_time=nine + 3 * hour
+    )
+    assert slots == {
+        listing_ids[0]: [nine + hour, nine + 2 * hour],
+        listing_ids[1]: [nine + 2 * hour],
+        listing_ids[2]: [],
+    }
+    assert next_after == {}
+
+    # The 9-10 slot straddling the window start does not use up the limit
+    u.create_availability(
+        {"start_time": nine + 4 * hour, "end_time": nine + 5 * hour},
+        listing_ids[1],
+        token,
+    )
+    slots, next_after = batch(start_time=nine + 30 * 60 * 1000, limit=1)
+    assert slots == {
+        listing_ids[0]: [nine + hour],
+        listing_ids[1]: [nine + 2 * hour],
+        listing_ids[2]: [],
+    }
+    assert next_after == {
+        listing_ids[0]: nine + 2 * hour,
+        listing_ids[1]: nine + 3 * hour,
+    }
+
+    response = requests.get(
+        f"{API_URL}/availabilities/batch",
+        params={"listing_ids": "1,two"},
+        headers=headers,
+    )
+    assert response.status_code == 400
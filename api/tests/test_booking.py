@@ -1,4 +1,7 @@
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import api.tests.utils as u
 import requests
@@ -33,6 +36,20 @@ CONSUMER2 = {
     "user_description": "sport",
 }
 
+OWNER3 = {
+    "username": "krusty_krab3",
+    "email": "krusty3@test.com",
+    "password": "krabbypatties",
+    "user_description": "sport",
+}
+
+CONSUMER3 = {
+    "username": "sponge_bob3",
+    "email": "sponge3@bob.com",
+    "password": "krabby",
+    "user_description": "sport",
+}
+
 LISTING = {
     "listing_name": "Krusty Krab's",
     "address": "Somewhere down in Bikini Bottom",
@@ -107,7 +124,8 @@ AVAILABILITY_3 = {
     "end_time": int(avaliability_date3_finish_ue) * 1000,
 }
 
-avaliability_date4 = current_date + timedelta(4)
+# The day after, availabilities of a listing can't overlap
+avaliability_date4 = current_date + timedelta(5)
 avaliability_date4_start = avaliability_date4.strftime("%Y-%m-%d 10:00:00")
 avaliability_date4_finish = avaliability_date4.strftime("%Y-%m-%d 22:00:00")
 
@@ -283,6 +301,20 @@ def test_my_bookings():
     assert "upcoming" in response.json()["mybookings"].keys()
     assert "past" in response.json()["mybookings"].keys()
 
+    # Ask for a couple of fields only
+    response = requests.get(
+        booking_url,
+        params={"fields": "listing_name,start_time"},
+        headers={
+            "Authorization": f"JWT {consumer_token}",
+        },
+    )
+    assert response.status_code == 200
+    my_bookings = response.json()["mybookings"]
+    assert len(my_bookings["upcoming"]) > 0
+    for b in my_bookings["past"] + my_bookings["upcoming"]:
+        assert set(b.keys()) == {"booking_id", "listing_name", "start_time"}
+
 
 def test_must_not_have_more_than_10_booking_hours():
     # Register resouce owner
@@ -296,10 +328,18 @@ def test_must_not_have_more_than_10_booking_hours():
     # Resource owner creates a listing and availability
     listing_id = u.create_listing(LISTING2, owner_token)
 
-    # Owner creates 20 availabilities
+    # Owner creates 20 one hour availabilities on the same day, 10am is kept free
+    day = current_date + timedelta(2)
     availability_ids = [
-        u.create_availability(AVAILABILITY, listing_id, owner_token)
-        for i in range(0, 20)
+        u.create_availability(
+            {
+                "start_time": int((day + timedelta(hours=h)).strftime("%s")) * 1000,
+                "end_time": int((day + timedelta(hours=h + 1)).strftime("%s")) * 1000,
+            },
+            listing_id,
+            owner_token,
+        )
+        for h in [h for h in range(24) if h != 10][:20]
     ]
 
     # Consumer attempts to book a lot
@@ -369,3 +409,346 @@ def test_must_not_have_more_than_10_booking_hours():
 
     # I should just have 9 hours booked after all this
     assert auth_me_response.json()["hours_booked"] == 9
+
+
+def test_booking_hours_are_counted_per_year_and_month():
+    u.register_user(OWNER3)
+    u.register_user(CONSUMER3)
+    owner_token = u.login_user(OWNER3)
+    consumer_token = u.login_user(CONSUMER3)
+    listing_id = u.create_listing(
+        {**LISTING, "listing_name": "Krusty Krab's 3"}, owner_token
+    )
+
+    def slot(day, start_hour, end_hour):
+        return {
+            "start_time": int((day + timedelta(hours=start_hour)).strftime("%s"))
+            * 1000,
+            "end_time": int((day + timedelta(hours=end_hour)).strftime("%s")) * 1000,
+        }
+
+    soon = current_date + timedelta(10)
+    next_year = soon.replace(year=soon.year + 1, day=min(soon.day, 28))
+    long_slot = u.create_availability(slot(next_year, 9, 19), listing_id, owner_token)
+    extra_slot = u.create_availability(slot(next_year, 19, 20), listing_id, owner_token)
+    soon_slot = u.create_availability(slot(soon, 9, 10), listing_id, owner_token)
+
+    # 10 hours in the same month next year
+    response = u.create_booking_response(listing_id, long_slot, consumer_token)
+    assert response.status_code == 200
+
+    # They do not count towards the same month this year
+    response = u.create_booking_response(listing_id, soon_slot, consumer_token)
+    assert response.status_code == 200
+
+    # But they do fill up next year's month
+    response = u.create_booking_response(listing_id, extra_slot, consumer_token)
+    assert response.status_code == 403
+
+    # A bad update of a booked slot leaves the ledger and the database alone
+    response = requests.put(
+        f"{API_URL}/availabilities/{soon_slot}",
+        json={**slot(soon, 9, 12), "is_available": False},
+        headers={"Authorization": f"JWT {owner_token}"},
+    )
+    assert response.status_code == 400
+    hours = requests.get(
+        f"{API_URL}/auth/me", headers={"Authorization": f"JWT {consumer_token}"}
+    ).json()["hours_booked"]
+    assert hours == (1 if soon.month == current_date.month else 0)
+    u.register_user(
+        {**CONSUMER3, "username": "after_bad_put", "email": "after_bad_put@bob.com"}
+    )
+
+
+def test_concurrent_bookings_never_double_book():
+    owner = {**OWNER, "username": "stress_owner", "email": "stress_owner@test.com"}
+    consumers = [
+        {**CONSUMER, "username": f"stress_{i}", "email": f"stress_{i}@bob.com"}
+        for i in range(4)
+    ]
+    for user in [owner] + consumers:
+        u.register_user(user)
+    owner_token = u.login_user(owner)
+    consumer_tokens = [u.login_user(c) for c in consumers]
+    listing_id = u.create_listing(
+        {**LISTING, "listing_name": "Krusty Krab's Stress Test"}, owner_token
+    )
+    day = current_date + timedelta(12)
+    availability_ids = [
+        u.create_availability(
+            {
+                "start_time": int((day + timedelta(hours=h)).strftime("%s")) * 1000,
+                "end_time": int((day + timedelta(hours=h + 1)).strftime("%s")) * 1000,
+            },
+            listing_id,
+            owner_token,
+        )
+        for h in range(9, 14)
+    ]
+
+    # Every consumer goes for every slot at the same time
+    attempts = [(t, a) for t in consumer_tokens for a in availability_ids]
+    random.shuffle(attempts)
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=len(attempts)) as pool:
+        responses = list(
+            pool.map(
+                lambda attempt: (
+                    attempt[1],
+                    u.create_booking_response(listing_id, attempt[1], attempt[0]),
+                ),
+                attempts,
+            )
+        )
+    elapsed = time.time() - started
+    print(
+        f"{len(attempts)} concurrent booking requests, {len(attempts) / elapsed:.1f}/s"
+    )
+
+    booked = [a for a, r in responses if r.status_code == 200]
+    assert sorted(booked) == sorted(availability_ids)
+    assert all(r.status_code in [200, 409] for _, r in responses)
+
+    # Every slot ended up with exactly one booking
+    booked_slots = []
+    for token in consumer_tokens:
+        response = requests.get(
+            f"{API_URL}/bookings/mybookings", headers={"Authorization": f"JWT {token}"}
+        )
+        upcoming = response.json()["mybookings"]["upcoming"]
+        booked_slots += [b["availability_id"] for b in upcoming]
+    assert sorted(booked_slots) == sorted(availability_ids)
+
+
+def test_batch_booking():
+    owner = {**OWNER, "username": "batch_owner", "email": "batch_owner@test.com"}
+    consumer = {**CONSUMER, "username": "batch_consumer", "email": "batch@bob.com"}
+    u.register_user(owner)
+    u.register_user(consumer)
+    owner_token = u.login_user(owner)
+    consumer_token = u.login_user(consumer)
+    headers = {"Authorization": f"JWT {consumer_token}"}
+    listing_id = u.create_listing(
+        {**LISTING, "listing_name": "Krusty Krab's Batch"}, owner_token
+    )
+    # A weekly class for 4 weeks, 2 hours each
+    first_class = current_date + timedelta(14, hours=18)
+    class_ids = [
+        u.create_availability(
+            {
+                "start_time": int((first_class + timedelta(7 * w)).strftime("%s"))
+                * 1000,
+                "end_time": int(
+                    (first_class + timedelta(7 * w, hours=2)).strftime("%s")
+                )
+                * 1000,
+            },
+            listing_id,
+            owner_token,
+        )
+        for w in range(4)
+    ]
+    taken_id = class_ids[1]
+    u.create_booking_response(listing_id, taken_id, owner_token)
+
+    # One slot is gone, so nothing gets booked
+    response = requests.post(
+        f"{API_URL}/bookings/batch",
+        json={"availability_ids": class_ids + [999999]},
+        headers=headers,
+    )
+    assert response.status_code == 409
+    results = {r["availability_id"]: r for r in response.json()["results"]}
+    assert results[taken_id]["status"] == "failed"
+    assert results[999999]["status"] == "failed"
+    assert results[class_ids[0]]["status"] == "ok"
+    free = u.get_availabilities(listing_id, consumer_token)["availabilities"]
+    assert class_ids[0] in [a["availability_id"] for a in free if a["is_available"]]
+
+    # Ids that are not integers fail the batch
+    batch = [a for a in class_ids if a != taken_id]
+    response = requests.post(
+        f"{API_URL}/bookings/batch",
+        json={"availability_ids": batch + ["abc"]},
+        headers=headers,
+    )
+    assert response.status_code == 400
+    assert response.json()["results"][-1]["status"] == "failed"
+
+    # A slot someone else holds fails the batch and stays free for them
+    owner_headers = {"Authorization": f"JWT {owner_token}"}
+    response = requests.post(
+        f"{API_URL}/bookings/holds",
+        json={"availability_id": batch[0]},
+        headers=owner_headers,
+    )
+    hold_id = response.json()["hold_id"]
+    response = requests.post(
+        f"{API_URL}/bookings/batch",
+        json={"availability_ids": batch},
+        headers=headers,
+    )
+    assert response.status_code == 409
+    results = {r["availability_id"]: r for r in response.json()["results"]}
+    assert results[batch[0]]["status"] == "failed"
+    assert results[batch[1]]["status"] == "ok"
+    free = u.get_availabilities(listing_id, consumer_token)["availabilities"]
+    assert set(batch) <= {a["availability_id"] for a in free if a["is_available"]}
+    response = requests.delete(
+        f"{API_URL}/bookings/holds/{hold_id}", headers=owner_headers
+    )
+    assert response.status_code == 204
+
+    # The rest books in one go, ids sent as strings are fine
+    response = requests.post(
+        f"{API_URL}/bookings/batch",
+        json={"availability_ids": [str(a) for a in batch]},
+        headers=headers,
+    )
+    assert response.status_code == 200
+    bookings = response.json()["bookings"]
+    assert [b["availability_id"] for b in bookings] == batch
+    assert all(b["listing_id"] == listing_id for b in bookings)
+
+
+def test_booking_holds():
+    owner = {**OWNER, "username": "hold_owner", "email": "hold_owner@test.com"}
+    fast = {**CONSUMER, "username": "hold_fast", "email": "hold_fast@bob.com"}
+    slow = {**CONSUMER, "username": "hold_slow", "email": "hold_slow@bob.com"}
+    for user in [owner, fast, slow]:
+        u.register_user(user)
+    owner_token = u.login_user(owner)
+    slow_token = u.login_user(slow)
+    fast_headers = {"Authorization": f"JWT {u.login_user(fast)}"}
+    slow_headers = {"Authorization": f"JWT {slow_token}"}
+    listing_id = u.create_listing(
+        {**LISTING, "listing_name": "Krusty Krab's Holds"}, owner_token
+    )
+    day = current_date + timedelta(20)
+    slot_ids = [
+        u.create_availability(
+            {
+                "start_time": int((day + timedelta(hours=h)).strftime("%s")) * 1000,
+                "end_time": int((day + timedelta(hours=h + 1)).strftime("%s")) * 1000,
+            },
+            listing_id,
+            owner_token,
+        )
+        for h in [9, 10]
+    ]
+    holds_url = f"{API_URL}/bookings/holds"
+
+    # The first hold wins, everyone else is turned away before any booking work
+    response = requests.post(
+        holds_url, json={"availability_id": slot_ids[0]}, headers=fast_headers
+    )
+    assert response.status_code == 200
+    hold_id = response.json()["hold_id"]
+    response = requests.post(
+        holds_url, json={"availability_id": slot_ids[0]}, headers=slow_headers
+    )
+    assert response.status_code == 409
+    response = u.create_booking_response(listing_id, slot_ids[0], slow_token)
+    assert response.status_code == 409
+
+    # Confirming turns the hold into a booking, exactly once
+    response = requests.post(f"{holds_url}/{hold_id}/confirm", headers=fast_headers)
+    assert response.status_code == 200
+    assert response.json()["availability_id"] == slot_ids[0]
+    response = requests.post(f"{holds_url}/{hold_id}/confirm", headers=fast_headers)
+    assert response.status_code == 410
+
+    # An expired hold can be taken over
+    response = requests.post(
+        holds_url,
+        json={"availability_id": slot_ids[1], "ttl_seconds": 1},
+        headers=fast_headers,
+    )
+    assert response.status_code == 200
+    expired_hold_id = response.json()["hold_id"]
+    time.sleep(1.5)
+    response = requests.post(
+        holds_url, json={"availability_id": slot_ids[1]}, headers=slow_headers
+    )
+    assert response.status_code == 200
+    slow_hold_id = response.json()["hold_id"]
+    response = requests.post(
+        f"{holds_url}/{expired_hold_id}/confirm", headers=fast_headers
+    )
+    assert response.status_code == 410
+
+    # Releasing frees the slot straight away
+    response = requests.delete(f"{holds_url}/{slow_hold_id}", headers=slow_headers)
+    assert response.status_code == 204
+    response = requests.post(
+        holds_url, json={"availability_id": slot_ids[1]}, headers=fast_headers
+    )
+    assert response.status_code == 200
+    fast_hold_id = response.json()["hold_id"]
+
+    # Holds last between 1 second and the server maximum
+    for ttl_seconds in ["abc", 0, -5, 10 ** 6]:
+        response = requests.post(
+            holds_url,
+            json={"availability_id": slot_ids[1], "ttl_seconds": ttl_seconds},
+            headers=slow_headers,
+        )
+        assert response.status_code == 400
+
+    # Deleting the held slot drops its hold too
+    requests.delete(
+        f"{API_URL}/availabilities/{slot_ids[1]}",
+        headers={"Authorization": f"JWT {owner_token}"},
+    )
+    response = requests.post(
+        f"{holds_url}/{fast_hold_id}/confirm", headers=fast_headers
+    )
+    assert response.status_code == 410
+
+
+def test_my_bookings_pages():
+    owner = {**OWNER, "username": "pages_owner", "email": "pages_owner@test.com"}
+    consumer = {**CONSUMER, "username": "pages_consumer", "email": "pages@bob.com"}
+    u.register_user(owner)
+    consumer_id = u.register_user(consumer)
+    owner_token = u.login_user(owner)
+    consumer_token = u.login_user(consumer)
+    headers = {"Authorization": f"JWT {consumer_token}"}
+    listing_id = u.create_listing(
+        {**LISTING, "listing_name": "Krusty Krab's Pages"}, owner_token
+    )
+    slots = {}
+    for days in [-3, -2, 5, 6, 7]:
+        day = current_date + timedelta(days, hours=9)
+        availability_id = u.create_availability(
+            {
+                "start_time": int(day.strftime("%s")) * 1000,
+                "end_time": int((day + timedelta(hours=1)).strftime("%s")) * 1000,
+            },
+            listing_id,
+            owner_token,
+        )
+        u.create_booking(consumer_id, listing_id, availability_id, consumer_token)
+        slots[days] = availability_id
+
+    def all_pages(section):
+        seen = []
+        params = {"section": section, "page_size": 2}
+        while True:
+            response = requests.get(
+                f"{API_URL}/bookings/mybookings", params=params, headers=headers
+            )
+            assert response.status_code == 200
+            assert list(response.json()["mybookings"].keys()) == [section]
+            seen += [
+                b["availability_id"] for b in response.json()["mybookings"][section]
+            ]
+            cursor = response.json()["next_cursor"][section]
+            if cursor is None:
+                return seen
+            params[f"{section}_cursor"] = cursor
+
+    # Most recent past booking first, soonest upcoming booking first
+    assert all_pages("past") == [slots[-2], slots[-3]]
+    assert all_pages("upcoming") == [slots[5], slots[6], slots[7]]
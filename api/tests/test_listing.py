@@ -1,5 +1,6 @@
 import os
 
+import api.tests.utils as u
 import requests
 from api.models.default_listing_image import DEFAULT_LISTING_IMAGE
 
@@ -19,6 +20,16 @@ TEST_2_LISTING = {
     "description": "Great way to get coffee at UNSW",
 }
 
+TEST_SEARCH_LISTING = {
+    "listing_name": "Bagel Corner",
+    "address": "Randwick NSW 2031",
+    "category": "other",
+    "description": "Hot bagels every morning",
+}
+
+# A 1x1 gif
+TEST_IMAGE = "data:image/gif;base64,R0lGODdhAQABAPAAAP8AAAAAACwAAAAAAQABAAACAkQBADs="
+
 TEST_LISTING_USER = {
     "username": "test_listing_user",
     "email": "test_listing@test.com",
@@ -64,7 +75,7 @@ def test_create_listing():
     assert actual["address"] == TEST_LISTING["address"]
     assert actual["category"] == TEST_LISTING["category"].lower()
     assert actual["description"] == TEST_LISTING["description"]
-    assert actual["listing_image"] == DEFAULT_LISTING_IMAGE
+    assert actual["listing_image"] == u.image_url_of(DEFAULT_LISTING_IMAGE)
 
     # It must be zero at the start
     get_listing_url = f"{API_URL}/listings/{actual['listing_id']}"
@@ -93,7 +104,7 @@ def test_create_listing():
     assert actual["address"] == TEST_2_LISTING["address"]
     assert actual["category"] == TEST_2_LISTING["category"].lower()
     assert actual["description"] == TEST_2_LISTING["description"]
-    assert actual["listing_image"] == DEFAULT_LISTING_IMAGE
+    assert actual["listing_image"] == u.image_url_of(DEFAULT_LISTING_IMAGE)
 
     # Test delete
     listing_url = f"{API_URL}/listings/{actual['listing_id']}"
@@ -187,7 +198,14 @@ def test_search_resource():
     assert search_response_3.status_code == 200
     assert "listings" in actual_3.keys()
     assert len(actual_3["listings"]) == 1
-    assert actual_3["listings"][0]["listing_image"] == DEFAULT_LISTING_IMAGE
+    # Lists send the thumbnail instead of the full size image
+    assert (
+        actual_3["listings"][0]["listing_image"]
+        == actual_3["listings"][0]["listing_image_medium"]
+    )
+    assert actual_3["listings"][0]["listing_image"] != u.image_url_of(
+        DEFAULT_LISTING_IMAGE
+    )
 
     # Search for a listing by categories, should return nothing
     search_url_4 = (
@@ -203,3 +221,440 @@ def test_search_resource():
     assert search_response_4.status_code == 200
     assert "listings" in actual_4.keys()
     assert len(actual_4["listings"]) == 0
+
+
+def test_search_index_follows_updates():
+    token = u.login_user(TEST_LISTING_USER)
+    headers = {"Authorization": f"JWT {token}"}
+
+    listing_id = u.create_listing(TEST_SEARCH_LISTING, token)
+
+    # Prefix of a word in the description
+    search_response = requests.get(
+        f"{API_URL}/listings?search_query=bagel", headers=headers
+    )
+    assert search_response.status_code == 200
+    assert [l["listing_id"] for l in search_response.json()["listings"]] == [listing_id]
+
+    # The index must pick up the new description
+    requests.put(
+        f"{API_URL}/listings/{listing_id}",
+        json={**TEST_SEARCH_LISTING, "description": "Freshly ground espresso"},
+        headers=headers,
+    )
+    search_response = requests.get(
+        f"{API_URL}/listings?search_query=bagels", headers=headers
+    )
+    assert len(search_response.json()["listings"]) == 0
+    search_response = requests.get(
+        f"{API_URL}/listings?search_query=espresso", headers=headers
+    )
+    assert len(search_response.json()["listings"]) == 1
+
+    # And drop the listing once it is deleted
+    requests.delete(f"{API_URL}/listings/{listing_id}", headers=headers)
+    search_response = requests.get(
+        f"{API_URL}/listings?search_query=espresso", headers=headers
+    )
+    assert len(search_response.json()["listings"]) == 0
+
+
+def test_paginate_my_listings():
+    token = u.login_user(TEST_LISTING_USER)
+    headers = {"Authorization": f"JWT {token}"}
+    for name in ["Page Test C", "Page Test A", "Page Test B"]:
+        u.create_listing({**TEST_SEARCH_LISTING, "listing_name": name}, token)
+
+    url = f"{API_URL}/listings/mylistings"
+    everything = requests.get(url, headers=headers).json()
+    assert everything["next_cursor"] is None
+    expected_ids = sorted(l["listing_id"] for l in everything["mylistings"])
+    assert len(expected_ids) >= 3
+
+    # Walk through one listing at a time
+    for sort, key in [("listing_id", "listing_id"), ("listing_name", "listing_name")]:
+        seen = []
+        cursor = None
+        while True:
+            params = {"page_size": 1, "sort": sort}
+            if cursor:
+                params["cursor"] = cursor
+            page = requests.get(url, params=params, headers=headers).json()
+            assert len(page["mylistings"]) <= 1
+            seen += page["mylistings"]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert sorted(l["listing_id"] for l in seen) == expected_ids
+        assert [l[key] for l in seen] == sorted(l[key] for l in seen)
+
+    # Search pages the same way
+    search = requests.get(
+        f"{API_URL}/listings",
+        params={"search_query": "Page Test", "page_size": 2, "sort": "listing_name"},
+        headers=headers,
+    ).json()
+    assert [l["listing_name"] for l in search["listings"]] == [
+        "Page Test A",
+        "Page Test B",
+    ]
+    search = requests.get(
+        f"{API_URL}/listings",
+        params={
+            "search_query": "Page Test",
+            "page_size": 2,
+            "sort": "listing_name",
+            "cursor": search["next_cursor"],
+        },
+        headers=headers,
+    ).json()
+    assert [l["listing_name"] for l in search["listings"]] == ["Page Test C"]
+    assert search["next_cursor"] is None
+
+    # A cursor that was not handed out by the server is rejected
+    response = requests.get(url, params={"cursor": "not-a-cursor"}, headers=headers)
+    assert response.status_code == 400
+
+
+def test_listing_thumbnails():
+    token = u.login_user(TEST_LISTING_USER)
+    headers = {"Authorization": f"JWT {token}"}
+
+    response = requests.post(
+        f"{API_URL}/listings",
+        json={
+            **TEST_SEARCH_LISTING,
+            "listing_name": "Thumbnail Test",
+            "listing_image": TEST_IMAGE,
+        },
+        headers=headers,
+    )
+    created = response.json()
+    assert created["listing_image"] == u.image_url_of(TEST_IMAGE)
+    for variant in ["listing_image_small", "listing_image_medium"]:
+        assert created[variant] != created["listing_image"]
+        image_response = requests.get(created[variant])
+        assert image_response.status_code == 200
+        assert image_response.headers["Content-Type"] == "image/webp"
+
+    # The detail endpoint has the full size image, lists have the thumbnail
+    detail = requests.get(
+        f"{API_URL}/listings/{created['listing_id']}", headers=headers
+    ).json()
+    assert detail["listing_image"] == created["listing_image"]
+    search = requests.get(
+        f"{API_URL}/listings?search_query=Thumbnail", headers=headers
+    ).json()
+    assert search["listings"][0]["listing_image"] == created["listing_image_medium"]
+
+
+def test_listing_fields():
+    token = u.login_user(TEST_LISTING_USER)
+    headers = {"Authorization": f"JWT {token}"}
+
+    search = requests.get(
+        f"{API_URL}/listings",
+        params={"search_query": "Campus", "fields": "listing_name,avg_rating"},
+        headers=headers,
+    ).json()
+    assert len(search["listings"]) > 0
+    for l in search["listings"]:
+        assert set(l.keys()) == {"listing_id", "listing_name", "avg_rating"}
+
+    listing_id = search["listings"][0]["listing_id"]
+    detail = requests.get(
+        f"{API_URL}/listings/{listing_id}",
+        params={"fields": "listing_name"},
+        headers=headers,
+    ).json()
+    assert detail == {
+        "listing_id": listing_id,
+        "listing_name": search["listings"][0]["listing_name"],
+    }
+
+    # Unknown fields are rejected
+    response = requests.get(
+        f"{API_URL}/listings/{listing_id}",
+        params={"fields": "password_hash"},
+        headers=headers,
+    )
+    assert response.status_code == 400
+
+
+def test_search_cache():
+    token = u.login_user(TEST_LISTING_USER)
+    headers = {"Authorization": f"JWT {token}"}
+    params = {"search_query": "Lantern", "categories": "other"}
+
+    def search():
+        response = requests.get(f"{API_URL}/listings", params=params, headers=headers)
+        assert response.status_code == 200
+        return [l["listing_name"] for l in response.json()["listings"]]
+
+    def stats():
+        return requests.get(f"{API_URL}/listings/cache_stats", headers=headers).json()
+
+    before = search()
+    hits = stats()["hits"]
+    assert search() == before
+    assert stats()["hits"] == hits + 1
+
+    # Creating a listing invalidates the cached results
+    u.create_listing(
+        {
+            "listing_name": "Lantern Hall",
+            "address": "Sydney NSW 2000",
+            "category": "other",
+            "description": "Lit by lanterns",
+        },
+        token,
+    )
+    assert search() == before + ["Lantern Hall"]
+    assert stats()["misses"] > 0
+
+
+def test_search_facets():
+    token = u.login_user(TEST_LISTING_USER)
+    for name, category in [("Facet Pool", "sport"), ("Facet Clinic", "healthcare")]:
+        u.create_listing(
+            {
+                "listing_name": name,
+                "address": "Sydney NSW 2000",
+                "category": category,
+                "description": "Facet test listing",
+            },
+            token,
+        )
+
+    response = requests.get(
+        f"{API_URL}/listings",
+        params={"search_query": "Facet", "categories": "sport", "facets": "true"},
+        headers={"Authorization": f"JWT {token}"},
+    )
+    assert response.status_code == 200
+    actual = response.json()
+    assert [l["listing_name"] for l in actual["listings"]] == ["Facet Pool"]
+    # The counts ignore the category filter
+    assert actual["facets"]["categories"] == {
+        "entertainment": 0,
+        "sport": 1,
+        "accommodation": 0,
+        "healthcare": 1,
+        "other": 0,
+    }
+
+
+def test_search_relevance():
+    token = u.login_user(TEST_LISTING_USER)
+    headers = {"Authorization": f"JWT {token}"}
+    for name, address in [
+        ("Corner Studio", "1 Orchid Lane, Sydney NSW 2000"),
+        ("Orchid Studio", "2 Pitt Street, Sydney NSW 2000"),
+    ]:
+        u.create_listing(
+            {
+                "listing_name": name,
+                "address": address,
+                "category": "other",
+                "description": "A bright studio",
+            },
+            token,
+        )
+
+    # A match in the name outranks a match in the address
+    response = requests.get(
+        f"{API_URL}/listings", params={"search_query": "orchid"}, headers=headers
+    )
+    names = [l["listing_name"] for l in response.json()["listings"]]
+    assert names == ["Orchid Studio", "Corner Studio"]
+
+    # Page through the ranking one listing at a time
+    paged = []
+    params = {"search_query": "orchid", "page_size": 1}
+    while True:
+        page = requests.get(f"{API_URL}/listings", params=params, headers=headers)
+        assert page.status_code == 200
+        paged += [l["listing_name"] for l in page.json()["listings"]]
+        if page.json()["next_cursor"] is None:
+            break
+        params["cursor"] = page.json()["next_cursor"]
+    assert paged == names
+
+    # Relevance needs something to be relevant to
+    response = requests.get(
+        f"{API_URL}/listings", params={"sort": "relevance"}, headers=headers
+    )
+    assert response.status_code == 400
+
+
+def test_search_fuzzy():
+    token = u.login_user(TEST_LISTING_USER)
+    headers = {"Authorization": f"JWT {token}"}
+    listing_id = u.create_listing(
+        {
+            "listing_name": "Harbourside Gymnasium",
+            "address": "3 Wharf Road, Sydney NSW 2000",
+            "category": "sport",
+            "description": "Weights and classes",
+        },
+        token,
+    )
+
+    def search(query, match):
+        response = requests.get(
+            f"{API_URL}/listings",
+            params={"search_query": query, "match": match},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        return [l["listing_id"] for l in response.json()["listings"]]
+
+    # Typos only match in fuzzy mode
+    assert listing_id not in search("harbrside gymnasim", "exact")
+    assert listing_id in search("harbrside gymnasim", "fuzzy")
+    assert listing_id in search("wharf raod", "fuzzy")
+    assert listing_id not in search("zzqx", "fuzzy")
+
+    # The index follows renames
+    response = requests.put(
+        f"{API_URL}/listings/{listing_id}",
+        json={
+            "listing_name": "Riverside Pool",
+            "address": "3 Wharf Road, Sydney NSW 2000",
+            "category": "sport",
+            "description": "Lanes and classes",
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert listing_id not in search("harbrside gymnasim", "fuzzy")
+    assert listing_id in search("riversde pol", "fuzzy")
+
+    response = requests.get(
+        f"{API_URL}/listings",
+        params={"search_query": "pool", "match": "sounds-like"},
+        headers=headers,
+    )
+    assert response.status_code == 400
+
+
+def test_suggest():
+    token = u.login_user(TEST_LISTING_USER)
+    headers = {"Authorization": f"JWT {token}"}
+    listing_id = u.create_listing(
+        {
+            "listing_name": "Zephyr Climbing Wall",
+            "address": "Sydney NSW 2000",
+            "category": "sport",
+            "description": "Bouldering for all levels",
+        },
+        token,
+    )
+
+    def suggest(prefix):
+        response = requests.get(
+            f"{API_URL}/listings/suggest", params={"prefix": prefix}, headers=headers
+        )
+        assert response.status_code == 200
+        return response.json()["suggestions"]
+
+    expected = {"listing_id": listing_id, "listing_name": "Zephyr Climbing Wall"}
+    assert suggest("zeph") == [expected]
+    # Any word of the name can start the prefix
+    assert expected in suggest("Climbing w")
+    assert suggest("") == []
+
+    # Renames and deletes are picked up
+    response = requests.put(
+        f"{API_URL}/listings/{listing_id}",
+        json={
+            "listing_name": "Zenith Climbing Wall",
+            "address": "Sydney NSW 2000",
+            "category": "sport",
+            "description": "Bouldering for all levels",
+        },
+        headers=headers,
+    )
+    assert response.status_code == 200
+    assert suggest("zeph") == []
+    assert suggest("zenith") == [
+        {"listing_id": listing_id, "listing_name": "Zenith Climbing Wall"}
+    ]
+    requests.delete(f"{API_URL}/listings/{listing_id}", headers=headers)
+    assert suggest("zenith") == []
+
+
+def test_import_listings():
+    token = u.login_user(TEST_LISTING_USER)
+    headers = {"Authorization": f"JWT {token}"}
+
+    csv_body = "\n".join(
+        [
+            "Listing Name,Address,Category,Description",
+            'Import Court One,"1 Court St, Sydney NSW 2000",Sport,Hard court',
+            "Import Court Two,2 Court St,spaceship,Not a real category",
+            "Import Court One,3 Court St,Sport,Same name twice",
+            "Import Clinic,4 Clinic St,Healthcare,",
+        ]
+    )
+    response = requests.post(
+        f"{API_URL}/listings/import",
+        data=csv_body.encode("utf-8"),
+        headers={**headers, "Content-Type": "text/csv"},
+    )
+    assert response.status_code == 200
+    actual = response.json()
+    assert actual["created"] == 2
+    assert actual["failed"] == 2
+    assert [r["status"] for r in actual["results"]] == [
+        "created",
+        "failed",
+        "failed",
+        "created",
+    ]
+    listing_id = actual["results"][0]["listing_id"]
+    listing = requests.get(f"{API_URL}/listings/{listing_id}", headers=headers).json()
+    assert listing["listing_name"] == "Import Court One"
+    assert listing["category"] == "sport"
+    assert listing["username"] == TEST_LISTING_USER["username"]
+
+    # Imported listings are searchable straight away
+    response = requests.get(
+        f"{API_URL}/listings", params={"search_query": "import court"}, headers=headers
+    )
+    assert [l["listing_id"] for l in response.json()["listings"]] == [listing_id]
+
+    ndjson_body = "\n".join(
+        [
+            '{"listing_name": "Import Studio", "category": "entertainment"}',
+            "not json",
+            '{"listing_name": "Import Clinic", "category": "healthcare"}',
+        ]
+    )
+    response = requests.post(
+        f"{API_URL}/listings/import",
+        data=ndjson_body.encode("utf-8"),
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == ["created", "failed", "failed"]
+    assert results[2]["error"] == "A listing with this listing_name already exists"
+
+    # A body that breaks after the first chunk keeps the rows committed before it
+    ndjson_body = "\n".join(
+        f'{{"listing_name": "Import Locker {i:03}", "category": "other"}}'
+        for i in range(600)
+    ).encode("utf-8")
+    response = requests.post(
+        f"{API_URL}/listings/import",
+        data=ndjson_body + b"\n\xff\xfe not utf-8\n",
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    actual = response.json()
+    results = actual["results"]
+    assert actual["created"] >= 500
+    assert all(r["status"] == "created" for r in results[: actual["created"]])
+    assert results[-1]["status"] == "failed"
+    assert results[-1]["error"].startswith("Stopped reading the file here")
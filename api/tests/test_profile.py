@@ -1,3 +1,4 @@
+import base64
 import os
 
 import api.tests.utils as u
@@ -14,6 +15,8 @@ TEST_USER = {
     "user_description": "sport",
 }
 
+IMAGE_AVATAR = "data:image/gif;base64,R0lGODdhAQABAPAAAP8AAAAAACwAAAAAAQABAAACAkQBADs="
+
 UPDATE_USER = {
     "username": "test_user_profile",
     "email": "test_profile@test.com",
@@ -39,11 +42,22 @@ def test_profile():
     assert response.status_code == 200
     assert response.json()["username"] == TEST_USER["username"]
     assert response.json()["email"] == TEST_USER["email"]
-    assert response.json()["avatar"] == DEFAULT_AVATAR
+    assert response.json()["avatar"] == u.image_url_of(DEFAULT_AVATAR)
     assert response.json()["user_description"] == TEST_USER["user_description"]
     assert type(response.json()["followers"]) == list
     assert type(response.json()["followees"]) == list
     assert type(response.json()["user_id"]) == int
+    # The default svg avatar is only ever shown as an image
+    image_response = requests.get(response.json()["avatar"])
+    assert image_response.headers["Content-Disposition"] == "attachment"
+
+    # Ask for just the username
+    response = requests.get(url, params={"fields": "username"})
+    assert response.status_code == 200
+    assert response.json() == {
+        "user_id": response.json()["user_id"],
+        "username": TEST_USER["username"],
+    }
 
     # update the username with some avatar
     update_url = f"{API_URL}/profiles/{UPDATE_USER['username']}"
@@ -58,6 +72,41 @@ def test_profile():
     assert response.json()["avatar"] == UPDATE_USER["avatar"]
     assert response.json()["user_description"] == UPDATE_USER["user_description"]
 
+    # Uploaded images are stored once and handed back as a URL
+    response = requests.put(
+        update_url,
+        json={"avatar": IMAGE_AVATAR},
+        headers={"Authorization": f"JWT {token}"},
+    )
+    assert response.status_code == 200
+    avatar_url = response.json()["avatar"]
+    assert avatar_url == u.image_url_of(IMAGE_AVATAR)
+
+    image_response = requests.get(avatar_url)
+    assert image_response.status_code == 200
+    assert image_response.headers["Content-Type"] == "image/gif"
+    assert "immutable" in image_response.headers["Cache-Control"]
+    assert image_response.headers["X-Content-Type-Options"] == "nosniff"
+    assert image_response.content == base64.b64decode(IMAGE_AVATAR.split(",")[1])
+
+    # Revalidating with the ETag does not send the image again
+    image_response = requests.get(
+        avatar_url, headers={"If-None-Match": image_response.headers["ETag"]}
+    )
+    assert image_response.status_code == 304
+    assert image_response.content == b""
+
+    # Data URLs that aren't images are never served from the API's origin
+    for content_type in ["text/html", "image/svg+xml"]:
+        html_avatar = f"data:{content_type};base64,PHNjcmlwdD48L3NjcmlwdD4="
+        response = requests.put(
+            update_url,
+            json={"avatar": html_avatar},
+            headers={"Authorization": f"JWT {token}"},
+        )
+        assert response.status_code == 200
+        assert response.json()["avatar"] == html_avatar
+
     # A missing user should return a 404
     url = f"{API_URL}/profiles/unknown"
     response = requests.get(
@@ -102,6 +102,24 @@ def test_create_rating():
     # There should be 1 rating attached to this
     assert len(mylistings_response.json()["mylistings"][0]["ratings"]) == 1
 
+    # Search and profile listings must report the same rating
+    search_response = requests.get(
+        f"{API_URL}/listings?search_query=Ratings Test",
+        headers={
+            "Authorization": f"JWT {owner_token}",
+        },
+    )
+    searched = search_response.json()["listings"]
+    assert [l["avg_rating"] for l in searched] == [5.0]
+    assert searched[0]["ratings"][0]["username"] == CONSUMER["username"]
+    profile_response = requests.get(
+        f"{API_URL}/profiles/{OWNER['username']}/listings",
+        headers={
+            "Authorization": f"JWT {owner_token}",
+        },
+    )
+    assert profile_response.json()["mylistings"][0]["avg_rating"] == 5.0
+
     # Update the rating
     ratings_url = f"{API_URL}/ratings/{rating_id}"
     rating_payload_updated = {
@@ -125,6 +143,82 @@ def test_create_rating():
     assert actual["rating"] == rating_payload_updated["rating"]
     assert actual["comment"] == rating_payload_updated["comment"]
 
+    # The summary must now hold the updated rating
+    mylistings_response = requests.get(
+        url,
+        headers={
+            "Authorization": f"JWT {owner_token}",
+        },
+    )
+    assert mylistings_response.json()["mylistings"][0]["avg_rating"] == 3.0
+
+    # A bad rating is rejected without touching the summary
+    bad_rating_response = requests.put(
+        ratings_url,
+        json={**rating_payload_updated, "rating": 7},
+        headers={
+            "Authorization": f"JWT {consumer_token}",
+        },
+    )
+    assert bad_rating_response.status_code == 400
+
+    # Ratings sent as strings are fine
+    updated_rating_response = requests.put(
+        ratings_url,
+        json={**rating_payload_updated, "rating": "4"},
+        headers={
+            "Authorization": f"JWT {consumer_token}",
+        },
+    )
+    assert updated_rating_response.status_code == 200
+    assert updated_rating_response.json()["rating"] == 4
+    mylistings_response = requests.get(
+        url,
+        headers={
+            "Authorization": f"JWT {owner_token}",
+        },
+    )
+    assert mylistings_response.json()["mylistings"][0]["avg_rating"] == 4.0
+
     # Test delete
     delete_response = requests.delete(ratings_url)
     assert delete_response.status_code == 204
+    assert requests.delete(ratings_url).status_code == 404
+
+    # No ratings left, so back to zero
+    mylistings_response = requests.get(
+        url,
+        headers={
+            "Authorization": f"JWT {owner_token}",
+        },
+    )
+    assert mylistings_response.json()["mylistings"][0]["avg_rating"] == 0.0
+    assert len(mylistings_response.json()["mylistings"][0]["ratings"]) == 0
+
+    # Cancelling a rated booking takes its rating out of the summary
+    future_start = int((current_date + timedelta(5, hours=12)).strftime("%s")) * 1000
+    future_id = u.create_availability(
+        {"start_time": future_start, "end_time": future_start + 60 * 60 * 1000},
+        listing_id,
+        owner_token,
+    )
+    future_booking_id = u.create_booking(
+        consumer_user_id, listing_id, future_id, consumer_token
+    )
+    u.create_rating(
+        {**rating_payload, "booking_id": future_booking_id, "rating": 1},
+        consumer_token,
+    )
+    response = requests.delete(
+        f"{API_URL}/bookings/{future_booking_id}",
+        headers={"Authorization": f"JWT {consumer_token}"},
+    )
+    assert response.status_code == 204
+    mylistings_response = requests.get(
+        url,
+        headers={
+            "Authorization": f"JWT {owner_token}",
+        },
+    )
+    assert mylistings_response.json()["mylistings"][0]["avg_rating"] == 0.0
+    assert len(mylistings_response.json()["mylistings"][0]["ratings"]) == 0
@@ -1,3 +1,5 @@
+import base64
+import hashlib
 import os
 
 import requests
@@ -177,3 +179,9 @@ def create_follower(payload: dict, token: str):
     assert response.status_code == 200
     assert response.json()["influencer_user_id"] == payload["influencer_user_id"]
     return response
+
+
+def image_url_of(data_url: str) -> str:
+    # Images are served by the SHA-256 of their bytes
+    data = base64.b64decode(data_url.split(",", 1)[1])
+    return f"{API_URL}/images/{hashlib.sha256(data).hexdigest()}"
@@ -0,0 +1,240 @@
+import logging
+
+from api import db
+from api.models.availability import AvailabilityModel
+from api.models.booking import BookingModel
+from api.models.booking_hold import BookingHoldModel
+from api.utils.holds import now_ms
+from sqlalchemy import and_, tuple_
+from sqlalchemy.sql import text
+
+MINUTE_MS = 60 * 1000
+
+
+def slot_ms(start_time, end_time, slot_minutes):
+    """
+    :return: Length of one slot of an availability, the whole row unless it is a range
+    """
+    if slot_minutes:
+        return slot_minutes * MINUTE_MS
+    return end_time - start_time
+
+
+def check_slot_times(start_time, end_time, slot_minutes=None):
+    """
+    :raises ValueError: If end_time is not after start_time, or a range of start_time
+        to end_time can't be cut into slots of slot_minutes
+    """
+    if int(end_time) <= int(start_time):
+        raise ValueError("end_time must be after start_time")
+    if slot_minutes is None:
+        return
+    if int(slot_minutes) < 1:
+        raise ValueError("slot_minutes must be at least 1")
+    if (int(end_time) - int(start_time)) % (int(slot_minutes) * MINUTE_MS) != 0:
+        raise ValueError(
+            f"start_time to end_time is not a whole number of {slot_minutes} minute slots"
+        )
+
+
+def range_slots(start_time, end_time, slot_minutes, after=None):
+    """
+    The slots stored in one availability row
+    :param start_time: Start of the row in unix time ms
+    :param end_time: End of the row in unix time ms
+    :param slot_minutes: Length of its slots, None for a single slot
+    :param after: Only yield slots ending at or after this time
+    :return: Generator of (start_time, end_time)
+    """
+    length = slot_ms(start_time, end_time, slot_minutes)
+    start = start_time
+    if after is not None and after > start + length:
+        # Skip straight to the first slot still ending at or after `after`
+        start += (after - start - 1) // length * length
+    while start + length <= end_time:
+        if after is None or start + length >= after:
+            yield start, start + length
+        start += length
+
+
+def merge_runs(rows):
+    """
+    Merges adjacent free rows cut into slots of the same length
+    :param rows: list of (availability_id, start_time, end_time, slot_minutes),
+        sorted by start_time
+    :return: list of runs, each a list of the rows it merges
+    """
+    runs = []
+    for row in rows:
+        _, start_time, end_time, slot_minutes = row
+        if len(runs) > 0:
+            _, last_start, last_end, last_slot_minutes = runs[-1][-1]
+            if last_end == start_time and slot_ms(
+                last_start, last_end, last_slot_minutes
+            ) == slot_ms(start_time, end_time, slot_minutes):
+                runs[-1].append(row)
+                continue
+        runs.append([row])
+    return runs
+
+
+def split_range(a, start_time):
+    """
+    Cuts the slot starting at start_time out of a range, on db.session so the split
+    is undone if the booking made with it is rolled back. The range row becomes the
+    slot and what is left on either side is inserted as new rows.
+    :param a: The AvailabilityModel of the range
+    :param start_time: Start of the slot wanted, None for the first slot of the range
+    :return: availability_id of the slot, or None if the range changed in the meantime
+    :raises ValueError: If start_time is not the start of a slot of the range
+    """
+    length = a.slot_minutes * MINUTE_MS
+    if start_time is None:
+        start_time = a.start_time
+    try:
+        start_time = int(start_time)
+    except (TypeError, ValueError):
+        raise ValueError(
+            f"start_time {start_time} is not the start of a slot of availability_id {a.availability_id}"
+        )
+    if (
+        start_time < a.start_time
+        or start_time + length > a.end_time
+        or (start_time - a.start_time) % length != 0
+    ):
+        raise ValueError(
+            f"start_time {start_time} is not the start of a slot of availability_id {a.availability_id}"
+        )
+
+    # Only succeeds if the range is still whole, free and not held by anyone
+    result = db.session.execute(
+        text(
+            """
+            update availabilities
+            set start_time = :start_time, end_time = :end_time, slot_minutes = null
+            where
+                availability_id = :availability_id
+                and start_time = :range_start
+                and end_time = :range_end
+                and slot_minutes = :slot_minutes
+                and is_available = 1
+                and not exists (
+                    select 1
+                    from booking_holds as h
+                    where
+                        h.availability_id = availabilities.availability_id
+                        and h.expires_at > :now
+                )
+            """
+        ),
+        {
+            "availability_id": a.availability_id,
+            "start_time": start_time,
+            "end_time": start_time + length,
+            "range_start": a.start_time,
+            "range_end": a.end_time,
+            "slot_minutes": a.slot_minutes,
+            "now": now_ms(),
+        },
+    )
+    if result.rowcount != 1:
+        return None
+
+    rest = [(a.start_time, start_time), (start_time + length, a.end_time)]
+    rest = [
+        {
+            "listing_id": a.listing_id,
+            "start_time": start,
+            "end_time": end,
+            "is_available": True,
+            # A single slot is stored as a plain availability
+            "slot_minutes": a.slot_minutes if end - start > length else None,
+        }
+        for start, end in rest
+        if end > start
+    ]
+    if len(rest) > 0:
+        db.session.execute(AvailabilityModel.__table__.insert(), rest)
+    # The session still has the range loaded, it is now the slot
+    db.session.expire(a)
+    return a.availability_id
+
+
+def compact_availabilities(listing_ids):
+    """
+    Merges adjacent free availabilities of the same slot length into ranges
+    Slots that are booked or held are left alone
+    :param listing_ids: The listings to compact
+    :return: dict with the number of rows before and after, or None if some of the
+        rows were booked, held or changed while compacting, nothing is merged then
+    """
+    in_use = db.session.query(BookingModel.availability_id).union(
+        db.session.query(BookingHoldModel.availability_id)
+    )
+    rows = (
+        db.session.query(
+            AvailabilityModel.listing_id,
+            AvailabilityModel.availability_id,
+            AvailabilityModel.start_time,
+            AvailabilityModel.end_time,
+            AvailabilityModel.slot_minutes,
+        )
+        .filter(AvailabilityModel.listing_id.in_(listing_ids))
+        .filter(AvailabilityModel.is_available)
+        .filter(AvailabilityModel.start_time < AvailabilityModel.end_time)
+        .filter(~AvailabilityModel.availability_id.in_(in_use))
+        .order_by(AvailabilityModel.listing_id, AvailabilityModel.start_time)
+        .all()
+    )
+    by_listing = {}
+    for listing_id, *row in rows:
+        by_listing.setdefault(listing_id, []).append(tuple(row))
+
+    updates = []
+    deletes = []
+    for listing_rows in by_listing.values():
+        for run in merge_runs(listing_rows):
+            first_id, first_start, first_end, first_slot_minutes = run[0]
+            length = slot_ms(first_start, first_end, first_slot_minutes)
+            if len(run) < 2 or length % MINUTE_MS != 0:
+                continue
+            updates.append((run[0], run[-1][2], length // MINUTE_MS))
+            deletes.extend(
+                (availability_id, start, end)
+                for availability_id, start, end, _ in run[1:]
+            )
+
+    # Rows are only merged if they are still free, unchanged and not booked or held
+    # since they were read. The first write takes the database lock, so once every
+    # row matched nothing else can change them before the commit.
+    table = AvailabilityModel.__table__
+    unused = and_(table.c.is_available, ~table.c.availability_id.in_(in_use))
+    changed = 0
+    for (availability_id, start, end, slot_minutes), run_end, run_slot in updates:
+        changed += db.session.execute(
+            table.update()
+            .where(table.c.availability_id == availability_id)
+            .where(table.c.start_time == start)
+            .where(table.c.end_time == end)
+            .where(table.c.slot_minutes.isnot_distinct_from(slot_minutes))
+            .where(unused)
+            .values(end_time=run_end, slot_minutes=run_slot)
+        ).rowcount
+    for i in range(0, len(deletes), 500):
+        changed += db.session.execute(
+            table.delete()
+            .where(
+                tuple_(
+                    table.c.availability_id, table.c.start_time, table.c.end_time
+                ).in_(deletes[i : i + 500])
+            )
+            .where(unused)
+        ).rowcount
+    if changed != len(updates) + len(deletes):
+        db.session.rollback()
+        return None
+    db.session.commit()
+    logging.info(
+        f"Compacted {len(rows)} availabilities into {len(rows) - len(deletes)}"
+    )
+    return {"before": len(rows), "after": len(rows) - len(deletes)}
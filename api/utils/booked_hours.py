@@ -0,0 +1,135 @@
+from datetime import datetime
+
+from api import db
+from api.models.availability import AvailabilityModel
+from api.models.booking import BookingModel
+from api.models.user_month_hours import UserMonthHoursModel
+from sqlalchemy.sql import text
+
+# Most hours a user can book in a calendar month
+MAX_HOURS_PER_MONTH = 10
+
+
+def slot_hours(start_time, end_time):
+    """
+    Length of a slot in whole hours, the way it counts towards the monthly quota
+    :param start_time: Unix time in ms
+    :param end_time: Unix time in ms
+    """
+    return int(round((float(end_time) - float(start_time)) / (60.0 * 60.0 * 1000.0)))
+
+
+def month_of(start_time):
+    """
+    :param start_time: Unix time in ms, None means now
+    :return: (year, month) in server local time
+    """
+    if start_time is None:
+        dt = datetime.now()
+    else:
+        dt = datetime.fromtimestamp(start_time / 1000)
+    return dt.year, dt.month
+
+
+def get_booked_hours(user_id, start_time=None):
+    """
+    Hours a user has booked in a calendar month, a single row read
+    :param user_id: The user
+    :param start_time: Any unix time in ms inside the month, defaults to this month
+    """
+    year, month = month_of(start_time)
+    # A column query always goes to the database, so it sees writes made with text()
+    hours = (
+        db.session.query(UserMonthHoursModel.hours)
+        .filter_by(user_id=user_id, year=year, month=month)
+        .scalar()
+    )
+    return hours or 0
+
+
+def add_booked_hours(user_id, start_time, end_time, direction=1):
+    """
+    Adds (or with direction=-1 removes) a booked slot to the ledger of its month.
+    Runs on db.session so it commits with the booking itself.
+    :param user_id: The user who booked
+    :param start_time: Start of the slot in unix time ms
+    :param end_time: End of the slot in unix time ms
+    :param direction: 1 to add the slot, -1 to remove it
+    """
+    year, month = month_of(start_time)
+    params = {
+        "user_id": user_id,
+        "year": year,
+        "month": month,
+        "hours": direction * slot_hours(start_time, end_time),
+    }
+    db.session.execute(
+        text(
+            """
+            insert into user_month_hours (user_id, year, month)
+            values (:user_id, :year, :month)
+            on conflict (user_id, year, month) do nothing
+            """
+        ),
+        params,
+    )
+    db.session.execute(
+        text(
+            """
+            update user_month_hours
+            set hours = hours + :hours
+            where user_id = :user_id and year = :year and month = :month
+            """
+        ),
+        params,
+    )
+
+
+def get_booked_hours_by_month(user_id, months):
+    """
+    Hours a user has booked in several calendar months, in one query
+    :param user_id: The user
+    :param months: Iterable of (year, month)
+    :return: dict of (year, month) to hours
+    """
+    months = set(months)
+    out = {m: 0 for m in months}
+    if len(months) == 0:
+        return out
+    rows = (
+        db.session.query(
+            UserMonthHoursModel.year,
+            UserMonthHoursModel.month,
+            UserMonthHoursModel.hours,
+        )
+        .filter(UserMonthHoursModel.user_id == user_id)
+        .filter(UserMonthHoursModel.year.in_({y for y, _ in months}))
+    )
+    for year, month, hours in rows:
+        if (year, month) in out:
+            out[(year, month)] = hours
+    return out
+
+
+def remove_booked_hours(user_id, start_time, end_time):
+    add_booked_hours(user_id, start_time, end_time, direction=-1)
+
+
+def rebuild_booked_hours():
+    """Recomputes the whole ledger from bookings, e.g. after a bulk load."""
+    ledger = {}
+    slots = db.session.query(
+        BookingModel.user_id, AvailabilityModel.start_time, AvailabilityModel.end_time
+    ).join(
+        AvailabilityModel,
+        AvailabilityModel.availability_id == BookingModel.availability_id,
+    )
+    for user_id, start_time, end_time in slots:
+        key = (user_id, *month_of(start_time))
+        ledger[key] = ledger.get(key, 0) + slot_hours(start_time, end_time)
+    db.session.query(UserMonthHoursModel).delete()
+    db.session.add_all(
+        UserMonthHoursModel(user_id=user_id, year=year, month=month, hours=hours)
+        for (user_id, year, month), hours in ledger.items()
+    )
+    db.session.commit()
@@ -8,6 +8,8 @@ from api.models.booking import BookingModel
 from api.models.listing import ListingModel
 from api.models.rating import RatingModel
 from api.models.user import UserModel
+from api.utils.booked_hours import rebuild_booked_hours
+from api.utils.rating_summary import rebuild_rating_summary
 from faker import Faker
 import pandas as pd
 
@@ -114,6 +116,7 @@ def create_fake_bookings():
         bookings.append(b)
     db.session.add_all(bookings)
     db.session.commit()
+    rebuild_booked_hours()
 
 
 def create_fake_ratings():
@@ -126,11 +129,16 @@ def create_fake_ratings():
         rating = rating_data["rating"][random_index].astype(float)
         comment = rating_data["comment"][random_index]
         r = RatingModel(
-            user_id=user_id, booking_id=booking_id, rating=rating, comment=comment
+            user_id=user_id,
+            booking_id=booking_id,
+            listing_id=bookings[i].listing_id,
+            rating=rating,
+            comment=comment,
         )
         ratings.append(r)
     db.session.add_all(ratings)
     db.session.commit()
+    rebuild_rating_summary()
 
 
 def generate_fake_data():
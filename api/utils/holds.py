@@ -0,0 +1,149 @@
+import logging
+import threading
+import time
+import uuid
+
+from api import db
+from api.config import Config
+from api.models.booking_hold import BookingHoldModel
+from sqlalchemy.sql import text
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+def acquire_hold(availability_id, user_id, ttl_seconds):
+    """
+    Takes a hold on an availability with one conditional write. It succeeds if the
+    availability is still available and nobody else holds it, an expired hold is
+    simply taken over.
+    :param availability_id: The availability to hold
+    :param user_id: The user holding it
+    :param ttl_seconds: How long the hold lasts
+    :return: The hold as a dict, or None if the availability is taken or held
+    """
+    now = now_ms()
+    params = {
+        "availability_id": availability_id,
+        "hold_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "expires_at": now + ttl_seconds * 1000,
+        "now": now,
+    }
+    result = db.session.execute(
+        text(
+            """
+            insert into booking_holds (availability_id, hold_id, user_id, expires_at)
+            select availability_id, :hold_id, :user_id, :expires_at
+            from availabilities
+            where
+                availability_id = :availability_id
+                and is_available = 1
+                and slot_minutes is null
+            on conflict (availability_id) do update set
+                hold_id = excluded.hold_id,
+                user_id = excluded.user_id,
+                expires_at = excluded.expires_at
+            where booking_holds.expires_at <= :now
+            """
+        ),
+        params,
+    )
+    if result.rowcount != 1:
+        return None
+    return {
+        "hold_id": params["hold_id"],
+        "availability_id": availability_id,
+        "user_id": user_id,
+        "expires_at": params["expires_at"],
+    }
+
+
+def take_hold(hold_id, user_id):
+    """
+    Removes a live hold of a user so it can be turned into a booking
+    Runs on db.session, so the hold comes back if the booking is rolled back
+    :param hold_id: The hold
+    :param user_id: The user who has to own the hold
+    :return: The availability_id that was held, or None if the hold expired or is not theirs
+    """
+    hold = BookingHoldModel.query.filter_by(hold_id=hold_id, user_id=user_id).first()
+    if hold is None:
+        return None
+    result = db.session.execute(
+        text(
+            """
+            delete from booking_holds
+            where hold_id = :hold_id and user_id = :user_id and expires_at > :now
+            """
+        ),
+        {"hold_id": hold_id, "user_id": user_id, "now": now_ms()},
+    )
+    if result.rowcount != 1:
+        return None
+    return hold.availability_id
+
+
+def release_hold(hold_id, user_id):
+    """
+    :return: True if the user had that hold
+    """
+    result = db.session.execute(
+        text(
+            "delete from booking_holds where hold_id = :hold_id and user_id = :user_id"
+        ),
+        {"hold_id": hold_id, "user_id": user_id},
+    )
+    return result.rowcount == 1
+
+
+def sweep_expired_holds(batch_size=None):
+    """
+    Deletes expired holds a batch at a time so the write lock is only held briefly
+    :param batch_size: Holds per delete, defaults to Config.HOLD_SWEEP_BATCH
+    :return: The number of holds deleted
+    """
+    batch_size = batch_size or Config.HOLD_SWEEP_BATCH
+    deleted = 0
+    while True:
+        with db.engine.begin() as conn:
+            result = conn.execute(
+                text(
+                    """
+                    delete from booking_holds
+                    where availability_id in (
+                        select availability_id
+                        from booking_holds
+                        where expires_at <= :now
+                        limit :batch_size
+                    )
+                    """
+                ),
+                {"now": now_ms(), "batch_size": batch_size},
+            )
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
+def start_hold_sweeper(app):
+    """
+    Starts a daemon thread that sweeps expired holds every Config.HOLD_SWEEP_SECONDS
+    :param app: The flask app, the sweeper runs inside its app context
+    """
+
+    def sweep_forever():
+        with app.app_context():
+            while True:
+                time.sleep(Config.HOLD_SWEEP_SECONDS)
+                try:
+                    deleted = sweep_expired_holds()
+                    if deleted > 0:
+                        logging.info(f"Released {deleted} expired booking holds")
+                except Exception as e:
+                    logging.error(e)
+
+    sweeper = threading.Thread(target=sweep_forever, name="hold-sweeper", daemon=True)
+    sweeper.start()
+    return sweeper
@@ -0,0 +1,142 @@
+import io
+
+from PIL import Image
+
+from api import db
+from api.config import Config
+from api.models.image import (
+    DEFAULT_IMAGES,
+    ImageModel,
+    decode_data_url,
+    hash_image,
+    image_ref,
+    is_safe_image_type,
+    parse_image_ref,
+)
+from sqlalchemy import event
+from sqlalchemy.sql import text
+
+THUMBNAIL_CONTENT_TYPE = "image/webp"
+
+
+def store_image(value):
+    """
+    Moves an uploaded image into the images table and returns the reference to save
+    on the row instead of the payload.
+    - base64 data URLs are stored by their SHA-256, uploading the same image twice stores it once
+    - URLs handed out by this API (a client sending back what it got) keep pointing at the same image
+    - Anything else, including data URLs of other types than images, is kept as it is
+    Runs on db.session, so the image commits together with the row that uses it.
+    :param value: The listing_image or avatar sent by the client
+    :return: The value to store in the image column
+    """
+    ref, _ = _store_image(value)
+    return ref
+
+
+def store_listing_image(value):
+    """
+    Stores a listing image together with a small and a medium thumbnail of it.
+    Images that Pillow cannot read (or values that are not images) use themselves
+    as their thumbnails.
+    :param value: The listing_image sent by the client
+    :return: (listing_image, listing_image_small, listing_image_medium) to save on the listing
+    """
+    ref, data = _store_image(value)
+    image_hash = parse_image_ref(ref)
+    if image_hash is None:
+        return ref, ref, ref
+    if data is None:
+        image = ImageModel.query.get(image_hash)
+        if image is None:
+            return ref, ref, ref
+        data = image.data
+
+    thumbnails = make_thumbnails(data)
+    if thumbnails is None:
+        return ref, ref, ref
+    thumbnail_refs = {
+        variant: image_ref(insert_image(THUMBNAIL_CONTENT_TYPE, thumbnail))
+        for variant, thumbnail in thumbnails.items()
+    }
+    return ref, thumbnail_refs["small"], thumbnail_refs["medium"]
+
+
+def make_thumbnails(data):
+    """
+    Shrinks an image to fit in each of Config.THUMBNAIL_SIZES, keeping its aspect ratio
+    :param data: The image bytes
+    :return: dict of variant name to webp bytes, or None if the image can't be read (e.g. svg)
+    """
+    try:
+        source = Image.open(io.BytesIO(data))
+        source.load()
+    except Exception:
+        return None
+    if source.mode not in ("RGB", "RGBA"):
+        source = source.convert("RGBA")
+
+    thumbnails = {}
+    for variant, max_size in Config.THUMBNAIL_SIZES.items():
+        thumbnail = source.copy()
+        thumbnail.thumbnail((max_size, max_size))
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, format="WEBP", quality=80)
+        thumbnails[variant] = buffer.getvalue()
+    return thumbnails
+
+
+def insert_image(content_type, data):
+    """Adds an image to the images table on db.session unless it is already there"""
+    image_hash = hash_image(data)
+    db.session.execute(
+        text(
+            """
+            insert into images (image_hash, content_type, data)
+            values (:image_hash, :content_type, :data)
+            on conflict (image_hash) do nothing
+            """
+        ),
+        {"image_hash": image_hash, "content_type": content_type, "data": data},
+    )
+    return image_hash
+
+
+def _store_image(value):
+    decoded = decode_data_url(value)
+    if decoded is None:
+        existing_hash = parse_image_ref(value)
+        if existing_hash is not None:
+            return image_ref(existing_hash), None
+        return value, None
+
+    content_type, data = decoded
+    # Only served from /images/ if a browser can't run it, e.g. text/html or svg
+    if not is_safe_image_type(content_type):
+        return value, None
+    return image_ref(insert_image(content_type, data)), data
+
+
+# Thumbnails of the default listing image, created along with the images table
+DEFAULT_LISTING_THUMBNAILS = make_thumbnails(DEFAULT_IMAGES[0][1])
+DEFAULT_LISTING_IMAGE_SMALL_REF = image_ref(
+    hash_image(DEFAULT_LISTING_THUMBNAILS["small"])
+)
+DEFAULT_LISTING_IMAGE_MEDIUM_REF = image_ref(
+    hash_image(DEFAULT_LISTING_THUMBNAILS["medium"])
+)
+
+
+@event.listens_for(ImageModel.__table__, "after_create")
+def insert_default_thumbnails(target, connection, **kw):
+    connection.execute(
+        target.insert(),
+        [
+            {
+                "image_hash": hash_image(data),
+                "content_type": THUMBNAIL_CONTENT_TYPE,
+                "data": data,
+            }
+            for data in DEFAULT_LISTING_THUMBNAILS.values()
+        ],
+    )
@@ -0,0 +1,172 @@
+import csv
+import io
+import json
+import logging
+
+from api import db
+from api.config import Config
+from api.models.listing import ListingModel
+from api.search.listing_suggestions import listing_suggestions
+from api.search.search_cache import search_cache
+from api.search.trigram_index import index_listings
+
+IMPORT_FORMATS = ["csv", "ndjson"]
+
+# Fields of an imported listing, missing optional ones are stored as empty text
+IMPORT_FIELDS = ["listing_name", "address", "category", "description"]
+REQUIRED_IMPORT_FIELDS = ["listing_name", "category"]
+
+
+def read_listing_rows(stream, format):
+    """
+    Reads listings off a request body one row at a time, the body is never fully loaded
+    CSV files use the header of api/utils/listings.csv, "Listing Name" and
+    "listing_name" both work. NDJSON files have one JSON object per line.
+    :param stream: The binary request stream
+    :param format: One of IMPORT_FORMATS
+    :return: generator of (row number, dict of the row or an error message)
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if format == "csv":
+        for n, r in enumerate(csv.DictReader(text), start=1):
+            yield n, {_field_name(k): v for k, v in r.items() if k is not None}
+        return
+
+    for n, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            r = json.loads(line)
+        except ValueError:
+            yield n, "Row is not valid JSON"
+            continue
+        if not isinstance(r, dict):
+            yield n, "Row is not a JSON object"
+            continue
+        yield n, {_field_name(k): v for k, v in r.items()}
+
+
+def import_listings(rows, user, chunk_size=None):
+    """
+    Inserts listings chunk by chunk, rows that fail do not stop the others
+    Every chunk is committed on its own, when one fails its rows are reported as
+    failed and the chunks committed before it stay imported
+    :param rows: generator from read_listing_rows
+    :param user: The UserModel the listings belong to
+    :param chunk_size: Rows per insert, defaults to Config.IMPORT_CHUNK_SIZE
+    :return: list of per row results, sorted by row number
+    """
+    chunk_size = chunk_size or Config.IMPORT_CHUNK_SIZE
+    results = []
+    chunk = []
+    seen_names = set()
+    n = 0
+    try:
+        for n, row in rows:
+            if isinstance(row, str):
+                results.append(_failed(n, row))
+                continue
+            listing, error = validate_listing_row(row)
+            if error is None and listing["listing_name"] in seen_names:
+                error = "Duplicate listing_name in this import"
+            if error is not None:
+                results.append(_failed(n, error))
+                continue
+            seen_names.add(listing["listing_name"])
+            chunk.append((n, listing))
+            if len(chunk) >= chunk_size:
+                results += _insert_chunk(chunk, user)
+                chunk = []
+    except Exception as e:
+        # The rest of the body can't be read, e.g. it is not utf-8, keep what was read
+        logging.error(e)
+        results.append(_failed(n + 1, f"Stopped reading the file here: {e}"))
+    if len(chunk) > 0:
+        results += _insert_chunk(chunk, user)
+    return sorted(results, key=lambda r: r["row"])
+
+
+def validate_listing_row(row):
+    """
+    :param row: dict of one imported row
+    :return: (listing values, None) or (None, error message)
+    """
+    listing = {}
+    for field in IMPORT_FIELDS:
+        value = row.get(field)
+        if value is None or str(value).strip() == "":
+            if field in REQUIRED_IMPORT_FIELDS:
+                return None, f"Missing {field}"
+            value = ""
+        listing[field] = str(value).strip()
+    listing["category"] = listing["category"].lower()
+    if listing["category"] not in Config.CATEGORIES:
+        return None, f"Category must be one of {Config.CATEGORIES}"
+    return listing, None
+
+
+def _insert_chunk(chunk, user):
+    names = [listing["listing_name"] for _, listing in chunk]
+    taken = {
+        r.listing_name
+        for r in db.session.query(ListingModel.listing_name).filter(
+            ListingModel.listing_name.in_(names)
+        )
+    }
+
+    results = []
+    inserts = []
+    for n, listing in chunk:
+        if listing["listing_name"] in taken:
+            results.append(
+                _failed(n, "A listing with this listing_name already exists")
+            )
+        else:
+            inserts.append((n, listing))
+    if len(inserts) == 0:
+        return results
+
+    try:
+        # One executemany for the whole chunk
+        db.session.execute(
+            ListingModel.__table__.insert(),
+            [
+                {**listing, "user_id": user.user_id, "username": user.username}
+                for _, listing in inserts
+            ],
+        )
+        # listing_name is unique, so it gives back the ids of the new rows
+        listing_ids = dict(
+            db.session.query(ListingModel.listing_name, ListingModel.listing_id).filter(
+                ListingModel.listing_name.in_([l["listing_name"] for _, l in inserts])
+            )
+        )
+        created = [
+            {**l, "listing_id": listing_ids[l["listing_name"]]} for _, l in inserts
+        ]
+        index_listings(db.session.connection(), created)
+        db.session.commit()
+    except Exception as e:
+        logging.error(e)
+        db.session.rollback()
+        return results + [
+            _failed(n, f"Not imported, its chunk failed: {e}") for n, _ in inserts
+        ]
+
+    # Core inserts skip the session events, so patch the in-memory indexes here
+    search_cache.clear()
+    for l in created:
+        listing_suggestions.update(l["listing_id"], l["listing_name"], l["category"])
+    results += [
+        {"row": n, "status": "created", "listing_id": listing_ids[l["listing_name"]]}
+        for n, l in inserts
+    ]
+    return results
+
+
+def _failed(n, error):
+    return {"row": n, "status": "failed", "error": error}
+
+
+def _field_name(name):
+    return str(name).strip().lower().replace(" ", "_")
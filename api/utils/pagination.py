@@ -0,0 +1,53 @@
+import base64
+import json
+
+from api.config import Config
+from api.utils.req_handling import get_request_arg
+from flask_restplus import abort
+
+
+def encode_cursor(values):
+    """Packs the sort values of the last row on a page into an opaque cursor string."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("utf-8")
+
+
+def decode_cursor(cursor):
+    """Unpacks a cursor made by encode_cursor, throws a 400 if it was tampered with."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("utf-8")))
+    except Exception:
+        abort(400, "Query parameter 'cursor' malformed")
+    if not isinstance(values, list):
+        abort(400, "Query parameter 'cursor' malformed")
+    return values
+
+
+def get_page_args():
+    """
+    Reads the pagination query parameters
+    - page_size defaults to Config.PAGE_SIZE and can never go above Config.RESULT_LIMIT
+    - cursor is the next_cursor returned with the previous page, if any
+    :return: (page_size, cursor values or None)
+    """
+    page_size = get_request_arg("page_size", int, default=Config.PAGE_SIZE)
+    if page_size < 1:
+        abort(400, "Query parameter 'page_size' must be at least 1")
+    page_size = min(page_size, Config.RESULT_LIMIT)
+    cursor = get_request_arg("cursor")
+    if cursor:
+        cursor = decode_cursor(cursor)
+    return page_size, cursor
+
+
+def split_page(rows, page_size, cursor_of):
+    """
+    Queries fetch one row more than the page size so we know whether there is a next page
+    :param rows: The rows fetched, at most page_size + 1
+    :param page_size: The number of rows to return
+    :param cursor_of: Function from a row to the list of values the cursor holds
+    :return: (rows on this page, next cursor or None)
+    """
+    if len(rows) <= page_size:
+        return rows, None
+    page = rows[:page_size]
+    return page, encode_cursor(cursor_of(page[-1]))
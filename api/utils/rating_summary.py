@@ -0,0 +1,121 @@
+from api import db
+from api.models.booking import BookingModel
+from api.models.listing_rating_summary import ListingRatingSummaryModel
+from api.models.rating import RatingModel
+from sqlalchemy.sql import text
+
+RATING_VALUES = [1, 2, 3, 4, 5]
+
+
+def validate_rating(rating):
+    """Ratings feed the 1-5 histogram, so anything else is rejected. "5" counts as 5."""
+    try:
+        value = int(str(rating).strip())
+    except ValueError:
+        value = None
+    if value not in RATING_VALUES:
+        raise ValueError(f"rating must be one of {RATING_VALUES}, got {rating}")
+    return value
+
+
+def rated_listing_id(booking_id):
+    """
+    :param booking_id: The booking being rated
+    :return: listing_id of the booking, which the rating counts towards
+    :raises ValueError: If the booking does not exist
+    """
+    booking = BookingModel.query.get(booking_id)
+    if booking is None:
+        raise ValueError(f"booking_id {booking_id} not found")
+    return booking.listing_id
+
+
+def add_to_rating_summary(listing_id, rating, direction=1):
+    """
+    Adds (or with direction=-1 removes) one rating to the summary of a listing.
+    Runs on db.session so it commits with the rating itself.
+    :param listing_id: The listing that was rated
+    :param rating: The rating value from 1-5
+    :param direction: 1 to add the rating, -1 to remove it
+    """
+    rating = validate_rating(rating)
+    params = {
+        "listing_id": listing_id,
+        "rating": rating,
+        "direction": direction,
+    }
+    db.session.execute(
+        text(
+            """
+            insert into listing_rating_summary (listing_id)
+            values (:listing_id)
+            on conflict (listing_id) do nothing
+            """
+        ),
+        params,
+    )
+    # Every expression on the right reads the row as it was before the update
+    db.session.execute(
+        text(
+            f"""
+            update listing_rating_summary
+            set
+                rating_count = rating_count + :direction,
+                rating_sum = rating_sum + :direction * :rating,
+                rating_{rating}_count = rating_{rating}_count + :direction,
+                avg_rating = case
+                    when rating_count + :direction > 0
+                    then (rating_sum + :direction * :rating) * 1.0
+                        / (rating_count + :direction)
+                    else 0.0
+                end
+            where listing_id = :listing_id
+            """
+        ),
+        params,
+    )
+
+
+def remove_from_rating_summary(listing_id, rating):
+    add_to_rating_summary(listing_id, rating, direction=-1)
+
+
+def delete_booking_ratings(booking_id):
+    """
+    Deletes the ratings of a booking and takes them out of the listing summary, on
+    db.session so it commits with the cancellation of the booking
+    :param booking_id: The booking being cancelled
+    """
+    for r in RatingModel.query.filter_by(booking_id=booking_id):
+        listing_id = r.listing_id or rated_listing_id(booking_id)
+        remove_from_rating_summary(listing_id, r.rating)
+        db.session.delete(r)
+
+
+def rebuild_rating_summary():
+    """Recomputes the whole summary table from ratings, e.g. after a bulk load."""
+    histogram_columns = ", ".join(f"rating_{v}_count" for v in RATING_VALUES)
+    histogram_values = ", ".join(
+        f"sum(case when r.rating = {v} then 1 else 0 end)" for v in RATING_VALUES
+    )
+    db.session.query(ListingRatingSummaryModel).delete()
+    db.session.execute(
+        text(
+            f"""
+            insert into listing_rating_summary (
+                listing_id, rating_count, rating_sum, avg_rating, {histogram_columns}
+            )
+            select
+                coalesce(r.listing_id, b.listing_id),
+                count(*),
+                sum(r.rating),
+                avg(r.rating),
+                {histogram_values}
+            from ratings as r
+            join bookings as b
+                on b.booking_id = r.booking_id
+            group by coalesce(r.listing_id, b.listing_id)
+            """
+        )
+    )
+    db.session.commit()
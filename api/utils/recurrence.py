@@ -0,0 +1,111 @@
+import bisect
+from datetime import datetime, time, timedelta
+
+from api.config import Config
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+def parse_recurrence(content):
+    """
+    Validates a recurrence rule, for example weekdays 9-17 in 1h blocks for 3 months:
+    {
+        "start_date": <unix time in ms of the first day>,
+        "end_date": <unix time in ms of the last day>,
+        "weekdays": ["mon", "tue", "wed", "thu", "fri"],
+        "day_start": "09:00",
+        "day_end": "17:00",
+        "slot_minutes": 60
+    }
+    :param content: The request json
+    :return: dict of the parsed rule
+    :raises ValueError: With a message for the client when the rule is invalid
+    """
+    try:
+        start_date = datetime.fromtimestamp(int(content["start_date"]) / 1000).date()
+        end_date = datetime.fromtimestamp(int(content["end_date"]) / 1000).date()
+        day_start = _parse_time(content["day_start"])
+        day_end = _parse_time(content["day_end"])
+        slot_minutes = int(content["slot_minutes"])
+        weekdays = [str(d).lower()[:3] for d in content.get("weekdays", WEEKDAYS)]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(
+            "A recurrence needs start_date, end_date, day_start, day_end and slot_minutes"
+        )
+    if end_date < start_date:
+        raise ValueError("end_date is before start_date")
+    if day_end <= day_start:
+        raise ValueError("day_end must be after day_start")
+    if slot_minutes < 1:
+        raise ValueError("slot_minutes must be at least 1")
+    unknown = [d for d in weekdays if d not in WEEKDAYS]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown weekdays {unknown}, expected any of {WEEKDAYS}")
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "weekdays": {WEEKDAYS.index(d) for d in weekdays},
+        "day_start": day_start,
+        "day_end": day_end,
+        "slot_minutes": slot_minutes,
+    }
+
+
+def expand_recurrence(rule):
+    """
+    Turns a rule from parse_recurrence into its slots, a slot that would run past
+    day_end is left out
+    :param rule: The parsed rule
+    :return: list of (start_time, end_time) in unix time ms, sorted by start_time
+    :raises ValueError: If the rule makes more than Config.RECURRENCE_SLOT_LIMIT slots
+    """
+    slots = []
+    step = timedelta(minutes=rule["slot_minutes"])
+    day = rule["start_date"]
+    while day <= rule["end_date"]:
+        if day.weekday() in rule["weekdays"]:
+            start = datetime.combine(day, rule["day_start"])
+            day_end = datetime.combine(day, rule["day_end"])
+            while start + step <= day_end:
+                slots.append((_unix_ms(start), _unix_ms(start + step)))
+                start += step
+                if len(slots) > Config.RECURRENCE_SLOT_LIMIT:
+                    raise ValueError(
+                        f"A recurrence can make at most {Config.RECURRENCE_SLOT_LIMIT} slots"
+                    )
+        day += timedelta(days=1)
+    return slots
+
+
+def drop_overlapping(slots, existing):
+    """
+    Splits slots into the ones that are free and the ones overlapping existing slots
+    :param slots: list of (start_time, end_time) to add
+    :param existing: list of (start_time, end_time) already there, sorted by start_time
+    :return: (free slots, overlapping slots)
+    """
+    starts = [s for s, _ in existing]
+    # Latest end of the existing slots up to each position
+    max_ends = []
+    for _, end in existing:
+        max_ends.append(max(end, max_ends[-1]) if max_ends else end)
+
+    free = []
+    overlapping = []
+    for start, end in slots:
+        # Existing slots that start before this one ends overlap it if they end after it starts
+        i = bisect.bisect_left(starts, end)
+        if i > 0 and max_ends[i - 1] > start:
+            overlapping.append((start, end))
+        else:
+            free.append((start, end))
+    return free, overlapping
+
+
+def _parse_time(value):
+    hours, minutes = str(value).split(":")
+    return time(int(hours), int(minutes))
+
+
+def _unix_ms(dt):
+    return int(dt.timestamp()) * 1000
@@ -30,3 +30,28 @@ def get_request_arg(arg, type=str, required=False, default=None):
             return type(request.args[arg])
         except:
             abort(400, "Query parameter '{}' malformed".format(arg))
+
+
+def get_request_fields(allowed, always=()):
+    """Get the fields a client asked for with ?fields=a,b,c
+
+    - If fields is not provided, None is returned and every field should be sent.
+    - If a field is not in allowed, then a 400 error is thrown.
+    - Fields in always are sent whether they were asked for or not.
+    """
+    fields = get_request_arg("fields")
+    if fields is None:
+        return None
+    fields = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if len(unknown) > 0:
+        abort(400, "Unknown fields {}, expected any of {}".format(unknown, allowed))
+    # Keep the order but drop duplicates
+    return list(dict.fromkeys(list(always) + fields))
+
+
+def only_fields(data, fields):
+    """Drop everything but fields from a dict, fields=None keeps everything."""
+    if fields is None:
+        return data
+    return {f: data[f] for f in fields if f in data}